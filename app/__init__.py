@@ -2,6 +2,7 @@
 from flask import Flask
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 import os
 from urllib.parse import urlparse
@@ -15,19 +16,31 @@ migrate = Migrate()
 
 @login_manager.user_loader
 def load_user(user_id):
-    from .models import User  
-    return User.query.get(int(user_id))
+    from .auth import load_session_user
+    return load_session_user(user_id)
 
-def create_app():
+def create_app(test_config=None):
     from .config import AppConfig
 
     app = Flask(__name__, template_folder="templates")
     app.config.from_object("app.config.AppConfig")
+    if test_config:
+        app.config.from_mapping(test_config)
+
+    hops = app.config.get("TRUSTED_PROXY_HOPS")
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    from . import logs
+    logs.init_app(app)
 
     db_init_app(app) 
     login_manager.init_app(app)
     migrate.init_app(app, db)
 
+    from . import cache
+    cache.init_app(app)
+
     from . import models
     with app.app_context():
         AppConfig.init_app(app)
@@ -47,4 +60,29 @@ def create_app():
     from .controllers.payment.viva import payment as payment_blueprint
     app.register_blueprint(payment_blueprint, url_prefix="/payment")
 
+    from .controllers.api import api as api_blueprint
+    app.register_blueprint(api_blueprint)
+
+    from .controllers.delivery.delivery import delivery as delivery_blueprint
+    app.register_blueprint(delivery_blueprint)
+
+    from . import recommendations, inventory, pricing, promotions, ratelimit, jobs, orders, payments, archive, replicas, querycount, shipping, carriers, tracking, media, templating, settings
+    ratelimit.init_app(app)
+    recommendations.init_app(app)
+    inventory.init_app(app)
+    pricing.init_app(app)
+    promotions.init_app(app)
+    jobs.init_app(app)
+    orders.init_app(app)
+    payments.init_app(app)
+    archive.init_app(app)
+    replicas.init_app(app)
+    shipping.init_app(app)
+    carriers.init_app(app)
+    tracking.init_app(app)
+    media.init_app(app)
+    templating.init_app(app)
+    settings.init_app(app)
+    querycount.init_app(app)
+
     return app
\ No newline at end of file
@@ -0,0 +1,178 @@
+# app/archive.py
+import gzip
+import json
+import logging
+import zlib
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, text, update
+
+from .db import db
+from .models import (
+    ArchivedOrder, Order, OrderItem, OrderStatus, OrderStatusHistory, PromotionRedemption, StockMovement
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED_STATUSES = (OrderStatus.COMPLETED.value, OrderStatus.CANCELLED.value, OrderStatus.EXPIRED.value)
+BATCH_SIZE = 500
+
+
+def _row(obj):
+    row = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        row[column.name] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def _pack(document):
+    return zlib.compress(json.dumps(document, separators=(",", ":")).encode(), 9)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(data))
+
+
+def _months_back(now, months):
+    index = now.year * 12 + now.month - 1 - months
+    return now.replace(year=index // 12, month=index % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ensure_partitions(dates):
+    """Create the monthly archive partitions that ``dates`` fall into (PostgreSQL only)."""
+    if db.engine.dialect.name != "postgresql":
+        return
+    for year, mon in {(d.year, d.month) for d in dates}:
+        start = f"{year:04d}-{mon:02d}-01"
+        end = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01"
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS archived_orders_{year:04d}_{mon:02d} "
+            f"PARTITION OF archived_orders FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+
+
+def archive_orders(older_than_months, batch_size=BATCH_SIZE, export=None):
+    """
+    Move closed orders created more than ``older_than_months`` months ago
+    out of ``orders``/``order_items`` into ``archived_orders``, one batch
+    per transaction. Each batch costs a handful of set-based statements.
+    Ledger rows keep their history but lose the order link, because the
+    orders row they pointed at is deleted. ``export`` is an open text stream;
+    each archived order is also written to it as one JSON line.
+    Returns the number of orders archived.
+    """
+    cutoff = _months_back(datetime.utcnow(), older_than_months)
+    total = 0
+    while True:
+        batch = (
+            Order.query.filter(Order.status.in_(CLOSED_STATUSES), Order.created_at < cutoff)
+            .order_by(Order.created_at, Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        ids = [order.id for order in batch]
+
+        items, history, redemptions = {}, {}, {}
+        for target, model in ((items, OrderItem), (history, OrderStatusHistory), (redemptions, PromotionRedemption)):
+            for row in model.query.filter(model.order_id.in_(ids)).order_by(model.id):
+                target.setdefault(row.order_id, []).append(_row(row))
+
+        rows = []
+        for order in batch:
+            document = {
+                "order": _row(order),
+                "items": items.get(order.id, []),
+                "history": history.get(order.id, []),
+                "redemptions": redemptions.get(order.id, []),
+            }
+            if export is not None:
+                export.write(json.dumps(document, separators=(",", ":")) + "\n")
+            rows.append({
+                "id": order.id,
+                "created_at": order.created_at,
+                "user_id": order.user_id,
+                "status": order.status,
+                "payment_status": order.payment_status,
+                "total_cents": order.total_cents,
+                "item_count": sum(item["quantity"] for item in document["items"]),
+                "archived_at": datetime.utcnow(),
+                "data": _pack(document),
+            })
+
+        _ensure_partitions(order.created_at for order in batch)
+        db.session.execute(insert(ArchivedOrder), rows)
+        db.session.execute(
+            update(StockMovement).where(StockMovement.order_id.in_(ids)).values(order_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        for model in (OrderItem, OrderStatusHistory, PromotionRedemption):
+            model.query.filter(model.order_id.in_(ids)).delete(synchronize_session=False)
+        Order.query.filter(Order.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+        total += len(ids)
+        logger.info(f"Archived {total} orders so far")
+    return total
+
+
+def orders_for_user(user_id):
+    """
+    Hot and archived orders for one user, newest first. Both sides are
+    served by a (user_id, created_at) index; archived rows only expose the
+    summary columns, which is all the order list needs.
+    """
+    hot = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
+    archived = (
+        ArchivedOrder.query.with_entities(
+            ArchivedOrder.id, ArchivedOrder.created_at, ArchivedOrder.status,
+            ArchivedOrder.payment_status, ArchivedOrder.total_cents,
+        )
+        .filter_by(user_id=user_id)
+        .order_by(ArchivedOrder.created_at.desc())
+        .all()
+    )
+    if not archived:
+        return hot
+    return sorted(hot + archived, key=lambda order: order.created_at or datetime.min, reverse=True)
+
+
+def load_archived_order(order_id):
+    row = ArchivedOrder.query.filter_by(id=order_id).first()
+    return unpack(row.data) if row else None
+
+
+archive_cli = AppGroup("archive", help="Move closed orders out of the hot tables.")
+
+
+@archive_cli.command("orders")
+@click.option("--months", default=12, show_default=True, help="Archive closed orders older than this.")
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+@click.option("--export", "export_path", type=click.Path(dir_okay=False),
+              help="Also write the archived orders to this .jsonl.gz file.")
+def archive_orders_command(months, batch_size, export_path):
+    """Archive closed orders older than --months."""
+    if export_path:
+        with gzip.open(export_path, "at", encoding="utf-8") as export:
+            count = archive_orders(months, batch_size, export)
+    else:
+        count = archive_orders(months, batch_size)
+    click.echo(f"Archived {count} orders.")
+
+
+@archive_cli.command("show")
+@click.argument("order_id", type=int)
+def show_command(order_id):
+    """Print an archived order as JSON."""
+    document = load_archived_order(order_id)
+    if document is None:
+        raise click.ClickException(f"Archived order {order_id} not found.")
+    click.echo(json.dumps(document, indent=2))
+
+
+def init_app(app):
+    app.cli.add_command(archive_cli)
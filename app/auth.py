@@ -1,8 +1,8 @@
 # app/auth.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from .models import User, Order
-from . import db
+from . import cache, db, querycount, ratelimit
 from .db import db_transaction  # <-- NEW
 from werkzeug.security import generate_password_hash, check_password_hash
 import logging
@@ -11,8 +11,9 @@ from google_auth_oauthlib.flow import Flow
 from google.oauth2 import id_token
 from google.auth.transport import requests
 import pathlib
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 auth = Blueprint("auth", __name__)
@@ -29,8 +30,74 @@ SCOPES = [
 CLIENT_SECRETS_FILE = os.path.join(pathlib.Path(__file__).parent, "client_secret.json")
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
+# Loaded users live in the shared cache under a per-user tag, which a
+# committed change to the user invalidates for every worker; the TTL bounds
+# how stale a process-local cache backend can be.
+USER_CACHE_TTL = 30
+
+
+def _user_key(user_id, version):
+    return f"auth:user:{user_id}:{version}"
+
+
+def _user_tag(user_id):
+    return f"auth:user:{user_id}"
+
+
+def load_session_user(session_id):
+    """
+    Flask-Login user loader. The session id is "<user id>:<auth version>";
+    a hit in the shared cache skips the per-request users query. A session
+    whose auth version no longer matches the row is treated as logged out.
+    """
+    user_id, _, version = str(session_id).partition(":")
+    try:
+        user_id, version = int(user_id), int(version) if version else 1
+    except ValueError:
+        return None
+
+    def load():
+        user = User.query.get(user_id)
+        if user is None or (user.auth_version or 1) != version:
+            return None
+        # Detached so later commits in other requests can't expire the cached copy
+        db.session.expunge(user)
+        return user
+
+    ttl = current_app.config.get("USER_CACHE_TTL", USER_CACHE_TTL)
+    if not ttl:
+        return load()
+    return cache.get_cache().get_or_set(
+        _user_key(user_id, version), load, ttl, [_user_tag(user_id)], cache_if=lambda user: user is not None
+    )
+
+
+def invalidate_user(user_id):
+    """Drop every cached copy of the user, in all workers; commits of User rows do this themselves."""
+    cache.invalidate_tags([_user_tag(user_id)])
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_users_dirty(session, flush_context):
+    dirty = {obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)}
+    if dirty:
+        session.info.setdefault("users_dirty", set()).update(dirty)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    for user_id in session.info.pop("users_dirty", ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("users_dirty", None)
+
 
 @auth.route("/register", methods=["GET", "POST"])
+@querycount.query_budget(4)
+@ratelimit.limit("register", per_ip="5/minute", methods=("POST",))
 @db_transaction
 def register():
     if request.method == "POST":
@@ -58,6 +125,7 @@ def register():
 
 
 @auth.route("/admin/promote/<int:user_id>", methods=["POST"])
+@querycount.query_budget(4)
 @login_required
 @db_transaction
 def promote_to_admin(user_id):
@@ -66,11 +134,13 @@ def promote_to_admin(user_id):
         return redirect(url_for("shop.dashboard"))
     user = User.query.get_or_404(user_id)
     user.role = "admin"
+    user.auth_version = (user.auth_version or 1) + 1
     flash(f"User {user.email} promoted to admin.", "success")
     return redirect(url_for("shop.dashboard"))
 
 
 @auth.route("/google/callback")
+@querycount.query_budget(4)
 @db_transaction
 def google_callback():
     if request.args.get("state") != session.get("state"):
@@ -88,6 +158,7 @@ def google_callback():
     if not user:
         user = User(email=email, name=name, google_id=google_id, role="user")
         db.session.add(user)
+        db.session.flush()  # assigns the id that login_user stores in the session
     else:
         user.google_id = google_id
 
@@ -96,6 +167,7 @@ def google_callback():
     return redirect(url_for("shop.dashboard"))
 
 @auth.route("/google/login")
+@querycount.query_budget(1)
 def google_login():
     flow = Flow.from_client_secrets_file(CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri=GOOGLE_REDIRECT_URI)
     authorization_url, state = flow.authorization_url(access_type="offline", include_granted_scopes="true")
@@ -103,18 +175,26 @@ def google_login():
     return redirect(authorization_url)
     
 @auth.route("/login", methods=["GET", "POST"])
+@querycount.query_budget(3)
+@ratelimit.limit("login", per_ip="20/minute", per_account="5/minute",
+                 account=ratelimit.form_email, methods=("POST",))
+@db_transaction
 def login():
     if request.method == "POST":
         email, password = request.form.get("email"), request.form.get("password")
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password, password):
+        if user and user.check_password(password):
+            if user.password_needs_rehash():
+                user.set_password(password)
+                logger.info(f"Rehashed password for user {user.id} with {user.password.split('$', 1)[0]}")
             login_user(user)
             flash("Login successful!", "success")
-            return redirect(url_for("auth.dashboard"))
+            return redirect(url_for("shop.dashboard"))
         flash("Invalid email or password.", "error")
     return render_template("login.html")
 
 @auth.route("/logout")
+@querycount.query_budget(1)
 @login_required
 def logout():
     logout_user()
@@ -0,0 +1,467 @@
+# app/cache.py
+import hashlib
+import logging
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+LOCAL_MAX_ENTRIES = 10000
+# Single-flight: the worker computing a missing value holds a lock for at most
+# LOCK_TTL seconds (so a crashed holder frees it); the others poll the cache
+# for up to LOCK_WAIT seconds and then compute the value themselves.
+LOCK_TTL = 10
+LOCK_WAIT = 5
+LOCK_POLL = 0.02
+LOCK_STRIPES = 64
+
+
+class LocalCache:
+    """
+    Process-local LRU. The fastest backend, but every worker has its own copy
+    and only sees its own invalidations; cached objects are shared, not
+    copied, so callers must treat them as read-only.
+    """
+
+    name = "local"
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> {key}
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    self._drop(key)
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, mapping, ttl, tags=()):
+        expires = time.time() + ttl
+        tags = tuple(tags)
+        with self._lock:
+            for key, value in mapping.items():
+                self._drop(key)
+                self._entries[key] = (expires, value, tags)
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._drop(key)
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def acquire(self, key, ttl):
+        # Threads of this process are already serialised by Cache, and no
+        # other process can see the value anyway
+        return "local"
+
+    def release(self, key, token):
+        pass
+
+    def locked(self, key):
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+
+class SQLiteCache:
+    """
+    Entries in a SQLite file shared by every worker on the host. WAL mode lets
+    readers run alongside a writer, and the file is memory-mapped so a hit is
+    served from the page cache without read() calls. Values are pickled.
+    """
+
+    name = "sqlite"
+    PRUNE_PROBABILITY = 0.01
+    MMAP_SIZE = 256 * 1024 * 1024
+    # SQLite's default limit on bound parameters is 999 on older builds
+    CHUNK = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entry_tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key)) "
+            "WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_entry_tags_key ON entry_tags (key)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def _chunks(self, keys):
+        for start in range(0, len(keys), self.CHUNK):
+            chunk = keys[start:start + self.CHUNK]
+            yield chunk, ",".join("?" * len(chunk))
+
+    def get_many(self, keys):
+        conn = self._conn()
+        now = time.time()
+        found = {}
+        for chunk, marks in self._chunks(list(keys)):
+            rows = conn.execute(f"SELECT key, value FROM entries WHERE key IN ({marks}) AND expires > ?", (*chunk, now))
+            found.update((key, pickle.loads(value)) for key, value in rows)
+        return found
+
+    def _delete(self, conn, keys):
+        for chunk, marks in self._chunks(list(keys)):
+            conn.execute(f"DELETE FROM entries WHERE key IN ({marks})", chunk)
+            conn.execute(f"DELETE FROM entry_tags WHERE key IN ({marks})", chunk)
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            work(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def set_many(self, mapping, ttl, tags=()):
+        expires = time.time() + ttl
+        rows = [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires) for key, value in mapping.items()]
+
+        def work(conn):
+            self._delete(conn, mapping)
+            conn.executemany("INSERT INTO entries (key, value, expires) VALUES (?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_tags (tag, key) VALUES (?, ?)",
+                [(tag, key) for tag in tags for key in mapping],
+            )
+            if random.random() < self.PRUNE_PROBABILITY:
+                self._prune(conn)
+
+        self._transaction(work)
+
+    def _prune(self, conn):
+        now = time.time()
+        conn.execute("DELETE FROM entry_tags WHERE key IN (SELECT key FROM entries WHERE expires <= ?)", (now,))
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        conn.execute("DELETE FROM locks WHERE expires <= ?", (now,))
+
+    def delete_many(self, keys):
+        self._transaction(lambda conn: self._delete(conn, keys))
+
+    def invalidate_tags(self, tags):
+        def work(conn):
+            tagged = set()
+            for chunk, marks in self._chunks(list(tags)):
+                tagged.update(key for (key,) in conn.execute(
+                    f"SELECT key FROM entry_tags WHERE tag IN ({marks})", chunk))
+            self._delete(conn, tagged)
+
+        self._transaction(work)
+
+    def acquire(self, key, ttl):
+        now = time.time()
+        owner = uuid.uuid4().hex
+        # Takes the lock if it is free or its holder's time is up, atomically
+        cursor = self._conn().execute(
+            "INSERT INTO locks (key, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+            "WHERE locks.expires <= ?",
+            (key, owner, now + ttl, now),
+        )
+        return owner if cursor.rowcount == 1 else None
+
+    def release(self, key, token):
+        self._conn().execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, token))
+
+    def locked(self, key):
+        # A plain read, so waiters polling it do not contend for the write lock
+        row = self._conn().execute("SELECT 1 FROM locks WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row is not None
+
+    def clear(self):
+        def work(conn):
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM entry_tags")
+            conn.execute("DELETE FROM locks")
+
+        self._transaction(work)
+
+
+class RedisCache:
+    """Entries in Redis, shared by every host; tags are Redis sets of the keys they cover."""
+
+    name = "redis"
+    # Tag sets outlive the entries they list; stale members are harmless
+    TAG_TTL = 86400
+
+    INVALIDATE = """
+    for _, tag in ipairs(KEYS) do
+        local members = redis.call('SMEMBERS', tag)
+        for i = 1, #members, 500 do
+            redis.call('DEL', unpack(members, i, math.min(i + 499, #members)))
+        end
+        redis.call('DEL', tag)
+    end
+    return 1
+    """
+    RELEASE = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url, namespace="cache:"):
+        import redis  # optional dependency, only needed when configured
+
+        self.namespace = namespace
+        self._client = redis.Redis.from_url(url)
+        self._invalidate = self._client.register_script(self.INVALIDATE)
+        self._release = self._client.register_script(self.RELEASE)
+
+    def _key(self, key):
+        return f"{self.namespace}{key}"
+
+    def _tag(self, tag):
+        return f"{self.namespace}tag:{tag}"
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = self._client.mget([self._key(key) for key in keys]) if keys else []
+        return {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping, ttl, tags=()):
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=max(1, int(ttl * 1000)))
+        for tag in tags:
+            pipe.sadd(self._tag(tag), *(self._key(key) for key in mapping))
+            pipe.expire(self._tag(tag), max(int(ttl) + 1, self.TAG_TTL))
+        pipe.execute()
+
+    def delete_many(self, keys):
+        keys = [self._key(key) for key in keys]
+        if keys:
+            self._client.delete(*keys)
+
+    def invalidate_tags(self, tags):
+        tags = [self._tag(tag) for tag in tags]
+        if tags:
+            self._invalidate(keys=tags)
+
+    def acquire(self, key, ttl):
+        owner = uuid.uuid4().hex
+        taken = self._client.set(self._key(f"lock:{key}"), owner, nx=True, px=int(ttl * 1000))
+        return owner if taken else None
+
+    def release(self, key, token):
+        self._release(keys=[self._key(f"lock:{key}")], args=[token])
+
+    def locked(self, key):
+        return bool(self._client.exists(self._key(f"lock:{key}")))
+
+    def clear(self):
+        for key in self._client.scan_iter(f"{self.namespace}*", count=1000):
+            self._client.delete(key)
+
+
+class Cache:
+    """
+    What the rest of the app talks to: a backend plus a key prefix,
+    single-flight loading and fail-open error handling. A backend that is
+    down behaves as an empty cache, so the shop keeps working uncached.
+    """
+
+    def __init__(self, backend, prefix="", default_ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _call(self, operation, *args, default=None):
+        try:
+            return getattr(self.backend, operation)(*args)
+        except Exception as e:
+            logger.error(f"Cache {self.backend.name} {operation} failed: {e}")
+            return default
+
+    def get_many(self, keys):
+        prefixed = {f"{self.prefix}{key}": key for key in keys}
+        found = self._call("get_many", list(prefixed), default={})
+        return {prefixed[key]: value for key, value in found.items()}
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, mapping, ttl=None, tags=()):
+        if mapping:
+            self._call("set_many", {f"{self.prefix}{key}": value for key, value in mapping.items()},
+                       ttl or self.default_ttl, [f"{self.prefix}{tag}" for tag in tags])
+
+    def set(self, key, value, ttl=None, tags=()):
+        self.set_many({key: value}, ttl, tags)
+
+    def delete_many(self, keys):
+        keys = [f"{self.prefix}{key}" for key in keys]
+        if keys:
+            self._call("delete_many", keys)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def invalidate_tags(self, tags):
+        tags = [f"{self.prefix}{tag}" for tag in tags]
+        if tags:
+            self._call("invalidate_tags", tags)
+
+    def clear(self):
+        self._call("clear")
+
+    def get_or_set(self, key, producer, ttl=None, tags=(), cache_if=None):
+        """
+        The cached value of ``key``, or ``producer()``'s result, stored for
+        ``ttl`` seconds unless ``cache_if(result)`` is false. On a miss only
+        one thread in the process, and with a shared backend one worker on
+        the host (or cluster), runs the producer; the rest wait for its result
+        instead of stampeding the database or the remote API.
+        """
+        found = self.get_many([key])
+        if key in found:
+            return found[key]
+
+        with self._stripes[hash(key) % LOCK_STRIPES]:
+            found = self.get_many([key])
+            if key in found:
+                return found[key]
+
+            lock_key = f"{self.prefix}{key}"
+            token = self._call("acquire", lock_key, LOCK_TTL)
+            if token is None:
+                deadline = time.monotonic() + LOCK_WAIT
+                while token is None and time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL)
+                    found = self.get_many([key])
+                    if key in found:
+                        return found[key]
+                    # Released without a cached value (the producer failed or
+                    # declined to cache): take over rather than wait it out
+                    if not self._call("locked", lock_key, default=False):
+                        token = self._call("acquire", lock_key, LOCK_TTL)
+                if token is None:
+                    logger.warning(f"Gave up waiting for another worker to load {key}")
+            try:
+                value = producer()
+                if cache_if is None or cache_if(value):
+                    self.set(key, value, ttl, tags)
+                return value
+            finally:
+                if token is not None:
+                    self._call("release", lock_key, token)
+
+
+def create_backend(app):
+    url = app.config.get("CACHE_URL")
+    if url and url.startswith("redis"):
+        return RedisCache(url)
+    if url == "memory://":
+        return LocalCache(app.config.get("CACHE_LOCAL_MAX_ENTRIES", LOCAL_MAX_ENTRIES))
+    if url and url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+    else:
+        os.makedirs(app.instance_path, exist_ok=True)
+        path = os.path.join(app.instance_path, "cache.db")
+    return SQLiteCache(path)
+
+
+def get_cache():
+    return current_app.extensions["cache"]
+
+
+def invalidate_tags(tags):
+    """Invalidate ``tags`` if there is an app to do it for (session events also fire outside one)."""
+    if has_app_context() and "cache" in current_app.extensions:
+        get_cache().invalidate_tags(tags)
+
+
+cache_cli = AppGroup("cache", help="The shared cache.")
+
+
+@cache_cli.command("invalidate")
+@click.argument("tags", nargs=-1, required=True)
+def invalidate_command(tags):
+    """Drop every entry carrying one of TAGS (e.g. catalog, quotes, settings)."""
+    get_cache().invalidate_tags(tags)
+    click.echo(f"Invalidated {', '.join(tags)}.")
+
+
+@cache_cli.command("clear")
+def clear_command():
+    """Drop every entry, of every database sharing the backend."""
+    get_cache().clear()
+    click.echo(f"{get_cache().backend.name} cache cleared.")
+
+
+def init_app(app):
+    """
+    Set up before anything reads through the cache. Keys are prefixed with a
+    hash of the database URL, so apps on different databases can share one
+    backend (a development box, the benchmarks) without seeing each other's
+    entries.
+    """
+    database = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    prefix = app.config.get("CACHE_KEY_PREFIX") or hashlib.blake2b(database.encode(), digest_size=4).hexdigest() + ":"
+    app.extensions["cache"] = Cache(create_backend(app), prefix, app.config.get("CACHE_DEFAULT_TTL", DEFAULT_TTL))
+    app.cli.add_command(cache_cli)
@@ -0,0 +1,252 @@
+# app/carriers.py
+import importlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import requests
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+
+logger = logging.getLogger(__name__)
+
+# Modules that register a carrier when imported; CARRIER_PLUGINS replaces the list
+PLUGINS = (
+    "app.controllers.delivery.delivery_acs",
+    "app.controllers.delivery.delivery_geniki",
+)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 15
+# Keep-alive connections per carrier host, and threads for parallel carrier calls
+POOL_SIZE = 16
+SLOW_CALL_MS = 2000
+
+_carriers = {}
+_lock = threading.Lock()
+
+
+class CarrierError(Exception):
+    """A carrier call that failed; ``status`` is the HTTP status to answer the shop's client with."""
+
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+class Carrier:
+    """
+    A courier plugin. Subclasses set ``name`` (the key used by the registry,
+    the tracking table and the quote cache), ``label`` and ``delivery_days``
+    (shown to customers), and implement what the courier supports; the rest
+    raise NotImplementedError. All HTTP goes through ``self.transport``.
+    Failures raise CarrierError. ``blueprint`` optionally adds
+    carrier-specific endpoints under /delivery/<name>.
+    """
+    name = None
+    label = None
+    delivery_days = None
+    blueprint = None
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def quote(self, destination, weight_kg):
+        """Price in cents for a parcel of ``weight_kg`` to ``destination``."""
+        raise NotImplementedError
+
+    def create_voucher(self, shipment):
+        """
+        Book a shipment; ``shipment`` has order_id, recipient_name, address,
+        phone, zipcode, region, weight_kg and items. Returns ``(voucher_number,
+        job_id)``, job_id being None for carriers without one.
+        """
+        raise NotImplementedError
+
+    def track_one(self, voucher_number, job_id):
+        """``{"status", "job_status", "error"}`` for one voucher."""
+        raise NotImplementedError
+
+    def track(self, vouchers):
+        """
+        Status of many ``(voucher_number, job_id)`` pairs as ``{voucher_number:
+        {"status", "job_status", "error"}}``. By default one track_one call
+        per voucher, run in parallel on the shared transport.
+        """
+        def fetch(voucher):
+            voucher_number, job_id = voucher
+            try:
+                return voucher_number, self.track_one(voucher_number, job_id)
+            except (CarrierError, requests.exceptions.RequestException) as e:
+                return voucher_number, {"status": None, "job_status": None, "error": str(e)}
+
+        return dict(self.transport.map(fetch, vouchers))
+
+    def cancel(self, voucher_number):
+        raise NotImplementedError
+
+    def pickup_slots(self, pickup_date):
+        """Pickup times offered for ``pickup_date``, or None if the carrier has no such service."""
+        return None
+
+
+class Transport:
+    """
+    The HTTP client all carriers share: one requests.Session with pooled
+    keep-alive connections, (connect, read) timeouts on every call, one
+    thread pool for running carrier calls in parallel, and call counts and
+    latencies per carrier and operation. A new courier reuses all of it.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), slow_ms=SLOW_CALL_MS):
+        self.timeout = timeout
+        self.slow_ms = slow_ms
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="carriers")
+        self._stats_lock = threading.Lock()
+        self._stats = {}  # (carrier, operation) -> [calls, errors, total_ms, max_ms]
+
+    def request(self, carrier, operation, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self._record(carrier, operation, ms, failed)
+            if ms > self.slow_ms:
+                logger.warning(f"{carrier} {operation} took {ms:.0f} ms")
+
+    def get(self, carrier, operation, url, **kwargs):
+        return self.request(carrier, operation, "GET", url, **kwargs)
+
+    def post(self, carrier, operation, url, **kwargs):
+        return self.request(carrier, operation, "POST", url, **kwargs)
+
+    def map(self, fn, items):
+        """
+        ``[fn(item) ...]`` run on the shared pool, inside the caller's app
+        context if it has one. ``fn`` must not call map itself: nested calls
+        could wait on threads that are all busy waiting.
+        """
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def run(item):
+            if app is None:
+                return fn(item)
+            with app.app_context():
+                return fn(item)
+
+        return list(self._pool.map(run, items))
+
+    def _record(self, carrier, operation, ms, failed):
+        with self._stats_lock:
+            stats = self._stats.setdefault((carrier, operation), [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += failed
+            stats[2] += ms
+            stats[3] = max(stats[3], ms)
+
+    def metrics(self):
+        """One dict per carrier and operation: calls, errors, avg_ms and max_ms since start."""
+        with self._stats_lock:
+            return [
+                {"carrier": carrier, "operation": operation, "calls": calls, "errors": errors,
+                 "avg_ms": round(total / calls, 1), "max_ms": round(worst, 1)}
+                for (carrier, operation), (calls, errors, total, worst) in sorted(self._stats.items())
+            ]
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+
+def register(cls):
+    """Class decorator adding a Carrier subclass to the registry under its ``name``."""
+    _carriers[cls.name] = cls
+    return cls
+
+
+def transport():
+    return current_app.extensions["carriers"]["transport"]
+
+
+def get(name):
+    """The app's instance of carrier ``name``, created on first use; KeyError if unknown."""
+    state = current_app.extensions["carriers"]
+    carrier = state["instances"].get(name)
+    if carrier is None:
+        if name not in state["enabled"]:
+            raise KeyError(name)
+        with _lock:
+            carrier = state["instances"].get(name)
+            if carrier is None:
+                carrier = state["instances"][name] = _carriers[name](state["transport"])
+    return carrier
+
+
+def names():
+    """The carriers enabled for this app, in plugin order."""
+    return list(current_app.extensions["carriers"]["enabled"])
+
+
+carriers_cli = AppGroup("carriers", help="Delivery carriers.")
+
+
+@carriers_cli.command("list")
+def list_command():
+    """Enabled carriers."""
+    for name in names():
+        cls = _carriers[name]
+        click.echo(f"{name}\t{cls.label}\t{cls.__module__}")
+
+
+@carriers_cli.command("check")
+@click.option("--destination", default="Athens", show_default=True)
+@click.option("--weight", default=1.0, show_default=True, help="Parcel weight in kg.")
+def check_command(destination, weight):
+    """Ask every carrier for a quote, in parallel, and show the call metrics."""
+    def ask(name):
+        try:
+            return name, f"{get(name).quote(destination, weight)} cents"
+        except (CarrierError, NotImplementedError, requests.exceptions.RequestException) as e:
+            return name, f"error: {e or type(e).__name__}"
+
+    for name, answer in transport().map(ask, names()):
+        click.echo(f"{name}\t{answer}")
+    for row in transport().metrics():
+        click.echo(f"{row['carrier']}\t{row['operation']}\tcalls={row['calls']} errors={row['errors']} "
+                   f"avg_ms={row['avg_ms']} max_ms={row['max_ms']}")
+
+
+def init_app(app):
+    """
+    Create the shared transport (CARRIER_POOL_SIZE, CARRIER_CONNECT_TIMEOUT,
+    CARRIER_READ_TIMEOUT, CARRIER_SLOW_MS), import the carrier plugins and
+    mount their own endpoints under /delivery/<name>.
+    """
+    modules = app.config.get("CARRIER_PLUGINS") or PLUGINS
+    for module in modules:
+        importlib.import_module(module)
+    enabled = [cls for cls in _carriers.values() if cls.__module__ in modules]
+    app.extensions["carriers"] = {
+        "transport": Transport(
+            app.config.get("CARRIER_POOL_SIZE", POOL_SIZE),
+            (app.config.get("CARRIER_CONNECT_TIMEOUT", CONNECT_TIMEOUT),
+             app.config.get("CARRIER_READ_TIMEOUT", READ_TIMEOUT)),
+            app.config.get("CARRIER_SLOW_MS", SLOW_CALL_MS),
+        ),
+        "enabled": [cls.name for cls in enabled],
+        "instances": {},
+    }
+    for cls in enabled:
+        if cls.blueprint is not None:
+            app.register_blueprint(cls.blueprint, url_prefix=f"/delivery/{cls.name}")
+    app.cli.add_command(carriers_cli)
@@ -0,0 +1,138 @@
+# app/carts.py
+import logging
+
+from . import archive
+from .db import db
+from .models import Order, OrderItem
+from .pricing import cart_products
+
+logger = logging.getLogger(__name__)
+
+MAX_OPERATIONS = 100
+MAX_LINES = 100
+OPERATIONS = ("add", "set", "remove", "clear")
+
+
+class CartError(ValueError):
+    """A batch that cannot be applied; ``errors`` lists every problem found, not just the first."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(error["message"] for error in errors))
+        self.errors = errors
+
+
+def _quantity(value, minimum):
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError
+    return value
+
+
+def apply_operations(cart, operations):
+    """
+    Return a new session cart with ``operations`` applied in order:
+    ``{"op": "add", "product_id", "quantity"}`` adds to a line, ``set``
+    replaces its quantity (0 removes it), ``remove`` drops it and ``clear``
+    empties the cart. Nothing is looked up here; see ``validate``.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartError([{"index": None, "message": "operations must be a non-empty list"}])
+    if len(operations) > MAX_OPERATIONS:
+        raise CartError([{"index": None, "message": f"at most {MAX_OPERATIONS} operations per request"}])
+
+    quantities = {item["product_id"]: item["quantity"] for item in cart}
+    errors = []
+    for index, operation in enumerate(operations):
+        op = operation.get("op") if isinstance(operation, dict) else None
+        if op not in OPERATIONS:
+            errors.append({"index": index, "message": f"op must be one of {', '.join(OPERATIONS)}"})
+            continue
+        if op == "clear":
+            quantities.clear()
+            continue
+        product_id = operation.get("product_id")
+        if isinstance(product_id, bool) or not isinstance(product_id, int):
+            errors.append({"index": index, "message": "product_id must be an integer"})
+            continue
+        try:
+            if op == "add":
+                quantities[product_id] = quantities.get(product_id, 0) + _quantity(operation.get("quantity", 1), 1)
+            elif op == "set":
+                quantities[product_id] = _quantity(operation.get("quantity"), 0)
+            else:
+                quantities[product_id] = 0
+        except ValueError:
+            errors.append({"index": index, "product_id": product_id,
+                           "message": f"quantity must be a {'positive' if op == 'add' else 'non-negative'} integer"})
+    if errors:
+        raise CartError(errors)
+
+    new_cart = [{"product_id": pid, "quantity": qty} for pid, qty in quantities.items() if qty > 0]
+    if len(new_cart) > MAX_LINES:
+        raise CartError([{"index": None, "message": f"a cart holds at most {MAX_LINES} products"}])
+    return new_cart
+
+
+def validate(cart):
+    """
+    Check every line of ``cart`` against the catalogue with one query.
+    Returns the loaded products ({id: Product}) for pricing; raises
+    CartError listing each missing or under-stocked product.
+    """
+    products = cart_products(cart)
+    errors = []
+    for item in cart:
+        product = products.get(item["product_id"])
+        if product is None:
+            errors.append({"product_id": item["product_id"], "message": f"Product {item['product_id']} does not exist"})
+        elif item["quantity"] > product.stock:
+            errors.append({"product_id": product.id, "available": product.stock,
+                           "message": f"Only {product.stock} of {product.name} in stock"})
+    if errors:
+        raise CartError(errors)
+    return products
+
+
+def order_lines(order_id, user_id):
+    """
+    ``(product_id, quantity)`` lines of one of the user's orders, hot or
+    archived, or None if there is no such order.
+    """
+    owner = db.session.query(Order.user_id).filter(Order.id == order_id).scalar()
+    if owner is not None:
+        if owner != user_id:
+            return None
+        return db.session.query(OrderItem.product_id, OrderItem.quantity).filter(OrderItem.order_id == order_id).all()
+    document = archive.load_archived_order(order_id)
+    if document is None or document["order"]["user_id"] != user_id:
+        return None
+    return [(item["product_id"], item["quantity"]) for item in document["items"]]
+
+
+def reorder(cart, lines):
+    """
+    Add an earlier order's lines to ``cart``. Unlike a batch this is lenient:
+    lines whose product is gone are skipped and quantities are capped at the
+    current stock, so the customer gets as much of the order as possible.
+    Returns ``(new_cart, products, skipped)`` with one product query in all.
+    """
+    wanted = {}
+    for product_id, quantity in lines:
+        wanted[product_id] = wanted.get(product_id, 0) + quantity
+    current = {item["product_id"]: item["quantity"] for item in cart}
+    products = cart_products([{"product_id": pid} for pid in set(wanted) | set(current)])
+
+    skipped = []
+    for product_id, quantity in wanted.items():
+        product = products.get(product_id)
+        have = current.get(product_id, 0)
+        room = (product.stock - have) if product is not None else 0
+        if room <= 0:
+            skipped.append({"product_id": product_id, "requested": quantity, "added": 0})
+            continue
+        added = min(quantity, room)
+        if added < quantity:
+            skipped.append({"product_id": product_id, "requested": quantity, "added": added})
+        current[product_id] = have + added
+
+    new_cart = [{"product_id": pid, "quantity": qty} for pid, qty in current.items()]
+    return new_cart, products, skipped
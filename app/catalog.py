@@ -0,0 +1,186 @@
+# app/catalog.py
+import logging
+
+from flask import g, has_app_context
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session
+
+from . import cache
+from .db import db
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+# (label, lower bound inclusive, upper bound exclusive) in whole currency units –
+# the last band is open-ended
+PRICE_BANDS = [
+    ("0-25", 0, 25),
+    ("25-50", 25, 50),
+    ("50-100", 50, 100),
+    ("100-200", 100, 200),
+    ("200+", 200, None),
+]
+
+# The tree lives in the shared cache under CATALOG_TAG and is invalidated when
+# a catalog write commits; the TTL bounds how stale a process-local cache
+# backend can be after a write in another worker.
+CATEGORY_TREE_TTL = 300
+CATALOG_TAG = "catalog"
+
+
+def price_band_expr():
+    whens = [(Product.price_cents < hi * 100, label) for label, lo, hi in PRICE_BANDS if hi is not None]
+    return case(*whens, else_=PRICE_BANDS[-1][0])
+
+
+def band_bounds(label):
+    for band_label, lo, hi in PRICE_BANDS:
+        if band_label == label:
+            return lo, hi
+    return None
+
+
+def _build_category_tree():
+    counts = dict(
+        db.session.query(Product.category_id, func.count(Product.id))
+        .group_by(Product.category_id)
+        .all()
+    )
+    rows = db.session.query(Category.id, Category.name, Category.parent_id).order_by(Category.name).all()
+
+    nodes = {
+        row.id: {
+            "id": row.id,
+            "name": row.name,
+            "parent_id": row.parent_id,
+            "count": counts.get(row.id, 0),
+            "children": [],
+        }
+        for row in rows
+    }
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node["parent_id"])
+        (parent["children"] if parent else roots).append(node)
+
+    def rollup(node):
+        node["total"] = node["count"] + sum(rollup(child) for child in node["children"])
+        return node["total"]
+
+    for root in roots:
+        rollup(root)
+    logger.debug("Category tree rebuilt (%d categories)", len(nodes))
+    return {"roots": roots, "nodes": nodes}
+
+
+def get_category_tree():
+    """
+    Category tree with per-category product counts (own + descendants).
+    Built with two queries by one worker at a time and kept in the shared
+    cache until a Category/Product write is committed or the TTL expires;
+    within a request it is read from the cache once.
+    """
+    if "category_tree" not in g:
+        g.category_tree = cache.get_cache().get_or_set(
+            "catalog:category_tree", _build_category_tree, CATEGORY_TREE_TTL, [CATALOG_TAG]
+        )
+    return g.category_tree
+
+
+def invalidate_category_tree():
+    cache.invalidate_tags([CATALOG_TAG])
+    if has_app_context():
+        g.pop("category_tree", None)
+
+
+def descendant_ids(category_id, tree=None):
+    tree = tree or get_category_tree()
+    node = tree["nodes"].get(category_id)
+    if node is None:
+        return [category_id]
+    ids, stack = [], [node]
+    while stack:
+        current = stack.pop()
+        ids.append(current["id"])
+        stack.extend(current["children"])
+    return ids
+
+
+def filter_products(query, category_id=None, band=None):
+    if category_id:
+        query = query.filter(Product.category_id.in_(descendant_ids(category_id)))
+    bounds = band_bounds(band) if band else None
+    if bounds:
+        lo, hi = bounds
+        query = query.filter(Product.price_cents >= lo * 100)
+        if hi is not None:
+            query = query.filter(Product.price_cents < hi * 100)
+    return query
+
+
+def facet_counts(query, category_id=None, band=None):
+    """
+    Category and price-band facet counts for the products matched by ``query``
+    (search filters only). One grouped query returns the category × band
+    cross-tab; each facet is then counted with the *other* facet applied, so
+    selecting a category narrows the band counts and vice versa.
+    """
+    band_col = price_band_expr().label("band")
+    rows = (
+        query.with_entities(Product.category_id, band_col, func.count(Product.id))
+        .order_by(None)
+        .group_by(Product.category_id, band_col)
+        .all()
+    )
+
+    tree = get_category_tree()
+    selected = set(descendant_ids(category_id, tree)) if category_id else None
+
+    own_counts = {}
+    band_counts = {label: 0 for label, _, _ in PRICE_BANDS}
+    for cat_id, band_label, n in rows:
+        if band is None or band_label == band:
+            own_counts[cat_id] = own_counts.get(cat_id, 0) + n
+        if selected is None or cat_id in selected:
+            band_counts[band_label] += n
+
+    category_counts = {}
+
+    def rollup(node):
+        total = own_counts.get(node["id"], 0) + sum(rollup(child) for child in node["children"])
+        if total:
+            category_counts[node["id"]] = total
+        return total
+
+    for root in tree["roots"]:
+        rollup(root)
+
+    return {"categories": category_counts, "price_bands": band_counts}
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_catalog_dirty(session, flush_context):
+    if session.info.get("catalog_dirty"):
+        return
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (Category, Product)):
+            session.info["catalog_dirty"] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, Category):
+            session.info["catalog_dirty"] = True
+            return
+        if isinstance(obj, Product) and inspect(obj).attrs.category_id.history.has_changes():
+            session.info["catalog_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("catalog_dirty", False):
+        invalidate_category_tree()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("catalog_dirty", None)
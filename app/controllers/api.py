@@ -0,0 +1,356 @@
+# app/controllers/api.py
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, abort, current_app, request, session
+from flask_login import current_user
+from sqlalchemy import and_, or_
+from werkzeug.exceptions import HTTPException
+
+from app.db import db
+from app.models import ArchivedOrder, Order, OrderItem, Product
+from app import archive, carts, catalog, pricing, querycount, ratelimit, replicas, shipping
+
+try:
+    import orjson  # optional: several times faster than json for large listings
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Listings select only the requested columns (never whole ORM objects), so
+# ?fields= shrinks both the payload and the query.
+PRODUCT_FIELDS = {
+    "id": Product.id,
+    "name": Product.name,
+    "description": Product.description,
+    "price_cents": Product.price_cents,
+    "stock": Product.stock,
+    "category_id": Product.category_id,
+    "weight_grams": Product.weight_grams,
+    "updated_at": Product.updated_at,
+}
+DEFAULT_PRODUCT_FIELDS = ("id", "name", "price_cents", "stock", "category_id")
+PRODUCT_SORTS = {
+    "id": (Product.id, False),
+    "name": (Product.name, False),
+    "price-asc": (Product.price_cents, False),
+    "price-desc": (Product.price_cents, True),
+}
+
+# Order listings span the hot and the archive table, so only their shared summary columns
+ORDER_FIELDS = ("id", "created_at", "status", "payment_status", "total_cents")
+ORDER_DETAIL_FIELDS = (
+    "id", "created_at", "status", "payment_status", "subtotal_cents", "discount_cents", "tax_cents",
+    "shipping_cents", "total_cents", "payment_method", "shipping_address", "shipping_zipcode", "shipping_region",
+)
+ORDER_ITEM_FIELDS = ("product_id", "quantity", "unit_price_cents")
+CART_TOTALS = ("subtotal_cents", "discount_cents", "tax_cents", "shipping_cents", "total_cents")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), default=_json_default).encode()
+
+
+def respond(data, status=200, private=False):
+    """
+    JSON response. Successful GETs carry an ETag over the body, so a client
+    sending If-None-Match gets an empty 304 when nothing changed.
+    """
+    response = current_app.response_class(dumps(data), status=status, mimetype="application/json")
+    if request.method == "GET" and status == 200:
+        response.headers["Cache-Control"] = "private, no-cache" if private else "no-cache"
+        response.add_etag()
+        response = response.make_conditional(request)
+    return response
+
+
+@api.errorhandler(HTTPException)
+def _http_error(e):
+    return respond({"error": e.name.lower().replace(" ", "_"), "message": e.description}, e.code)
+
+
+def login_required(f):
+    """Like flask_login's, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return respond({"error": "unauthorized", "message": "Log in first."}, 401)
+        return f(*args, **kwargs)
+    return decorated
+
+
+def requested_fields(available, default):
+    raw = request.args.get("fields")
+    if not raw:
+        return list(default)
+    names = list(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, description=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return names
+
+
+def requested_limit():
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(dumps(values)).rstrip(b"=").decode()
+
+
+def decode_cursor(size):
+    raw = request.args.get("cursor")
+    if not raw:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+    except (binascii.Error, ValueError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        abort(400, description="Invalid cursor.")
+    return values
+
+
+def after(column, descending, value, id_column, last_id):
+    """Keyset condition for rows after ``(value, last_id)`` in ``column`` order, ties broken by id."""
+    if column is id_column:
+        return id_column < last_id if descending else id_column > last_id
+    beyond = column < value if descending else column > value
+    return or_(beyond, and_(column == value, id_column > last_id))
+
+
+@api.route("/products")
+@querycount.query_budget(3)
+@replicas.read_only
+def products():
+    fields = requested_fields(PRODUCT_FIELDS, DEFAULT_PRODUCT_FIELDS)
+    sort = request.args.get("sort", "id")
+    if sort not in PRODUCT_SORTS:
+        abort(400, description=f"sort must be one of {', '.join(PRODUCT_SORTS)}.")
+    sort_column, descending = PRODUCT_SORTS[sort]
+    limit = requested_limit()
+
+    columns = [PRODUCT_FIELDS[name].label(name) for name in fields]
+    columns += [Product.id.label("_id"), sort_column.label("_sort")]
+    query = db.session.query(*columns)
+    search = request.args.get("search")
+    if search:
+        query = query.filter(Product.name.ilike(f"%{search}%"))
+    query = catalog.filter_products(
+        query, category_id=request.args.get("category_id", type=int), band=request.args.get("band") or None,
+    )
+    cursor = decode_cursor(2)
+    if cursor:
+        query = query.filter(after(sort_column, descending, cursor[0], Product.id, cursor[1]))
+    query = query.order_by(sort_column.desc() if descending else sort_column.asc())
+    if sort_column is not Product.id:
+        query = query.order_by(Product.id.asc())
+    rows = query.limit(limit + 1).all()
+
+    page = rows[:limit]
+    next_cursor = encode_cursor([page[-1]._sort, page[-1]._id]) if len(rows) > limit else None
+    return respond({
+        "data": [{name: row._mapping[name] for name in fields} for row in page],
+        "next_cursor": next_cursor,
+    })
+
+
+@api.route("/products/<int:product_id>")
+@querycount.query_budget(2)
+@replicas.read_only
+def product(product_id):
+    fields = requested_fields(PRODUCT_FIELDS, PRODUCT_FIELDS)
+    row = (
+        db.session.query(*(PRODUCT_FIELDS[name].label(name) for name in fields))
+        .filter(Product.id == product_id)
+        .first()
+    )
+    if row is None:
+        abort(404, description=f"Product {product_id} not found.")
+    return respond(dict(row._mapping))
+
+
+@api.route("/categories")
+@querycount.query_budget(3)
+@replicas.read_only
+def categories():
+    # Served from the in-memory category tree; nodes nest their children
+    return respond({"data": catalog.get_category_tree()["roots"]})
+
+
+def cart_payload(cart, products=None):
+    """Price a session cart and shape it for the API: lines, totals, promotions and weight."""
+    products = pricing.cart_products(cart) if products is None else products
+    lines = [
+        (products[item["product_id"]], item["quantity"])
+        for item in cart if item["product_id"] in products
+    ]
+    priced = pricing.price_cart(lines, coupon_code=session.get("coupon"))
+    payload = {
+        "lines": [
+            {
+                "product_id": line["product"].id,
+                "name": line["product"].name,
+                "quantity": line["quantity"],
+                "unit_price_cents": line["unit_price_cents"],
+                "subtotal_cents": line["subtotal_cents"],
+                "stock": line["product"].stock,
+            }
+            for line in priced["lines"]
+        ],
+        "promotions": [
+            {"promotion_id": promotion_id, "discount_cents": cents}
+            for promotion_id, cents in priced["promotions"].items()
+        ],
+        "coupon": session.get("coupon"),
+        "shipment_grams": shipping.cart_shipment_grams(products),
+    }
+    payload.update({key: priced[key] for key in CART_TOTALS})
+    return payload
+
+
+@api.route("/cart")
+@querycount.query_budget(5)
+@login_required
+def cart():
+    return respond(cart_payload(session.get("cart", [])), private=True)
+
+
+@api.route("/cart/batch", methods=["POST"])
+@querycount.query_budget(5)
+@ratelimit.limit("cart_batch", per_ip="120/minute", per_account="60/minute")
+@login_required
+def cart_batch():
+    """
+    Apply many add/set/remove/clear operations at once, e.g. a quick order:
+    {"operations": [{"op": "add", "product_id": 3, "quantity": 2}, ...]}.
+    All-or-nothing: stock is checked for the whole resulting cart with one
+    query and the priced cart is returned.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        new_cart = carts.apply_operations(session.get("cart", []), data.get("operations"))
+    except carts.CartError as e:
+        return respond({"error": "bad_request", "message": str(e), "errors": e.errors}, 400)
+    try:
+        products = carts.validate(new_cart)
+    except carts.CartError as e:
+        return respond({"error": "insufficient_stock", "message": str(e), "errors": e.errors}, 409)
+    session["cart"] = new_cart
+    return respond(cart_payload(new_cart, products), private=True)
+
+
+@api.route("/cart/reorder/<int:order_id>", methods=["POST"])
+@querycount.query_budget(7)
+@ratelimit.limit("cart_batch", per_ip="120/minute", per_account="60/minute")
+@login_required
+def cart_reorder(order_id):
+    """Add the items of an earlier order to the cart; ``skipped`` lists what could not be added in full."""
+    lines = carts.order_lines(order_id, current_user.id)
+    if lines is None:
+        abort(404, description=f"Order {order_id} not found.")
+    new_cart, products, skipped = carts.reorder(session.get("cart", []), lines)
+    session["cart"] = new_cart
+    payload = cart_payload(new_cart, products)
+    payload["skipped"] = skipped
+    return respond(payload, private=True)
+
+
+@api.route("/orders")
+@querycount.query_budget(4)
+@login_required
+@replicas.read_only
+def orders():
+    """
+    The user's orders, newest first, hot and archived alike. Both tables are
+    read with the same keyset on (created_at, id) and merged, so each page
+    costs two index range scans however deep the client pages.
+    """
+    limit = requested_limit()
+    fields = requested_fields(ORDER_FIELDS, ORDER_FIELDS)
+    cursor = decode_cursor(2)
+    if cursor:
+        try:
+            cursor[0] = datetime.fromisoformat(cursor[0])
+        except (TypeError, ValueError):
+            abort(400, description="Invalid cursor.")
+
+    rows = []
+    for model in (Order, ArchivedOrder):
+        query = db.session.query(*(getattr(model, name).label(name) for name in ORDER_FIELDS))
+        query = query.filter(model.user_id == current_user.id)
+        if cursor:
+            query = query.filter(or_(
+                model.created_at < cursor[0], and_(model.created_at == cursor[0], model.id < cursor[1])
+            ))
+        rows += query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    rows.sort(key=lambda row: (row.created_at or datetime.min, row.id), reverse=True)
+
+    page = rows[:limit]
+    next_cursor = encode_cursor([page[-1].created_at, page[-1].id]) if len(rows) > limit else None
+    return respond({
+        "data": [{name: row._mapping[name] for name in fields} for row in page],
+        "next_cursor": next_cursor,
+    }, private=True)
+
+
+@api.route("/orders/<int:order_id>")
+@querycount.query_budget(4)
+@login_required
+@replicas.read_only
+def order(order_id):
+    row = (
+        db.session.query(Order.user_id, *(getattr(Order, name).label(name) for name in ORDER_DETAIL_FIELDS))
+        .filter(Order.id == order_id)
+        .first()
+    )
+    if row is not None:
+        if row.user_id != current_user.id:
+            abort(404, description=f"Order {order_id} not found.")
+        items = (
+            db.session.query(*(getattr(OrderItem, name).label(name) for name in ORDER_ITEM_FIELDS),
+                             Product.name.label("name"))
+            .outerjoin(Product, Product.id == OrderItem.product_id)
+            .filter(OrderItem.order_id == order_id)
+            .order_by(OrderItem.id)
+            .all()
+        )
+        payload = {name: row._mapping[name] for name in ORDER_DETAIL_FIELDS}
+        payload["items"] = [dict(item._mapping) for item in items]
+        payload["archived"] = False
+        return respond(payload, private=True)
+
+    document = archive.load_archived_order(order_id)
+    if document is None or document["order"]["user_id"] != current_user.id:
+        abort(404, description=f"Order {order_id} not found.")
+    names = dict(
+        db.session.query(Product.id, Product.name)
+        .filter(Product.id.in_({item["product_id"] for item in document["items"]}))
+        .all()
+    )
+    payload = {name: document["order"].get(name) for name in ORDER_DETAIL_FIELDS}
+    payload["items"] = [
+        dict({name: item[name] for name in ORDER_ITEM_FIELDS}, name=names.get(item["product_id"]))
+        for item in document["items"]
+    ]
+    payload["archived"] = True
+    return respond(payload, private=True)
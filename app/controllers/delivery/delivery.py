@@ -1,13 +1,180 @@
-from flask import Flask, Blueprint, request, jsonify
-from delivery_acs import delivery as acs_delivery
-from delivery_geniki import delivery as geniki_delivery
+# app/controllers/delivery/delivery.py
+import logging
+from datetime import date
 
-app = Flask(__name__)
+from flask import Blueprint, jsonify, request, session
+from flask_login import current_user, login_required
 
-# Register blueprints
-app.register_blueprint(acs_delivery, url_prefix='/acs')
-app.register_blueprint(geniki_delivery, url_prefix='/geniki')
+from app import carriers, querycount, shipping, tracking
+from app.carriers import CarrierError
+from app.db import db_transaction
+from app.helper import from_cents
+from app.models import Order, OrderStatus, PaymentStatus
 
-if app == '__main__':
-    app.run(debug=True)
-    
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+# The same endpoints for every carrier plugin; the carrier is a parameter
+delivery = Blueprint("delivery", __name__, url_prefix="/delivery")
+
+
+def _carrier_or_404(name):
+    if name not in carriers.names():
+        return None, (jsonify({"error": f"Unknown carrier {name!r}"}), 404)
+    return carriers.get(name), None
+
+
+def _carrier_error(e):
+    if isinstance(e, NotImplementedError):
+        return jsonify({"error": "Not supported by this carrier"}), 501
+    return jsonify({"error": str(e)}), e.status
+
+
+@delivery.route("/options", methods=["GET"])
+@querycount.query_budget(2)
+def get_delivery_options():
+    """
+    A quote from every carrier, asked in parallel on the shared transport,
+    so the page waits for the slowest carrier rather than for all of them
+    in turn. Quotes are cached per weight bucket (shipping.quote).
+    """
+    destination = request.args.get("destination", "Thessaloniki")
+    # An explicit ?weight= (kg) still wins; otherwise quote the cart's chargeable weight
+    weight = request.args.get("weight", type=float)
+    grams = round(weight * 1000) if weight is not None else shipping.cart_shipment_grams()
+
+    def ask(name):
+        carrier = carriers.get(name)
+
+        def fetch(weight_kg):
+            try:
+                return {"cost_cents": carrier.quote(destination, weight_kg)}, 200
+            except CarrierError as e:
+                return {"error": str(e)}, e.status
+
+        return carrier, shipping.quote(name, destination, grams, fetch)
+
+    options, errors = [], []
+    for carrier, (result, status) in carriers.transport().map(ask, carriers.names()):
+        if status != 200:
+            errors.append((carrier.name, result, status))
+            continue
+        options.append({
+            "carrier": carrier.name,
+            "method": carrier.label,
+            "cost": float(from_cents(result["cost_cents"])),
+            "days": carrier.delivery_days,
+        })
+    for name, result, status in errors:
+        logger.warning(f"No {name} quote for {destination}: {status} {result.get('error')}")
+    if not options and errors:
+        _, result, status = errors[0]
+        return jsonify(result), status
+    return jsonify({"options": options})
+
+
+@delivery.route("/select", methods=["POST"])
+@querycount.query_budget(1)
+def select_delivery():
+    data = request.get_json(silent=True) or {}
+    name = data.get("carrier")
+    if name is None:
+        # Older clients send the option's label
+        name = next((n for n in carriers.names() if carriers.get(n).label == data.get("method")), None)
+    if name not in carriers.names():
+        return jsonify({"error": "Invalid delivery method"}), 400
+    carrier = carriers.get(name)
+    session["delivery"] = {
+        "carrier": name,
+        "method": carrier.label,
+        "cost": data.get("cost"),
+        "days": data.get("days", carrier.delivery_days)
+    }
+    session.modified = True
+    return jsonify({"message": "Delivery selected", "carrier": name, "method": carrier.label})
+
+
+@delivery.route("/create-voucher", methods=["POST"])
+@querycount.query_budget(8)
+@login_required
+@db_transaction
+def create_voucher():
+    """
+    Book the voucher for the caller's paid order now rather than waiting
+    for the order.paid job; the shipment comes from the order itself, and an
+    order that already has one gets it back.
+    """
+    order_id = session.get("order_id")
+    # Locked until the commit, so the order.paid job cannot book it at the same time
+    order = tracking.lock_order(order_id) if order_id is not None else None
+    if order is None or order.user_id != current_user.id:
+        return jsonify({"error": "No order to ship"}), 400
+    if order.status != OrderStatus.COMPLETED.value or order.payment_status != PaymentStatus.PAID.value:
+        return jsonify({"error": "Order is not paid"}), 409
+    name = order.shipping_carrier or (session.get("delivery") or {}).get("carrier")
+    if name not in carriers.names():
+        return jsonify({"error": "Invalid delivery method"}), 400
+
+    try:
+        shipment, created = tracking.book(order, carriers.get(name))
+    except (CarrierError, NotImplementedError) as e:
+        return _carrier_error(e)
+    session["voucher_no"] = shipment.voucher_number
+    return jsonify({"message": "Voucher created" if created else "Voucher already created",
+                    "carrier": shipment.carrier, "voucher_no": shipment.voucher_number})
+
+
+# Status answers come from the local table kept fresh by `flask tracking poll`
+@delivery.route("/voucher-status", methods=["GET"])
+@querycount.query_budget(2)
+def get_voucher_status():
+    name = request.args.get("carrier", "")
+    voucher_number = request.args.get("voucher_number")
+    shipment = tracking.by_voucher(name, voucher_number) if voucher_number else None
+    if shipment is None:
+        return jsonify({"status": "error", "message": "Unknown voucher"}), 404
+    return jsonify({"status": "success", "data": {
+        "carrier": name, "voucher_number": voucher_number, "status": shipment.status,
+        "checked_at": tracking.checked_at(shipment),
+    }})
+
+
+@delivery.route("/cancel-voucher", methods=["POST"])
+@querycount.query_budget(4)
+@login_required
+@db_transaction
+def cancel_voucher():
+    data = request.get_json(silent=True) or {}
+    voucher_number = data.get("voucher_number")
+    if not voucher_number:
+        return jsonify({"status": "error", "message": "voucher_number is required"}), 400
+    carrier, error = _carrier_or_404(data.get("carrier", ""))
+    if error:
+        return error
+    # Admins cancel any voucher, customers only those of their own orders
+    shipment = tracking.by_voucher(carrier.name, voucher_number)
+    order = Order.query.get(shipment.order_id) if shipment is not None and shipment.order_id else None
+    if shipment is None or not (current_user.is_admin() or (order is not None and order.user_id == current_user.id)):
+        return jsonify({"status": "error", "message": "Unknown voucher"}), 404
+    try:
+        carrier.cancel(voucher_number)
+    except (CarrierError, NotImplementedError) as e:
+        return _carrier_error(e)
+    tracking.close(carrier.name, voucher_number, "cancelled")
+    return jsonify({"status": "success", "data": {"voucher_number": voucher_number, "status": "cancelled"}})
+
+
+@delivery.route("/pickup-times", methods=["GET"])
+@querycount.query_budget(1)
+def get_pickup_times():
+    name = request.args.get("carrier", "")
+    if name not in carriers.names():
+        return jsonify({"status": "error", "message": f"Unknown carrier {name!r}"}), 404
+    try:
+        pickup_date = date.fromisoformat(request.args["date"]) if request.args.get("date") else date.today()
+    except ValueError:
+        return jsonify({"status": "error", "message": "date must be YYYY-MM-DD"}), 400
+    # Fetched ahead by `flask tracking poll`; the carrier is never called from here
+    times = tracking.pickup_slots(name, pickup_date)
+    if times is None:
+        return jsonify({"status": "error", "message": "No pickup times known for this date"}), 503
+    return jsonify({"status": "success", "data": {"pickup_date": pickup_date.isoformat(), "times": times}})
@@ -1,27 +1,57 @@
-from flask import Blueprint, request, jsonify, session
-import requests
+# app/controllers/delivery/delivery_geniki.py
+import logging
 import os
+import threading
 import xml.etree.ElementTree as ET
-from datetime import datetime
-from eShop.app.models import Order
+from datetime import date
+
+import requests
+from flask import Blueprint, jsonify, request
 
+from app import querycount, tracking
+from app.carriers import Carrier, CarrierError, register
 
+logger = logging.getLogger(__name__)
+
+# Mounted under /delivery/geniki by carriers.init_app
 delivery = Blueprint("geniki_delivery", __name__)
 
 # Geniki Taxydromiki API configuration
-GENIKI_BASE_URL = "https://voucher.taxydromiki.gr/JobServicesV2.asmx"
+GENIKI_BASE_URL = os.environ.get("GENIKI_BASE_URL", "https://voucher.taxydromiki.gr/JobServicesV2.asmx")
 GENIKI_AUTH_USERNAME = os.environ.get("GENIKI_AUTH_USERNAME", "your_username")
 GENIKI_AUTH_PASSWORD = os.environ.get("GENIKI_AUTH_PASSWORD", "your_password")
 GENIKI_APPLICATION_KEY = os.environ.get("GENIKI_APPLICATION_KEY", "your_application_key")
+GENIKI_NS = "{http://voucher.taxydromiki.gr/JobServicesV2.asmx}"
+SOAP_NS = "{http://schemas.xmlsoap.org/soap/envelope/}"
+# The JobServices API has no price lookup; Geniki bills this flat rate
+GENIKI_FLAT_RATE_CENTS = 500
+# Pickup window requested for new vouchers (JobServices day quarter code)
+PICKUP_DAY_QUARTER = "200"
 
 class JobServicesApiClient:
-    def __init__(self, username, password, application_key):
+    def __init__(self, username, password, application_key, transport):
         self.username = username
         self.password = password
         self.application_key = application_key
         self.base_url = GENIKI_BASE_URL
+        self.transport = transport
         self.auth_key = self._authenticate()
 
+    def _post(self, headers, soap_body):
+        """The SOAP response; network errors, unparseable replies and SOAP faults raise CarrierError."""
+        action = headers["SOAPAction"].rsplit("/", 1)[-1]
+        try:
+            response = self.transport.post("geniki", action, self.base_url, data=soap_body, headers=headers)
+            root = ET.fromstring(response.content) if response.content else None
+        except (requests.exceptions.RequestException, ET.ParseError) as e:
+            logger.error(f"Geniki network error: {e}")
+            raise CarrierError("Geniki service unavailable", 503)
+        fault = root.find(f".//{SOAP_NS}Fault") if root is not None else None
+        if fault is not None:
+            logger.error(f"Geniki {action} fault: {fault.findtext('faultstring')}")
+            raise CarrierError(fault.findtext("faultstring") or "Geniki error")
+        return response
+
     def _authenticate(self):
         headers = {
             'Content-Type': 'text/xml; charset=utf-8',
@@ -37,12 +67,13 @@ class JobServicesApiClient:
     </Authenticate>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
             key = root.find('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}Key')
-            return key.text if key is not None else None
-        return None
+            if key is not None and key.text:
+                return key.text
+        raise CarrierError("Geniki authentication failed")
 
     def get_jobs_from_order_id(self, order_id):
         if not self.auth_key:
@@ -60,7 +91,7 @@ class JobServicesApiClient:
     </GetJobsFromOrderId>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
             jobs = root.find('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}GetJobsFromOrderIdResult')
@@ -87,11 +118,14 @@ class JobServicesApiClient:
     </CreateGetVoucherPickUpOrder>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
             result = root.find('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}CreateGetVoucherPickUpOrderResult')
-            if result is not None and result.text == 'Success':  # Adjust based on schema
+            code = root.find(f'.//{GENIKI_NS}CreateGetVoucherPickUpOrderResult/{GENIKI_NS}Result')
+            if result is not None and (result.text == 'Success' or (code is not None and code.text == '0')):
+                voucher = root.find(f'.//{GENIKI_NS}CreateGetVoucherPickUpOrderResult/{GENIKI_NS}Voucher')
+                voucher_number = voucher.text if voucher is not None else voucher_number
                 return {'status': 'success', 'data': {'voucher_number': voucher_number, 'status': 'created'}}
             return {'status': 'error', 'message': 'Voucher creation failed'}
         return {'status': 'error', 'message': f'Failed to create pickup order: {response.status_code}'}
@@ -112,7 +146,7 @@ class JobServicesApiClient:
     </GetJobStatus>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
             status = root.find('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}GetJobStatusResult')
@@ -137,7 +171,7 @@ class JobServicesApiClient:
     </GetVoucherPickUpStatus>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
             status = root.find('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}GetVoucherPickUpStatusResult')
@@ -162,7 +196,7 @@ class JobServicesApiClient:
     </CancelVoucherPickUpOrder>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
             result = root.find('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}CancelVoucherPickUpOrderResult')
@@ -187,102 +221,78 @@ class JobServicesApiClient:
     </GetAvailablePickupTimes>
   </soap:Body>
 </soap:Envelope>"""
-        response = requests.post(self.base_url, data=soap_body, headers=headers)
+        response = self._post(headers, soap_body)
         if response.status_code == 200:
             root = ET.fromstring(response.content)
-            times = root.findall('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}GetAvailablePickupTimesResult/time')
+            times = root.findall('.//{http://voucher.taxydromiki.gr/JobServicesV2.asmx}GetAvailablePickupTimesResult/{http://voucher.taxydromiki.gr/JobServicesV2.asmx}time')
             if times:
                 return {'status': 'success', 'data': {'pickup_date': pickup_date.isoformat(), 'times': [time.text for time in times]}}  # Adjust based on schema
             return {'status': 'error', 'message': 'No times found'}
         return {'status': 'error', 'message': f'Failed to get available pickup times: {response.status_code}'}
 
-# Initialize API client
-geniki_client = JobServicesApiClient(GENIKI_AUTH_USERNAME, GENIKI_AUTH_PASSWORD, GENIKI_APPLICATION_KEY)
 
-@delivery.route("/delivery/options", methods=["GET"])
-def get_delivery_options():
-    destination = request.args.get("destination", "Thessaloniki")
-    weight_kg = float(request.args.get("weight", 2.0))
-    
-    geniki_response = geniki_client.get_jobs_from_order_id("sample_order_id")  # Replace with actual logic
-    geniki_delivery = {
-        "method": "Geniki Standard",
-        "cost": 5.0,  # Placeholder, replace with actual cost from API
-        "days": 3     # Placeholder, replace with actual days from API
-    } if geniki_response['status'] == 'success' else None
+@register
+class GenikiCarrier(Carrier):
+    """Geniki Taxydromiki through the JobServicesV2 SOAP API; authenticates once per process."""
+    name = "geniki"
+    label = "Geniki Standard"
+    delivery_days = 3
+    blueprint = delivery
 
-    delivery_options = [geniki_delivery] if geniki_delivery else []
-    return jsonify({"options": delivery_options})
+    def __init__(self, transport):
+        super().__init__(transport)
+        self._client = None
+        self._client_lock = threading.Lock()
 
-@delivery.route("/delivery/select", methods=["POST"])
-def select_delivery():
-    data = request.json
-    method = data.get("method")
-    cost = data.get("cost")
-    days = data.get("days")
-    
-    if "delivery" not in session:
-        session["delivery"] = {}
-    session["delivery"] = {"method": method, "cost": cost, "days": days}
-    session.modified = True
-    
-    return jsonify({"message": "Delivery method selected", "method": method, "cost": cost})
+    @property
+    def client(self):
+        """The API client, authenticated on first use rather than at import."""
+        if self._client is None or not self._client.auth_key:
+            with self._client_lock:
+                if self._client is None or not self._client.auth_key:
+                    self._client = JobServicesApiClient(
+                        GENIKI_AUTH_USERNAME, GENIKI_AUTH_PASSWORD, GENIKI_APPLICATION_KEY, self.transport)
+        return self._client
 
-@delivery.route("/delivery/create-voucher", methods=["POST"])
-def create_voucher():
-    if "delivery" not in session or "cart" not in session:
-        return jsonify({"error": "No delivery or cart data available"}), 400
-    
-    if session["delivery"]["method"] != "Geniki Standard":
-        return jsonify({"error": "Unsupported delivery method"}), 400
-    
-    order_data = {
-        "voucher_number": f"GENIKI-{Order.query.count() + 1}",
-        "pickup_date": datetime.now(),
-        "day_quarter": "200"  
-    }
-    response = geniki_client.create_voucher_pickup_order(
-        order_data["voucher_number"],
-        order_data["pickup_date"],
-        order_data["day_quarter"]
-    )
-    if response['status'] == 'error':
-        return jsonify(response), 500
-    
-    voucher_no = response['data']['voucher_number']
-    if voucher_no:
-        session["voucher_no"] = voucher_no
-        return jsonify({"message": "Voucher created", "voucher_no": voucher_no})
-    return jsonify({"error": "Failed to create voucher"}), 500
+    @staticmethod
+    def _data(response):
+        if response["status"] != "success":
+            raise CarrierError(response["message"])
+        return response["data"]
 
-@delivery.route("/delivery/job-status", methods=["GET"])
-def get_job_status():
-    job_id = request.args.get("job_id", "sample_job_id")
-    response = geniki_client.get_job_status(job_id)
-    if response['status'] == 'error':
-        return jsonify(response), 500
-    return jsonify(response)
+    def quote(self, destination, weight_kg):
+        return GENIKI_FLAT_RATE_CENTS
+
+    def create_voucher(self, shipment):
+        data = self._data(self.client.create_voucher_pickup_order(
+            f"GENIKI-{shipment['order_id']}", shipment.get("pickup_date") or date.today(), PICKUP_DAY_QUARTER))
+        return data["voucher_number"], None
+
+    def track_one(self, voucher_number, job_id):
+        pickup = self.client.get_voucher_pickup_status(voucher_number)
+        job = self.client.get_job_status(job_id) if job_id else None
+        return {
+            "status": pickup["data"]["status"] if pickup["status"] == "success" else None,
+            "job_status": job["data"]["status"] if job and job["status"] == "success" else None,
+            "error": None if pickup["status"] == "success" else pickup["message"],
+        }
+
+    def cancel(self, voucher_number):
+        self._data(self.client.cancel_voucher_pickup_order(voucher_number))
 
-@delivery.route("/delivery/voucher-pickup-status", methods=["GET"])
-def get_voucher_pickup_status():
-    voucher_number = request.args.get("voucher_number", "sample_voucher")
-    response = geniki_client.get_voucher_pickup_status(voucher_number)
-    if response['status'] == 'error':
-        return jsonify(response), 500
-    return jsonify(response)
+    def pickup_slots(self, pickup_date):
+        response = self.client.get_available_pickup_times(pickup_date)
+        return response["data"]["times"] if response["status"] == "success" else None
 
-@delivery.route("/delivery/cancel-voucher", methods=["POST"])
-def cancel_voucher_pickup():
-    voucher_number = request.json.get("voucher_number", "sample_voucher")
-    response = geniki_client.cancel_voucher_pickup_order(voucher_number)
-    if response['status'] == 'error':
-        return jsonify(response), 500
-    return jsonify(response)
 
-@delivery.route("/delivery/available-pickup-times", methods=["GET"])
-def get_available_pickup_times():
-    pickup_date = datetime.now()  # Use current date or from request
-    response = geniki_client.get_available_pickup_times(pickup_date)
-    if response['status'] == 'error':
-        return jsonify(response), 500
-    return jsonify(response)
\ No newline at end of file
+# Answers from the local table kept fresh by `flask tracking poll`
+@delivery.route("/job-status", methods=["GET"])
+@querycount.query_budget(2)
+def get_job_status():
+    job_id = request.args.get("job_id")
+    shipment = tracking.by_job_id("geniki", job_id) if job_id else None
+    if shipment is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify({'status': 'success', 'data': {
+        'job_id': job_id, 'status': shipment.job_status, 'checked_at': tracking.checked_at(shipment),
+    }})
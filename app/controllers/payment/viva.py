@@ -5,21 +5,143 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from app import db                    
-from app.models import Order, OrderItem, Product
+from app.models import Order, OrderItem, OrderStatus, PaymentStatus, Product
 from app.db import db_error_msg      
-from app.config import AppConfig
 from sqlalchemy.exc import SQLAlchemyError
 import os
 import requests
 import logging
 import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from app.db import db_transaction
+from app import cache, inventory, orders, pricing, promotions, querycount, ratelimit, settings
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 payment = Blueprint("payment", __name__)
 
+# Viva access tokens expire after 3600 s; stop reusing one well before that
+VIVA_TOKEN_TTL = 3000
+VIVA_TIMEOUT = 15
+# Parallel order status checks (and pooled connections) when sweeping orders
+STATUS_WORKERS = 8
+# stateId of a Viva payment order
+VIVA_ORDER_STATES = {0: "pending", 1: "expired", 2: "cancelled", 3: "paid"}
+# Seconds a Viva payment order stays payable; the sweeper waits this long too
+PAYMENT_TIMEOUT = 300
+TRANSACTIONS_PAGE_SIZE = 500
+
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=STATUS_WORKERS))
+_http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=STATUS_WORKERS))
+
+
+def _token_key(client_id, client_secret):
+    return "viva:token:" + hashlib.sha256(f"{client_id}:{client_secret}".encode()).hexdigest()[:16]
+
+
+def viva_access_token(client_id, client_secret):
+    """
+    OAuth token for the Viva API. Tokens are valid for an hour, so one is
+    shared by every checkout and worker through the cache (fetched by a
+    single worker when it runs out) instead of being requested per checkout.
+    """
+    def fetch():
+        auth_str = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+        token_resp = requests.post(
+            f"{current_app.config['VIVA_ACCOUNTS_URL']}/connect/token",
+            data={"grant_type": "client_credentials"},
+            headers={"Authorization": f"Basic {auth_str}", "Content-Type": "application/x-www-form-urlencoded"}
+        )
+        token_resp.raise_for_status()
+        return token_resp.json()["access_token"]
+
+    return cache.get_cache().get_or_set(_token_key(client_id, client_secret), fetch, VIVA_TOKEN_TTL)
+
+
+def viva_credentials():
+    """``(client_id, client_secret, source_code, payment_timeout)``: settings first, then the environment."""
+    values = settings.get_many(["VIVA_CLIENT_ID", "VIVA_CLIENT_SECRET", "VIVA_SOURCE_CODE", "payment_timeout"])
+    return (
+        values.get("VIVA_CLIENT_ID") or os.getenv("VIVA_CLIENT_ID"),
+        values.get("VIVA_CLIENT_SECRET") or os.getenv("VIVA_CLIENT_SECRET"),
+        values.get("VIVA_SOURCE_CODE") or os.getenv("VIVA_SOURCE_CODE", "eShop"),
+        int(values.get("payment_timeout") or PAYMENT_TIMEOUT),
+    )
+
+
+def viva_order_states(order_codes, workers=STATUS_WORKERS):
+    """
+    Viva's state of each payment order ("pending", "expired", "cancelled" or
+    "paid"), checked in parallel over one pooled session with a single
+    token. Codes that could not be checked map to None.
+    """
+    client_id, client_secret, _, _ = viva_credentials()
+    if not client_id or not client_secret:
+        raise RuntimeError("Viva credentials are not configured")
+    headers = {"Authorization": f"Bearer {viva_access_token(client_id, client_secret)}"}
+    base_url = current_app.config["VIVA_API_URL"]
+    rejected = []
+
+    def fetch(order_code):
+        try:
+            resp = _http.get(f"{base_url}/checkout/v2/orders/{order_code}", headers=headers, timeout=VIVA_TIMEOUT)
+            if resp.status_code == 401:
+                rejected.append(order_code)
+            resp.raise_for_status()
+            return order_code, VIVA_ORDER_STATES.get(resp.json().get("stateId"))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Viva order {order_code}: status check failed: {e}")
+            return order_code, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        states = dict(pool.map(fetch, order_codes))
+    if rejected:
+        cache.get_cache().delete(_token_key(client_id, client_secret))
+    return states
+
+
+def viva_transactions(date_from, date_to, page_size=TRANSACTIONS_PAGE_SIZE):
+    """
+    Stream the transactions Viva recorded from ``date_from`` to ``date_to``
+    (dates, inclusive) as dicts with transactionId, orderCode, merchantTrns,
+    statusId and amount (in euros). The next page is requested while the
+    caller works through the current one, and only one page is held at a
+    time however long the listing is.
+    """
+    client_id, client_secret, _, _ = viva_credentials()
+    if not client_id or not client_secret:
+        raise RuntimeError("Viva credentials are not configured")
+    headers = {"Authorization": f"Bearer {viva_access_token(client_id, client_secret)}"}
+    url = f"{current_app.config['VIVA_API_URL']}/checkout/v2/transactions"
+
+    def fetch(page):
+        params = {"dateFrom": date_from.isoformat(), "dateTo": date_to.isoformat(),
+                  "page": page, "pageSize": page_size}
+        resp = _http.get(url, params=params, headers=headers, timeout=VIVA_TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        page = 1
+        upcoming = pool.submit(fetch, page)
+        while True:
+            try:
+                data = upcoming.result()
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 401:
+                    cache.get_cache().delete(_token_key(client_id, client_secret))
+                raise
+            transactions = data.get("transactions") or []
+            more = bool(transactions) and data.get("hasMore", False)
+            if more:
+                page += 1
+                upcoming = pool.submit(fetch, page)
+            yield from transactions
+            if not more:
+                return
+
 
 def _commit_or_rollback():
     """Commit the current session; on error → rollback + flash + return None."""
@@ -36,12 +158,11 @@ def _commit_or_rollback():
 
 
 @payment.route("/checkout", methods=["GET", "POST"])
+@querycount.query_budget(15)
 @login_required
 @db_transaction
 def checkout():
-    client_id = AppConfig.get("VIVA_CLIENT_ID") or os.getenv("VIVA_CLIENT_ID")
-    client_secret = AppConfig.get("VIVA_CLIENT_SECRET") or os.getenv("VIVA_CLIENT_SECRET")
-    source_code = AppConfig.get("VIVA_SOURCE_CODE") or os.getenv("VIVA_SOURCE_CODE", "eShop")
+    client_id, client_secret, source_code, payment_timeout = viva_credentials()
 
     if not client_id or not client_secret:
         flash("Payment credentials are not configured. Please contact admin.", "error")
@@ -51,19 +172,14 @@ def checkout():
     if "cart" not in session or not session["cart"]:
         flash("Your cart is empty.", "error")
         return redirect(url_for("shop.view_cart"))
-    cart_items = []
-    total = 0.0
-    for item in session["cart"]:
-        product = Product.query.get(item["product_id"])
-        if not product:
-            flash("One of the products no longer exists.", "error")
-            return redirect(url_for("shop.view_cart"))
-        cart_items.append({
-            "product": product,
-            "quantity": item["quantity"],
-            "subtotal": product.price * item["quantity"]
-        })
-        total += product.price * item["quantity"]
+    products = pricing.cart_products(session["cart"], for_update=request.method == "POST")
+    if any(item["product_id"] not in products for item in session["cart"]):
+        flash("One of the products no longer exists.", "error")
+        return redirect(url_for("shop.view_cart"))
+    cart = pricing.price_cart(
+        ((products[item["product_id"]], item["quantity"]) for item in session["cart"]),
+        coupon_code=session.get("coupon"),
+    )
     delivery_info = session.get("delivery_info", {})
     required = ["address", "zipcode", "region", "phone"]
     if not all(delivery_info.get(k) for k in required):
@@ -71,7 +187,7 @@ def checkout():
         return redirect(url_for("shop.delivery_info"))
 
     if request.method == "GET":
-        return render_template("checkout.html", cart_items=cart_items, total=total)
+        return render_template("checkout.html", cart=cart)
 
     address = request.form.get("address", delivery_info.get("address"))
     phone   = request.form.get("phone",   delivery_info.get("phone"))
@@ -82,57 +198,58 @@ def checkout():
 
     if not all([address, phone, zipcode, region]):
         flash("All required fields (Address, Phone, Zipcode, Region) must be filled.", "error")
-        return render_template("checkout.html", cart_items=cart_items, total=total)
+        return render_template("checkout.html", cart=cart)
     order = Order(
         user_id=current_user.id,
-        total_amount=0,
-        status="Pending",
-        payment_status="Pending",
+        subtotal_cents=cart["subtotal_cents"],
+        discount_cents=cart["discount_cents"],
+        tax_cents=cart["tax_cents"],
+        shipping_cents=cart["shipping_cents"],
+        total_cents=cart["total_cents"],
+        status=OrderStatus.PENDING.value,
+        payment_status=PaymentStatus.PENDING.value,
         shipping_address=address,
         payment_method=payment_method,
         shipping_phone=phone,
         shipping_floor=floor,
         shipping_zipcode=zipcode,
-        shipping_region=region
+        shipping_region=region,
+        shipping_carrier=(session.get("delivery") or {}).get("carrier"),
     )
     db.session.add(order)
     db.session.flush()
+    orders.record_created(order)
 
-    total_amount = 0.0
-    for item in session["cart"]:
-        product = Product.query.get(item["product_id"])
-        if not product or product.stock < item["quantity"]:
+    for line in cart["lines"]:
+        product = line["product"]
+        if product.stock < line["quantity"]:
             flash(f"Out of stock: {product.name}", "error")
             raise SQLAlchemyError("Stock error")  # will trigger rollback
 
         order_item = OrderItem(
             order_id=order.id,
             product_id=product.id,
-            quantity=item["quantity"],
-            unit_price=product.price
+            quantity=line["quantity"],
+            unit_price_cents=line["unit_price_cents"]
         )
-        total_amount += product.price * item["quantity"]
-        product.stock -= item["quantity"]
+        inventory.record_movement(product, -line["quantity"], "checkout", order_id=order.id)
         db.session.add(order_item)
 
-    order.total_amount = total_amount
+    if promotions.redeem(cart["promotions"], order, current_user.id) is not None:
+        db.session.rollback()
+        session.pop("coupon", None)
+        flash("A promotion in your cart is no longer available. Please review your cart.", "error")
+        return redirect(url_for("shop.view_cart"))
+
     session["order_id"] = order.id
     session.modified = True
 
     try:
-        token_url = "https://demo-accounts.vivapayments.com/connect/token"
-        auth_str = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-        token_resp = requests.post(
-            token_url,
-            data={"grant_type": "client_credentials"},
-            headers={"Authorization": f"Basic {auth_str}", "Content-Type": "application/x-www-form-urlencoded"}
-        )
-        token_resp.raise_for_status()
-        access_token = token_resp.json()["access_token"]
+        access_token = viva_access_token(client_id, client_secret)
 
-        checkout_url = "https://demo-api.vivapayments.com/checkout/v2/orders"
+        checkout_url = f"{current_app.config['VIVA_API_URL']}/checkout/v2/orders"
         payload = {
-            "amount": int(total_amount * 100),
+            "amount": order.total_cents,
             "customerTrns": f"Order {order.id} for {current_user.email}",
             "customer": {
                 "email": current_user.email,
@@ -140,7 +257,7 @@ def checkout():
                 "phone": phone,
                 "countryCode": "GR"
             },
-            "paymentTimeout": 300,
+            "paymentTimeout": payment_timeout,
             "webhookUrl": url_for("payment.payment_viva_callback", order_id=order.id, _external=True),
             "merchantTrns": f"Order-{order.id}",
             "sourceCode": source_code,
@@ -156,6 +273,8 @@ def checkout():
         )
         checkout_resp.raise_for_status()
         order_code = checkout_resp.json()["orderCode"]
+        # Lets the pending-order sweeper ask Viva about an abandoned payment
+        order.transaction_id = str(order_code)
         session["viva_order_code"] = order_code
         session.modified = True
 
@@ -166,25 +285,31 @@ def checkout():
         elif payment_method == "paypal":
             payment_method_id = os.getenv("VIVA_PAYPAL_METHOD_ID")
 
-        redirect_url = f"https://demo.vivapayments.com/web/checkout?ref={order_code}"
+        redirect_url = f"{current_app.config['VIVA_CHECKOUT_URL']}/web/checkout?ref={order_code}"
         if payment_method_id:
             redirect_url += f"&paymentMethodId={payment_method_id}"
 
         return redirect(redirect_url)
 
     except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 401:
+            # Revoked or expired early: fetch a fresh token next time
+            cache.get_cache().delete(_token_key(client_id, client_secret))
         logger.error(f"Viva API error: {e.response.status_code} – {e.response.text}")
         flash(f"Payment gateway error: {e.response.text}", "danger")
         db.session.rollback()
-        return render_template("checkout.html", cart_items=cart_items, total=total)
+        return render_template("checkout.html", cart=cart)
     except Exception as e:
         logger.exception("Unexpected error during Viva checkout")
         flash(f"Unexpected error: {str(e)}", "danger")
         db.session.rollback()
-        return render_template("checkout.html", cart_items=cart_items, total=total)
+        return render_template("checkout.html", cart=cart)
 
 
 @payment.route("/viva/callback/<int:order_id>", methods=["POST"])
+@querycount.query_budget(8)
+@ratelimit.limit("viva_callback", per_ip="120/minute")
+@db_transaction
 def payment_viva_callback(order_id):
     webhook_key = request.headers.get("Key")
     if webhook_key != os.getenv("VIVA_WEBHOOK_KEY"):
@@ -198,18 +323,19 @@ def payment_viva_callback(order_id):
         return jsonify({"error": "Order not found"}), 404
 
     if data.get("statusId") == "F":
-        order.payment_status = "Paid"
-        order.status = "Completed"
+        if order.status == OrderStatus.PENDING:
+            orders.transition(order, OrderStatus.COMPLETED, reason="viva webhook")
         session.pop("cart", None)
         session.pop("delivery_info", None)
         return jsonify({"status": "success"}), 200
     else:
-        order.payment_status = "Failed"
-        order.status = "Cancelled"
+        if order.status == OrderStatus.PENDING:
+            orders.transition(order, OrderStatus.CANCELLED, reason="viva webhook: payment failed")
         return jsonify({"status": "failed"}), 400
 
 
 @payment.route("/success")
+@querycount.query_budget(8)
 @login_required
 @db_transaction
 def payment_success():
@@ -223,26 +349,31 @@ def payment_success():
         flash("Unauthorized.", "danger")
         return redirect(url_for("shop.orders"))
 
-    order.payment_status = "Paid"
-    order.status = "Completed"
+    if order.status in (OrderStatus.CANCELLED, OrderStatus.EXPIRED):
+        flash("This order was cancelled before the payment was confirmed. Please contact us.", "warning")
+        return redirect(url_for("shop.orders"))
+    if order.status == OrderStatus.PENDING:
+        orders.transition(order, OrderStatus.COMPLETED, reason="payment success page")
     flash("Payment confirmed!", "success")
     session.pop("cart", None)
     session.pop("delivery_info", None)
+    session.pop("coupon", None)
     return render_template("payment_success.html", order=order)
 
 
 @payment.route("/cancel")
+@querycount.query_budget(12)
 @login_required
 @db_transaction
 def payment_cancel():
+    order = None
     order_id = session.get("order_id")
     if order_id:
         order = Order.query.get(order_id)
-        if order:
-            order.payment_status = "Failed"
-            order.status = "Cancelled"
+        if order and order.user_id == current_user.id and order.status == OrderStatus.PENDING:
+            orders.transition(order, OrderStatus.CANCELLED, reason="payment cancelled by customer")
 
     session.pop("cart", None)
     session.pop("delivery_info", None)
     flash("Payment cancelled.", "info")
-    return render_template("payment_cancel.html")
\ No newline at end of file
+    return render_template("payment_cancel.html", order=order)
\ No newline at end of file
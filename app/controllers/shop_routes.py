@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import logging
@@ -7,47 +7,135 @@ from google_auth_oauthlib.flow import Flow
 from google.oauth2 import id_token
 from google.auth.transport import requests
 import pathlib
-from app.models import Product, Category, Order, OrderItem
+from app.models import Product, Category, Order, OrderItem, LOW_STOCK_THRESHOLD
+from app.db import db, db_transaction
+from app import archive, carts, catalog, media, recommendations, inventory, pricing, promotions, querycount, ratelimit, replicas, shipping
 
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 shop = Blueprint("shop", __name__)
 
 @shop.route("/")
 @shop.route("/index")
+@querycount.query_budget(2)
 def index():
     return render_template("index.html")
 
 @shop.route("/dashboard")
+@querycount.query_budget(4)
 @login_required
+@replicas.read_only
 def dashboard():
     orders_count = Order.query.filter_by(user_id=current_user.id).count()
-    return render_template("dashboard.html", orders_count=orders_count, is_admin=current_user.is_admin())
+    low_stock_alerts = inventory.open_alerts() if current_user.is_admin() else []
+    return render_template(
+        "dashboard.html",
+        orders_count=orders_count,
+        is_admin=current_user.is_admin(),
+        low_stock_alerts=low_stock_alerts,
+    )
 
 @shop.route("/products")
+@querycount.query_budget(7)
+@replicas.read_only
 def products():
     search = request.args.get("search", "")
     sort = request.args.get("sort", "name")
+    category_id = request.args.get("category_id", type=int)
+    band = request.args.get("band") or None
     page = request.args.get("page", 1, type=int)
     per_page = 9
     query = Product.query.filter(Product.name.ilike(f"%{search}%"))
+    facets = catalog.facet_counts(query, category_id=category_id, band=band)
+    query = catalog.filter_products(query, category_id=category_id, band=band)
     if sort == "price-asc":
-        query = query.order_by(Product.price.asc())
+        query = query.order_by(Product.price_cents.asc())
     elif sort == "price-desc":
-        query = query.order_by(Product.price.desc())
+        query = query.order_by(Product.price_cents.desc())
     else:
         query = query.order_by(Product.name)
     products = query.paginate(page=page, per_page=per_page)
-    return render_template("products.html", products=products.items, pagination=products)
+    filters = {"search": search, "sort": sort, "category_id": category_id, "band": band}
+    return render_template(
+        "products.html",
+        products=products.items,
+        pagination=products,
+        filters=filters,
+        facets=facets,
+        images=media.primary_images([product.id for product in products.items]),
+        category_tree=catalog.get_category_tree(),
+        price_bands=catalog.PRICE_BANDS,
+        low_stock_threshold=LOW_STOCK_THRESHOLD,
+    )
+
+@shop.route("/categories")
+@querycount.query_budget(3)
+def categories():
+    return render_template("categories.html", category_tree=catalog.get_category_tree())
+
+@shop.route("/category/<int:category_id>")
+@querycount.query_budget(3)
+def category(category_id):
+    if category_id not in catalog.get_category_tree()["nodes"]:
+        abort(404)
+    return redirect(url_for("shop.products", category_id=category_id))
 
 @shop.route("/product/<int:product_id>")
+@querycount.query_budget(5)
+@replicas.read_only
 def product_detail(product_id):
     product = Product.query.get_or_404(product_id)
-    return render_template("product_detail.html", product=product)
+    recs = recommendations.recommendations_for(product_id)
+    return render_template(
+        "product_detail.html",
+        product=product,
+        images=media.product_images(product_id),
+        bought_together=recs["bought_together"],
+        related=recs["related"],
+    )
+
+@shop.route("/admin/restock/<int:product_id>", methods=["POST"])
+@querycount.query_budget(6)
+@login_required
+@db_transaction
+def restock(product_id):
+    if not current_user.is_admin():
+        flash("You do not have permission.", "error")
+        return redirect(url_for("shop.dashboard"))
+    product = Product.query.get_or_404(product_id)
+    quantity = request.form.get("quantity", 0, type=int)
+    if quantity <= 0:
+        flash("Restock quantity must be positive.", "error")
+        return redirect(url_for("shop.dashboard"))
+    inventory.restock(product, quantity)
+    flash(f"{product.name} restocked to {product.stock}.", "success")
+    return redirect(url_for("shop.dashboard"))
+
+@shop.route("/admin/products/<int:product_id>/images", methods=["POST"])
+@querycount.query_budget(6)
+@login_required
+@db_transaction
+def upload_image(product_id):
+    if not current_user.is_admin():
+        flash("You do not have permission.", "error")
+        return redirect(url_for("shop.dashboard"))
+    Product.query.get_or_404(product_id)
+    upload = request.files.get("image")
+    if not upload or not upload.filename:
+        flash("Choose an image to upload.", "error")
+        return redirect(url_for("shop.product_detail", product_id=product_id))
+    try:
+        media.save_upload(product_id, upload.stream, alt=request.form.get("alt") or None)
+    except media.MediaError as e:
+        flash(str(e), "error")
+    else:
+        flash("Image uploaded; thumbnails are being generated.", "success")
+    return redirect(url_for("shop.product_detail", product_id=product_id))
 
 @shop.route("/add_to_cart/<int:product_id>", methods=["POST"])
+@querycount.query_budget(4)
+@ratelimit.limit("add_to_cart", per_ip="120/minute", per_account="60/minute")
 @login_required
 def add_to_cart(product_id):
     product = Product.query.get_or_404(product_id)
@@ -72,27 +160,45 @@ def add_to_cart(product_id):
     return redirect(url_for("shop.products"))
 
 @shop.route("/cart")
+@querycount.query_budget(5)
 @login_required
 def view_cart():
-    cart_items = []
-    total = 0
-    if "cart" in session:
-        for item in session["cart"]:
-            product = Product.query.get(item["product_id"])
-            if product and product.stock >= item["quantity"]:
-                cart_items.append({
-                    "product": product,
-                    "quantity": item["quantity"],
-                    "subtotal": product.price * item["quantity"]
-                })
-                total += product.price * item["quantity"]
-            else:
-                flash(f"Product {product.name if product else 'Unknown'} is out of stock and removed from cart.")
-                session["cart"].remove(item)
-                session.modified = True
-    return render_template("cart.html", cart_items=cart_items, total=total)
+    cart = session.get("cart", [])
+    products = pricing.cart_products(cart)
+    lines = []
+    for item in list(cart):
+        product = products.get(item["product_id"])
+        if product and product.stock >= item["quantity"]:
+            lines.append((product, item["quantity"]))
+        else:
+            flash(f"Product {product.name if product else 'Unknown'} is out of stock and removed from cart.")
+            cart.remove(item)
+            session.modified = True
+    coupon_code = session.get("coupon")
+    return render_template(
+        "cart.html",
+        cart=pricing.price_cart(lines, coupon_code=coupon_code),
+        coupon_code=coupon_code,
+        shipment_grams=shipping.cart_shipment_grams(products),
+    )
+
+@shop.route("/cart/coupon", methods=["POST"])
+@querycount.query_budget(4)
+@login_required
+def apply_coupon():
+    code = (request.form.get("code") or "").strip().upper()
+    if not code or request.form.get("action") == "remove":
+        session.pop("coupon", None)
+        flash("Coupon removed.")
+    elif promotions.lookup_coupon(code) is None:
+        flash("That coupon code is not valid.", "error")
+    else:
+        session["coupon"] = code
+        flash(f"Coupon {code} applied.", "success")
+    return redirect(url_for("shop.view_cart"))
 
 @shop.route("/delivery_info", methods=["GET", "POST"])
+@querycount.query_budget(2)
 @login_required
 def delivery_info():
     if request.method == "POST":
@@ -118,7 +224,28 @@ def delivery_info():
     return render_template("delivery_info.html")
 
 @shop.route("/orders")
+@querycount.query_budget(4)
 @login_required
+@replicas.read_only
 def orders():
-    orders = Order.query.filter_by(user_id=current_user.id).all()
-    return render_template("orders.html", orders=orders)
\ No newline at end of file
+    orders = archive.orders_for_user(current_user.id)
+    return render_template("orders.html", orders=orders)
+
+@shop.route("/orders/<int:order_id>/reorder", methods=["POST"])
+@querycount.query_budget(5)
+@login_required
+def reorder(order_id):
+    lines = carts.order_lines(order_id, current_user.id)
+    if lines is None:
+        abort(404)
+    cart, products, skipped = carts.reorder(session.get("cart", []), lines)
+    session["cart"] = cart
+    for line in skipped:
+        product = products.get(line["product_id"])
+        name = product.name if product else f"Product {line['product_id']}"
+        if line["added"]:
+            flash(f"Only {line['added']} of {line['requested']} x {name} could be added (stock).")
+        else:
+            flash(f"{name} is no longer available.")
+    flash(f"Items from order {order_id} added to your cart.")
+    return redirect(url_for("shop.view_cart"))
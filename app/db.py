@@ -1,17 +1,41 @@
 # app/db.py
 import os
-from flask import current_app, g, jsonify, render_template, request, flash, redirect, url_for
+from flask import current_app, g, has_app_context, jsonify, render_template, request, flash, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from flask_login import current_user
 from sqlalchemy import event
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
 import logging
 from contextlib import contextmanager
 from functools import wraps
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-db = SQLAlchemy()
+
+
+class RoutingSession(FlaskSession):
+    """
+    Sends plain SELECTs to the read replica chosen for the current request
+    (``g.read_replica``, set by ``replicas.read_only``); flushes, DML and
+    SELECT ... FOR UPDATE always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            replica = g.get("read_replica")
+            if (
+                replica is not None
+                and not self._flushing
+                and not isinstance(clause, UpdateBase)
+                and getattr(clause, "_for_update_arg", None) is None
+            ):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 def db_error_msg(e: SQLAlchemyError) -> str:
@@ -0,0 +1,16 @@
+# app/helper.py
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def to_cents(amount):
+    """Convert a major-unit amount (str/int/float/Decimal) to integer cents, rounding half up."""
+    if amount is None:
+        return None
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Integer cents to a two-place Decimal for display, e.g. 1250 -> Decimal('12.50')."""
+    if cents is None:
+        return None
+    return Decimal(cents).scaleb(-2)
@@ -0,0 +1,275 @@
+# app/inventory.py
+import logging
+import sys
+import zlib
+from array import array
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from .db import db
+from .models import (
+    LOW_STOCK_THRESHOLD, InventorySnapshot, LowStockAlert, OrderItem, Product, StockMovement
+)
+
+logger = logging.getLogger(__name__)
+
+
+def record_movement(product, delta, reason, order_id=None):
+    """
+    Apply a stock change and append it to the ledger in the caller's
+    transaction. Low-stock alerts are raised/resolved here, only when the
+    threshold is actually crossed, so no scan of the product table is needed.
+    ``product`` must be row-locked (lock_products, or pricing.cart_products
+    with for_update=True) so a concurrent change cannot be lost between the
+    read of ``stock`` and the write.
+    """
+    before = product.stock
+    product.stock = before + delta
+    movement = StockMovement(
+        product_id=product.id,
+        delta=delta,
+        stock_after=product.stock,
+        reason=reason,
+        order_id=order_id,
+    )
+    db.session.add(movement)
+    _update_alert(product.id, before, product.stock)
+    return movement
+
+
+def _update_alert(product_id, before, after):
+    crossed_down = before > LOW_STOCK_THRESHOLD >= after
+    crossed_up = before <= LOW_STOCK_THRESHOLD < after
+    if not (crossed_down or crossed_up):
+        return
+
+    alert = LowStockAlert.query.get(product_id)
+    if crossed_down:
+        if alert is None:
+            alert = LowStockAlert(product_id=product_id)
+            db.session.add(alert)
+        alert.stock = after
+        alert.raised_at = datetime.utcnow()
+        alert.resolved_at = None
+        logger.info(f"Low stock: product {product_id} down to {after}")
+    elif alert is not None and alert.resolved_at is None:
+        alert.stock = after
+        alert.resolved_at = datetime.utcnow()
+
+
+def lock_products(product_ids):
+    """
+    Load and row-lock products in id order (so two transactions locking
+    overlapping sets cannot deadlock), re-reading rows already in the session.
+    """
+    if not product_ids:
+        return {}
+    query = (
+        Product.query.filter(Product.id.in_(set(product_ids)))
+        .order_by(Product.id)
+        .with_for_update()
+        .populate_existing()
+    )
+    return {p.id: p for p in query}
+
+
+def restock(product, quantity):
+    product = lock_products([product.id])[product.id]
+    return record_movement(product, quantity, "restock")
+
+
+def restore_order_stock(order):
+    """Return the stock held by a cancelled order's items."""
+    restore_orders_stock([order.id])
+
+
+def restore_orders_stock(order_ids):
+    """Bulk version for many cancelled/expired orders: two queries, then one ledger row per item."""
+    if not order_ids:
+        return
+    items = OrderItem.query.filter(OrderItem.order_id.in_(order_ids)).order_by(OrderItem.id).all()
+    if not items:
+        return
+    products = lock_products({item.product_id for item in items})
+    for item in items:
+        product = products.get(item.product_id)
+        if product is not None:
+            record_movement(product, item.quantity, "cancellation", order_id=item.order_id)
+
+
+def open_alerts():
+    return (
+        LowStockAlert.query.options(joinedload(LowStockAlert.product))
+        .filter(LowStockAlert.resolved_at.is_(None))
+        .order_by(LowStockAlert.stock, LowStockAlert.raised_at)
+        .all()
+    )
+
+
+def low_stock_products():
+    """Served by the ix_products_low_stock partial index."""
+    return Product.query.filter(Product.stock <= LOW_STOCK_THRESHOLD).order_by(Product.stock).all()
+
+
+def sync_alerts():
+    """
+    Seed/repair the alert table from the products currently at or below the
+    threshold (stock changed outside the ledger, or first deployment).
+    """
+    now = datetime.utcnow()
+    low = {p.id: p.stock for p in low_stock_products()}
+    alerts = {a.product_id: a for a in LowStockAlert.query.all()}
+    for product_id, stock in low.items():
+        alert = alerts.get(product_id)
+        if alert is None:
+            db.session.add(LowStockAlert(product_id=product_id, stock=stock, raised_at=now))
+        else:
+            alert.stock = stock
+            if alert.resolved_at is not None:
+                alert.raised_at, alert.resolved_at = now, None
+    for product_id, alert in alerts.items():
+        if product_id not in low and alert.resolved_at is None:
+            alert.resolved_at = now
+    db.session.commit()
+    return len(low)
+
+
+def _pack(pairs):
+    flat = array("i")
+    for product_id, stock in pairs:
+        flat.append(product_id)
+        flat.append(stock)
+    if sys.byteorder == "big":
+        flat.byteswap()
+    return zlib.compress(flat.tobytes())
+
+
+def _unpack(data):
+    flat = array("i")
+    flat.frombytes(zlib.decompress(data))
+    if sys.byteorder == "big":
+        flat.byteswap()
+    return dict(zip(flat[::2], flat[1::2]))
+
+
+def take_snapshot():
+    """
+    Store the whole catalog's stock levels as one compact row. The ledger
+    watermark and the stock levels are read from the same MVCC snapshot so
+    replaying movements after ``last_movement_id`` never double-counts.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    last_id = db.session.query(func.max(StockMovement.id)).scalar() or 0
+    rows = db.session.query(Product.id, Product.stock).order_by(Product.id).all()
+    snapshot = InventorySnapshot(
+        taken_at=datetime.utcnow(),
+        last_movement_id=last_id,
+        product_count=len(rows),
+        data=_pack(rows),
+    )
+    db.session.add(snapshot)
+    db.session.commit()
+    logger.info(f"Inventory snapshot {snapshot.id}: {len(rows)} products up to movement {last_id}")
+    return snapshot
+
+
+def stock_as_of(product_id, at):
+    """Stock of one product at time ``at``: at most two index probes on the ledger."""
+    last = (
+        StockMovement.query.filter(StockMovement.product_id == product_id, StockMovement.created_at <= at)
+        .order_by(StockMovement.created_at.desc(), StockMovement.id.desc())
+        .first()
+    )
+    if last is not None:
+        return last.stock_after
+
+    first_after = (
+        StockMovement.query.filter(StockMovement.product_id == product_id, StockMovement.created_at > at)
+        .order_by(StockMovement.created_at, StockMovement.id)
+        .first()
+    )
+    if first_after is not None:
+        return first_after.stock_after - first_after.delta
+
+    product = Product.query.get(product_id)
+    return product.stock if product else None
+
+
+def inventory_as_of(at):
+    """
+    Stock of every product at time ``at``: the newest snapshot taken at or
+    before ``at`` plus one grouped sum over the movements recorded since.
+    Without a snapshot, current stock is rolled back over later movements.
+    """
+    snapshot = (
+        InventorySnapshot.query.filter(InventorySnapshot.taken_at <= at)
+        .order_by(InventorySnapshot.taken_at.desc())
+        .first()
+    )
+    if snapshot is not None:
+        stock = _unpack(snapshot.data)
+        deltas = (
+            db.session.query(StockMovement.product_id, func.sum(StockMovement.delta))
+            .filter(StockMovement.id > snapshot.last_movement_id, StockMovement.created_at <= at)
+            .group_by(StockMovement.product_id)
+        )
+        for product_id, delta in deltas:
+            stock[product_id] = stock.get(product_id, 0) + delta
+        return stock
+
+    stock = dict(db.session.query(Product.id, Product.stock).filter(Product.created_at <= at))
+    deltas = (
+        db.session.query(StockMovement.product_id, func.sum(StockMovement.delta))
+        .filter(StockMovement.created_at > at)
+        .group_by(StockMovement.product_id)
+    )
+    for product_id, delta in deltas:
+        if product_id in stock:
+            stock[product_id] -= delta
+    return stock
+
+
+inventory_cli = AppGroup("inventory", help="Stock ledger, snapshots and low-stock alerts.")
+
+
+@inventory_cli.command("snapshot")
+def snapshot_command():
+    """Take a compact snapshot of all stock levels (run periodically)."""
+    snapshot = take_snapshot()
+    click.echo(f"Snapshot {snapshot.id}: {snapshot.product_count} products, {len(snapshot.data)} bytes.")
+
+
+@inventory_cli.command("restock")
+@click.argument("product_id", type=int)
+@click.argument("quantity", type=int)
+def restock_command(product_id, quantity):
+    """Add QUANTITY units of PRODUCT_ID to stock."""
+    product = Product.query.get(product_id)
+    if product is None:
+        raise click.ClickException(f"Product {product_id} not found.")
+    restock(product, quantity)
+    db.session.commit()
+    click.echo(f"{product.name}: stock is now {product.stock}.")
+
+
+@inventory_cli.command("alerts")
+def alerts_command():
+    """List open low-stock alerts."""
+    for alert in open_alerts():
+        click.echo(f"{alert.product_id}\t{alert.stock}\t{alert.raised_at:%Y-%m-%d %H:%M}\t{alert.product.name}")
+
+
+@inventory_cli.command("sync-alerts")
+def sync_alerts_command():
+    """Rebuild open alerts from the low-stock partial index."""
+    click.echo(f"{sync_alerts()} products at or below {LOW_STOCK_THRESHOLD}.")
+
+
+def init_app(app):
+    app.cli.add_command(inventory_cli)
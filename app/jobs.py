@@ -0,0 +1,312 @@
+# app/jobs.py
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, insert, or_, update
+
+from . import carriers, tracking
+from .db import db
+from .models import Order, OutboxJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 10
+# A job still "running" after this long is assumed lost with its worker and is claimed again.
+VISIBILITY_TIMEOUT = 300
+REPORT_EVERY = 30
+
+_handlers = {}
+
+
+def handler(kind):
+    """Register the function that runs jobs of ``kind``; it receives the decoded payload."""
+    def decorator(f):
+        _handlers[kind] = f
+        return f
+    return decorator
+
+
+def _job_values(kind, payload, delay, max_attempts):
+    return {
+        "kind": kind,
+        "payload": json.dumps(payload or {}),
+        "run_after": datetime.utcnow() + timedelta(seconds=delay),
+        "max_attempts": max_attempts,
+    }
+
+
+def enqueue(kind, payload=None, delay=0, max_attempts=MAX_ATTEMPTS):
+    """
+    Add a job to the outbox in the caller's transaction: it becomes visible
+    to the worker only if the change that caused it commits.
+    """
+    job = OutboxJob(**_job_values(kind, payload, delay, max_attempts))
+    db.session.add(job)
+    return job
+
+
+def enqueue_many(kind, payloads, delay=0, max_attempts=MAX_ATTEMPTS):
+    """Like ``enqueue`` for one job per payload, added with a single INSERT."""
+    rows = [_job_values(kind, payload, delay, max_attempts) for payload in payloads]
+    if rows:
+        db.session.execute(insert(OutboxJob), rows)
+
+
+def claim(limit):
+    """
+    Lock up to ``limit`` due jobs with FOR UPDATE SKIP LOCKED, mark them
+    running and commit, so concurrent workers never pick the same job.
+    Returns ``(id, kind, payload, attempts, max_attempts)`` rows.
+    """
+    now = datetime.utcnow()
+    rows = (
+        db.session.query(OutboxJob.id, OutboxJob.kind, OutboxJob.payload,
+                         OutboxJob.attempts, OutboxJob.max_attempts)
+        .filter(or_(
+            and_(OutboxJob.status == "pending", OutboxJob.run_after <= now),
+            and_(OutboxJob.status == "running",
+                 OutboxJob.locked_at < now - timedelta(seconds=VISIBILITY_TIMEOUT)),
+        ))
+        .order_by(OutboxJob.run_after, OutboxJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if rows:
+        db.session.execute(
+            update(OutboxJob)
+            .where(OutboxJob.id.in_([row.id for row in rows]))
+            .values(status="running", locked_at=now, attempts=OutboxJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return [(row.id, row.kind, row.payload, row.attempts + 1, row.max_attempts) for row in rows]
+
+
+def _finish(job_id, **values):
+    db.session.execute(
+        update(OutboxJob)
+        .where(OutboxJob.id == job_id)
+        .values(locked_at=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def run_job(job):
+    """
+    Run one claimed job. The handler's writes and the "done" mark commit
+    together; on error they are rolled back and the job is retried with
+    exponential backoff until ``max_attempts``, then left as "failed".
+    Returns "done", "retry" or "failed".
+    """
+    job_id, kind, payload, attempts, max_attempts = job
+    try:
+        run = _handlers.get(kind)
+        if run is None:
+            raise LookupError(f"No handler registered for job kind {kind!r}")
+        run(json.loads(payload))
+        _finish(job_id, status="done", finished_at=datetime.utcnow(), last_error=None)
+        db.session.commit()
+        return "done"
+    except Exception as exc:
+        db.session.rollback()
+        error = f"{type(exc).__name__}: {exc}"
+        if attempts >= max_attempts:
+            logger.error(f"Job {job_id} ({kind}) failed permanently after {attempts} attempts: {error}")
+            _finish(job_id, status="failed", finished_at=datetime.utcnow(), last_error=error)
+            result = "failed"
+        else:
+            delay = RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+            logger.warning(f"Job {job_id} ({kind}) attempt {attempts} failed, retrying in {delay}s: {error}")
+            _finish(job_id, status="pending", run_after=datetime.utcnow() + timedelta(seconds=delay),
+                    last_error=error)
+            result = "retry"
+        db.session.commit()
+        return result
+
+
+class WorkerStats:
+    """Throughput counters shared by the worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = self._last_report = time.monotonic()
+        self.counts = {"done": 0, "retry": 0, "failed": 0}
+        self.busy_seconds = 0.0
+
+    def record(self, result, seconds):
+        with self._lock:
+            self.counts[result] += 1
+            self.busy_seconds += seconds
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            total = sum(self.counts.values())
+            avg_ms = self.busy_seconds / total * 1000 if total else 0.0
+            return (
+                f"{self.counts['done']} done, {self.counts['retry']} retried, "
+                f"{self.counts['failed']} failed in {elapsed:.1f}s "
+                f"({total / elapsed if elapsed else 0:.1f} jobs/s, avg {avg_ms:.1f} ms/job)"
+            )
+
+    def maybe_report(self, every=REPORT_EVERY):
+        now = time.monotonic()
+        if now - self._last_report >= every:
+            self._last_report = now
+            logger.info(f"Jobs: {self.summary()}")
+
+
+def _run_in_context(app, job, stats):
+    start = time.perf_counter()
+    with app.app_context():
+        result = run_job(job)
+    stats.record(result, time.perf_counter() - start)
+    return result
+
+
+def run_worker(app, threads=4, prefetch=None, poll=1.0, once=False):
+    """
+    Claim due jobs and run them on a thread pool, keeping at most
+    ``prefetch`` (default 2 × threads) claimed at a time. With ``once`` the
+    worker exits when the queue is drained instead of polling forever.
+    """
+    capacity = prefetch or threads * 2
+    stats = WorkerStats()
+    inflight = set()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="jobs") as pool:
+        try:
+            while True:
+                free = capacity - len(inflight)
+                jobs = []
+                if free > 0:
+                    with app.app_context():
+                        jobs = claim(free)
+                for job in jobs:
+                    inflight.add(pool.submit(_run_in_context, app, job, stats))
+
+                if not jobs and not inflight:
+                    if once:
+                        break
+                    time.sleep(poll)
+                elif not jobs or len(inflight) >= capacity:
+                    _, inflight = wait(inflight, timeout=poll, return_when=FIRST_COMPLETED)
+                stats.maybe_report()
+        except KeyboardInterrupt:
+            logger.info(f"Stopping, waiting for {len(inflight)} running jobs")
+            wait(inflight)
+    logger.info(f"Jobs: {stats.summary()}")
+    return stats
+
+
+@handler("order.paid")
+def order_paid(payload):
+    """
+    Book the carrier voucher for a paid order and start tracking it. A
+    CarrierError fails the job, which is retried with backoff; an order that
+    already has a voucher (a retry after the booking committed, or one made
+    from /delivery/create-voucher) is left alone. The order row stays locked
+    until the job commits (see tracking.book).
+    """
+    order = tracking.lock_order(payload["order_id"])
+    if order is None:
+        return
+    logger.info(f"Order {order.id} paid: confirmation for {order.user.email} ({order.total_cents} cents)")
+    if not order.shipping_carrier:
+        return
+    if order.shipping_carrier not in carriers.names():
+        logger.warning(f"Order {order.id}: no carrier plugin for {order.shipping_carrier}; voucher not booked")
+        return
+    carrier = carriers.get(order.shipping_carrier)
+    try:
+        shipment, created = tracking.book(order, carrier)
+    except NotImplementedError:
+        logger.warning(f"Order {order.id}: {carrier.name} cannot book vouchers")
+        return
+    if created:
+        logger.info(f"Order {order.id}: {carrier.name} voucher {shipment.voucher_number}")
+
+
+@handler("order.cancelled")
+def order_cancelled(payload):
+    """Cancel the order's open voucher at the carrier, if one was booked."""
+    order = Order.query.get(payload["order_id"])
+    if order is None:
+        return
+    logger.info(f"Order {order.id} cancelled: notification for {order.user.email}")
+    shipment = tracking.for_order(order.id)
+    if shipment is None or not shipment.is_open or shipment.carrier not in carriers.names():
+        return
+    try:
+        carriers.get(shipment.carrier).cancel(shipment.voucher_number)
+    except NotImplementedError:
+        logger.warning(f"Order {order.id}: {shipment.carrier} voucher {shipment.voucher_number} must be cancelled by hand")
+        return
+    tracking.close(shipment.carrier, shipment.voucher_number, "cancelled")
+
+
+jobs_cli = AppGroup("jobs", help="Outbox job queue.")
+
+
+@jobs_cli.command("worker")
+@click.option("--threads", default=4, show_default=True, help="Jobs run in parallel.")
+@click.option("--prefetch", type=int, help="Jobs claimed ahead (default 2 x threads).")
+@click.option("--poll", default=1.0, show_default=True, help="Seconds between polls when idle.")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+def worker_command(threads, prefetch, poll, once):
+    """Run queued jobs."""
+    stats = run_worker(current_app._get_current_object(), threads, prefetch, poll, once)
+    click.echo(stats.summary())
+
+
+@jobs_cli.command("stats")
+def stats_command():
+    """Job counts per status and the age of the oldest due job."""
+    for status, count in db.session.query(OutboxJob.status, func.count(OutboxJob.id)).group_by(OutboxJob.status):
+        click.echo(f"{status}\t{count}")
+    oldest = (
+        db.session.query(func.min(OutboxJob.run_after))
+        .filter(OutboxJob.status == "pending", OutboxJob.run_after <= datetime.utcnow())
+        .scalar()
+    )
+    if oldest:
+        click.echo(f"oldest due job waiting {(datetime.utcnow() - oldest).total_seconds():.0f}s")
+
+
+@jobs_cli.command("retry")
+@click.argument("job_ids", type=int, nargs=-1)
+def retry_command(job_ids):
+    """Requeue failed jobs (all of them when no ids are given)."""
+    query = update(OutboxJob).where(OutboxJob.status == "failed")
+    if job_ids:
+        query = query.where(OutboxJob.id.in_(job_ids))
+    result = db.session.execute(
+        query.values(status="pending", attempts=0, run_after=datetime.utcnow(), finished_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    click.echo(f"Requeued {result.rowcount} jobs.")
+
+
+@jobs_cli.command("purge")
+@click.option("--days", default=7, show_default=True, help="Delete finished jobs older than this.")
+def purge_command(days):
+    """Delete completed jobs."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    count = OutboxJob.query.filter(OutboxJob.status == "done", OutboxJob.finished_at < cutoff).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    click.echo(f"Deleted {count} jobs.")
+
+
+def init_app(app):
+    app.cli.add_command(jobs_cli)
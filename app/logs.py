@@ -0,0 +1,229 @@
+# app/logs.py
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+try:
+    import orjson  # optional: faster serialisation of every record
+except ImportError:
+    orjson = None
+
+# Records waiting for the writer thread. When it falls this far behind,
+# new records are dropped (and counted) rather than blocking requests.
+QUEUE_SIZE = 10000
+REQUEST_ID_HEADER = "X-Request-ID"
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+_CONTEXT_FIELDS = ("request_id", "user_id")
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+_dropped = 0
+_debug_sample_rate = 0.0
+# The current request's log context, so the filter avoids Flask's proxies
+_context = contextvars.ContextVar("log_context", default=None)
+
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode()
+    return json.dumps(data, default=str, separators=(",", ":"))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request context and any ``extra`` fields."""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", "-") != "-":
+            data["request_id"] = record.request_id
+        if getattr(record, "user_id", None):
+            data["user_id"] = record.user_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key not in _CONTEXT_FIELDS:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return _dumps(data)
+
+
+class _RequestContext:
+    __slots__ = ("request_id", "debug_sampled", "g")
+
+    def __init__(self, request_id, debug_sampled, globals_):
+        self.request_id = request_id
+        self.debug_sampled = debug_sampled
+        self.g = globals_
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamp records with the request id and user while still on the request
+    thread, and sample DEBUG records. Sampling is decided once per request,
+    so a sampled request keeps all of its DEBUG lines.
+    """
+
+    def filter(self, record):
+        context = _context.get()
+        if context is not None:
+            record.request_id = context.request_id
+            # Only a user Flask-Login already loaded: logging must not query
+            record.user_id = getattr(getattr(context.g, "_login_user", None), "id", None)
+            sampled = context.debug_sampled
+        else:
+            record.request_id, record.user_id = "-", None
+            sampled = None
+        if record.levelno > logging.DEBUG:
+            return True
+        if sampled is None:
+            sampled = random.random() < _debug_sample_rate
+        return sampled
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Hands records to the writer thread. The message is rendered here, so
+    arguments are captured as they were at the call, but formatting and I/O
+    happen on the writer thread. A full queue drops the record.
+    """
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+def dropped():
+    """Records dropped so far because the writer thread could not keep up."""
+    return _dropped
+
+
+def _assign_request_id():
+    incoming = request.headers.get(REQUEST_ID_HEADER, "")
+    # Not a secret, so no need for uuid4's os.urandom call on every request
+    g.request_id = incoming if _REQUEST_ID.match(incoming) else f"{random.getrandbits(64):016x}"
+    g.debug_sampled = random.random() < _debug_sample_rate
+    _context.set(_RequestContext(g.request_id, g.debug_sampled, g._get_current_object()))
+
+
+def _clear_context(exc):
+    _context.set(None)
+
+
+def _echo_request_id(response):
+    request_id = g.get("request_id")
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+def _target_handler(app):
+    path = app.config.get("LOG_FILE")
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    if app.config.get("LOG_FORMAT") == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    return handler
+
+
+def _stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_in_child():
+    # A fork (gunicorn --preload) copies the queue but not the writer thread
+    global _listener
+    if _listener is not None:
+        _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def configure(app):
+    """
+    Route all logging through one queue drained by a writer thread. Replaces
+    any earlier configuration, so creating a second app (tests, benchmarks)
+    reconfigures instead of duplicating output.
+    """
+    global _listener, _handler, _debug_sample_rate
+    level = logging.getLevelName(str(app.config.get("LOG_LEVEL") or ("DEBUG" if app.debug else "INFO")).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown LOG_LEVEL {app.config.get('LOG_LEVEL')!r}")
+    sample_rate = float(app.config.get("LOG_DEBUG_SAMPLE_RATE") or 0)
+    if sample_rate and level > logging.DEBUG:
+        # Sampled DEBUG records must get past the logger level to be sampled
+        level = logging.DEBUG
+    elif level <= logging.DEBUG and not sample_rate:
+        sample_rate = 1.0
+
+    with _lock:
+        root = logging.getLogger()
+        _stop()
+        if _handler is not None:
+            root.removeHandler(_handler)
+        for handler in list(root.handlers):
+            # Handlers from an earlier logging.basicConfig()
+            root.removeHandler(handler)
+
+        log_queue = queue.Queue(app.config.get("LOG_QUEUE_SIZE", QUEUE_SIZE))
+        _debug_sample_rate = sample_rate
+        _handler = AsyncHandler(log_queue)
+        _handler.addFilter(ContextFilter())
+        root.addHandler(_handler)
+        root.setLevel(level)
+        _listener = QueueListener(log_queue, _target_handler(app), respect_handler_level=True)
+        _listener.start()
+
+
+def init_app(app):
+    """
+    LOG_LEVEL (INFO, DEBUG in debug mode), LOG_FORMAT ("json", or "text" in
+    debug mode), LOG_FILE (stderr by default) and LOG_DEBUG_SAMPLE_RATE (the
+    share of requests whose DEBUG records are kept at INFO level; 0 drops
+    them at the logger, before their arguments are formatted).
+    """
+    app.config.setdefault("LOG_FORMAT", "text" if app.debug else "json")
+    configure(app)
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
+    app.teardown_request(_clear_context)
+
+
+atexit.register(_stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
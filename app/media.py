@@ -0,0 +1,281 @@
+# app/media.py
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import Blueprint, current_app, send_from_directory, url_for
+from flask.cli import AppGroup
+from sqlalchemy import func
+
+from . import jobs
+from .db import db
+from .models import ProductImage
+
+try:
+    from PIL import Image, ImageOps  # optional: without it originals are served as they are
+except ImportError:
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Widths generated for every image (never upscaled); listings ask for ~320px,
+# the product page for ~640px, and srcset lets the browser pick by density.
+VARIANT_WIDTHS = (160, 320, 640, 1024)
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+# Files are named by content hash, so a URL always means the same bytes
+CACHE_SECONDS = 365 * 24 * 3600
+BATCH_SIZE = 50
+
+# Recognised by magic bytes rather than by the client's filename or MIME type
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+media = Blueprint("media", __name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class MediaError(ValueError):
+    pass
+
+
+def media_root():
+    return current_app.config.get("MEDIA_ROOT") or os.path.join(current_app.instance_path, "media")
+
+
+def _sniff(data):
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return None
+
+
+def _write_once(root, relative, data):
+    """Write a content-addressed file unless it already exists (same name, same bytes)."""
+    path = os.path.join(root, relative)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_upload(product_id, stream, alt=None):
+    """
+    Store an uploaded image and queue its variants (in the caller's
+    transaction). Returns the new ProductImage; raises MediaError for files
+    that are too large or not an image.
+    """
+    data = stream.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise MediaError(f"Images are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    extension = _sniff(data)
+    if extension is None:
+        raise MediaError("Only JPEG, PNG, GIF and WebP images can be uploaded.")
+
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    original = f"{digest[:2]}/{digest}.{extension}"
+    _write_once(media_root(), original, data)
+
+    position = db.session.query(func.max(ProductImage.position)).filter(ProductImage.product_id == product_id).scalar()
+    image = ProductImage(product_id=product_id, original=original, alt=alt,
+                         position=0 if position is None else position + 1)
+    db.session.add(image)
+    db.session.flush()
+    jobs.enqueue("media.variants", {"image_id": image.id})
+    return image
+
+
+def render_variants(root, original, widths=VARIANT_WIDTHS):
+    """
+    Resize one original into every width below its own, as WebP and JPEG.
+    Runs in a pool process, so it only takes and returns plain values:
+    ``(width, height, {width: {"webp": path, "jpeg": path}})``.
+    """
+    stem = original.rsplit(".", 1)[0]
+    with Image.open(os.path.join(root, original)) as source:
+        # EXIF orientations 5-8 are rotated by 90 degrees
+        width, height = source.size if source.getexif().get(0x0112, 1) < 5 else source.size[::-1]
+        targets = [w for w in widths if w < width] or [width]
+        # Let the JPEG decoder downscale by a power of two before we resize
+        source.draft("RGB", (max(targets), max(targets)))
+        im = ImageOps.exif_transpose(source)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info or im.mode in ("LA", "PA") else "RGB")
+
+        variants = {}
+        for target in targets:
+            resized = im.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+            paths = {"webp": f"{stem}-{target}.webp", "jpeg": f"{stem}-{target}.jpg"}
+            resized.save(os.path.join(root, paths["webp"]), "WEBP", quality=WEBP_QUALITY, method=4)
+            if resized.mode == "RGBA":
+                flat = Image.new("RGB", resized.size, (255, 255, 255))
+                flat.paste(resized, mask=resized.getchannel("A"))
+                resized = flat
+            resized.save(os.path.join(root, paths["jpeg"]), "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            variants[str(target)] = paths
+    return width, height, variants
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: the job worker is multi-threaded, and forking a threaded process is unsafe
+                _pool = ProcessPoolExecutor(
+                    max_workers=current_app.config.get("MEDIA_PROCESSES") or os.cpu_count(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def process(images):
+    """
+    Generate the variants of ``images`` in the process pool, all in parallel,
+    and record the results on the rows (the caller commits). Returns the
+    number that failed.
+    """
+    if Image is None:
+        logger.warning("Pillow is not installed; serving original images without variants")
+        for image in images:
+            image.status = "ready"
+        return 0
+
+    root = media_root()
+    futures = [(image, _get_pool().submit(render_variants, root, image.original)) for image in images]
+    failed = 0
+    for image, future in futures:
+        try:
+            image.width, image.height, variants = future.result()
+        except Exception as e:
+            logger.error(f"Image {image.id} ({image.original}) could not be processed: {e}")
+            image.status = "failed"
+            failed += 1
+            continue
+        image.variants = json.dumps(variants)
+        image.status = "ready"
+    return failed
+
+
+@jobs.handler("media.variants")
+def variants_job(payload):
+    image = ProductImage.query.get(payload["image_id"])
+    if image is not None and image.status != "ready":
+        process([image])
+
+
+def primary_images(product_ids):
+    """The first ready image of each product, {product_id: ProductImage}, in one query."""
+    if not product_ids:
+        return {}
+    images = {}
+    query = (
+        ProductImage.query.filter(ProductImage.product_id.in_(set(product_ids)), ProductImage.status == "ready")
+        .order_by(ProductImage.product_id, ProductImage.position)
+    )
+    for image in query:
+        images.setdefault(image.product_id, image)
+    return images
+
+
+def product_images(product_id):
+    return (
+        ProductImage.query.filter_by(product_id=product_id, status="ready")
+        .order_by(ProductImage.position)
+        .all()
+    )
+
+
+def media_url(path):
+    base = current_app.config.get("MEDIA_URL")
+    if base:
+        return f"{base.rstrip('/')}/{path}"
+    return url_for("media.send_media", filename=path)
+
+
+def _variants(image):
+    return sorted((int(width), paths) for width, paths in json.loads(image.variants or "{}").items())
+
+
+def image_srcset(image, fmt="jpeg"):
+    return ", ".join(f"{media_url(paths[fmt])} {width}w" for width, paths in _variants(image))
+
+
+def image_src(image, width=320):
+    """The smallest variant at least ``width`` wide (else the largest), or the original."""
+    variants = _variants(image)
+    if not variants:
+        return media_url(image.original)
+    for variant_width, paths in variants:
+        if variant_width >= width:
+            return media_url(paths["jpeg"])
+    return media_url(variants[-1][1]["jpeg"])
+
+
+def image_size(image, width=320):
+    """``(width, height)`` for the img tag at ``width``, so the layout does not shift while loading."""
+    if not image.width or not image.height:
+        return None, None
+    width = min(width, image.width)
+    return width, round(image.height * width / image.width)
+
+
+@media.route("/media/<path:filename>")
+def send_media(filename):
+    response = send_from_directory(media_root(), filename, max_age=CACHE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+media_cli = AppGroup("media", help="Product images.")
+
+
+@media_cli.command("process")
+@click.option("--all", "everything", is_flag=True, help="Regenerate every image, not just pending/failed ones.")
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+def process_command(everything, batch_size):
+    """Generate missing image variants in a process pool (e.g. after changing VARIANT_WIDTHS)."""
+    query = ProductImage.query
+    if not everything:
+        query = query.filter(ProductImage.status != "ready")
+    ids = [row.id for row in query.with_entities(ProductImage.id).order_by(ProductImage.id)]
+    done = failed = 0
+    for start in range(0, len(ids), batch_size):
+        images = ProductImage.query.filter(ProductImage.id.in_(ids[start:start + batch_size])).all()
+        failed += process(images)
+        db.session.commit()
+        done += len(images)
+        click.echo(f"{done}/{len(ids)} processed, {failed} failed")
+
+
+@media_cli.command("stats")
+def stats_command():
+    """Count images by status."""
+    for status, count in db.session.query(ProductImage.status, func.count()).group_by(ProductImage.status):
+        click.echo(f"{status}\t{count}")
+
+
+def init_app(app):
+    app.register_blueprint(media)
+    app.add_template_global(image_src, "image_src")
+    app.add_template_global(image_srcset, "image_srcset")
+    app.add_template_global(image_size, "image_size")
+    app.cli.add_command(media_cli)
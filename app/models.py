@@ -1,8 +1,40 @@
 # app/models.py
 from .db import db
+from flask import current_app
 from flask_login import UserMixin
 from datetime import datetime
+from enum import Enum
+from functools import lru_cache
 from werkzeug.security import generate_password_hash, check_password_hash
+from .helper import to_cents, from_cents
+
+DEFAULT_PASSWORD_HASH_METHOD = "pbkdf2:sha256"
+
+
+class OrderStatus(str, Enum):
+    """Stored as the plain string value, so existing rows and templates are unaffected."""
+    PENDING = "Pending"
+    COMPLETED = "Completed"
+    CANCELLED = "Cancelled"
+    EXPIRED = "Expired"
+
+
+class PaymentStatus(str, Enum):
+    PENDING = "Pending"
+    PAID = "Paid"
+    FAILED = "Failed"
+    REFUNDED = "Refunded"
+
+
+def password_hash_method():
+    return current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_PASSWORD_HASH_METHOD)
+
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    """Fully-qualified method as werkzeug writes it, e.g. "pbkdf2:sha256" -> "pbkdf2:sha256:1000000"."""
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
@@ -15,12 +47,21 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     role = db.Column(db.String(50), default="user")
+    # Bumped whenever existing sessions must stop being trusted (e.g. role change)
+    auth_version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    def get_id(self):
+        return f"{self.id}:{self.auth_version or 1}"
 
     def set_password(self, password):
-        self.password = generate_password_hash(password, method="pbkdf2:sha256")
+        self.password = generate_password_hash(password, method=password_hash_method())
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return bool(self.password) and check_password_hash(self.password, password)
+
+    def password_needs_rehash(self):
+        """True when the stored hash was made with other parameters than PASSWORD_HASH_METHOD."""
+        return bool(self.password) and self.password.split("$", 1)[0] != _hash_prefix(password_hash_method())
 
     def is_admin(self):
         return self.role == "admin"
@@ -31,36 +72,83 @@ class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey("categories.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     products = db.relationship("Product", backref="category", lazy=True)
+    children = db.relationship("Category", backref=db.backref("parent", remote_side=[id]), lazy=True)
 
     def __repr__(self):
         return f"<Category {self.name}>"
 
+# Products at or below this stock level are "low stock" (partial index + alerts)
+LOW_STOCK_THRESHOLD = 5
+
 class Product(db.Model):
     __tablename__ = "products"
+    __table_args__ = (
+        db.Index(
+            "ix_products_low_stock", "stock",
+            postgresql_where=db.text(f"stock <= {LOW_STOCK_THRESHOLD}"),
+            sqlite_where=db.text(f"stock <= {LOW_STOCK_THRESHOLD}"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    price = db.Column(db.Float, nullable=False)
+    price_cents = db.Column(db.Integer, nullable=False)
     stock = db.Column(db.Integer, nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey("categories.id"), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey("categories.id"), nullable=False, index=True)
+    # Shipping metrics as integer grams/millimetres; NULL means "not measured yet"
+    weight_grams = db.Column(db.Integer, nullable=True)
+    length_mm = db.Column(db.Integer, nullable=True)
+    width_mm = db.Column(db.Integer, nullable=True)
+    height_mm = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    @property
+    def price(self):
+        return from_cents(self.price_cents)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = to_cents(value)
+
+    @property
+    def weight(self):
+        """Weight in kg (what the carrier APIs expect), or None if unknown."""
+        return None if self.weight_grams is None else self.weight_grams / 1000
+
+    @weight.setter
+    def weight(self, value):
+        self.weight_grams = None if value is None else round(value * 1000)
+
     def __repr__(self):
         return f"<Product {self.name}>"
 
 class Order(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        db.Index("ix_orders_status_created", "status", "created_at"),
+        db.Index("ix_orders_user_created", "user_id", "created_at"),
+        db.Index(
+            "ix_orders_basket_uncounted", "id",
+            postgresql_where=db.text("NOT basket_counted"),
+            sqlite_where=db.text("NOT basket_counted"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(50), default="Pending")  
-    payment_status = db.Column(db.String(50), default="Pending") 
+    subtotal_cents = db.Column(db.Integer, nullable=False, default=0)
+    discount_cents = db.Column(db.Integer, nullable=False, default=0)
+    tax_cents = db.Column(db.Integer, nullable=False, default=0)
+    shipping_cents = db.Column(db.Integer, nullable=False, default=0)
+    total_cents = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(50), default=OrderStatus.PENDING.value)
+    payment_status = db.Column(db.String(50), default=PaymentStatus.PENDING.value)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     shipping_address = db.Column(db.String(255), nullable=True)
@@ -70,13 +158,34 @@ class Order(db.Model):
     shipping_floor = db.Column(db.String(10), nullable=True)  
     shipping_zipcode = db.Column(db.String(10), nullable=True)  
     shipping_region = db.Column(db.String(100), nullable=True)  
+    # Carrier plugin name chosen at checkout; the order.paid job books its voucher
+    shipping_carrier = db.Column(db.String(20), nullable=True)
+    # Set once the basket has been folded into the recommendation matrix
+    basket_counted = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     user = db.relationship("User", backref="orders")
     items = db.relationship("OrderItem", backref="order", lazy=True)
 
+    @property
+    def total_amount(self):
+        return from_cents(self.total_cents)
+
     def __repr__(self):
         return f"<Order {self.id}>"
 
+class OrderStatusHistory(db.Model):
+    __tablename__ = "order_status_history"
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
+    from_status = db.Column(db.String(50), nullable=True)
+    to_status = db.Column(db.String(50), nullable=False)
+    reason = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<OrderStatusHistory {self.order_id}: {self.from_status} -> {self.to_status}>"
+
 class OrderItem(db.Model):
     __tablename__ = "order_items"
 
@@ -84,10 +193,14 @@ class OrderItem(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    unit_price = db.Column(db.Float, nullable=False) 
+    unit_price_cents = db.Column(db.Integer, nullable=False)
 
     product = db.relationship("Product", backref="order_items")
 
+    @property
+    def unit_price(self):
+        return from_cents(self.unit_price_cents)
+
     def __repr__(self):
         return f"<OrderItem {self.id}>"
 
@@ -103,10 +216,20 @@ class Config(db.Model):
 
 class Setting(db.Model):
     __tablename__ = "settings"
+    # One override per user and key; NULLs are distinct in a unique constraint,
+    # so global settings (user_id IS NULL) get their own partial unique index.
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "key", name="uq_settings_user_key"),
+        db.Index(
+            "uq_settings_global_key", "key", unique=True,
+            postgresql_where=db.text("user_id IS NULL"),
+            sqlite_where=db.text("user_id IS NULL"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)  
-    key = db.Column(db.String(100), unique=True, nullable=False)
+    key = db.Column(db.String(100), nullable=False)
     value = db.Column(db.String(500), nullable=False)
     description = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -116,4 +239,276 @@ class Setting(db.Model):
 
     def __repr__(self):
         return f"<Setting {self.key}: {self.value}>"
-        
\ No newline at end of file
+        
+
+class ProductRecommendation(db.Model):
+    """Precomputed top-K neighbours for one product, stored as comma-separated ids."""
+    __tablename__ = "product_recommendations"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    bought_together = db.Column(db.String(255), nullable=False, default="")
+    related = db.Column(db.String(255), nullable=False, default="")
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def split_ids(value):
+        return [int(x) for x in value.split(",") if x] if value else []
+
+    def __repr__(self):
+        return f"<ProductRecommendation {self.product_id}>"
+
+class ProductCooccurrence(db.Model):
+    """Sparse co-occurrence matrix over order baskets; both (a, b) and (b, a) are stored."""
+    __tablename__ = "product_cooccurrence"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey("products.id"), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ProductCooccurrence {self.product_id}-{self.other_id}: {self.count}>"
+
+class RecommendationRun(db.Model):
+    __tablename__ = "recommendation_runs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), nullable=False)
+    # Highest order id counted by the run; the orders themselves carry basket_counted
+    last_order_id = db.Column(db.Integer, nullable=False, default=0)
+    orders_scanned = db.Column(db.Integer, nullable=False, default=0)
+    products_updated = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<RecommendationRun {self.id} {self.mode}>"
+
+class StockMovement(db.Model):
+    """Append-only stock ledger; ``stock_after`` makes point-in-time lookups a single index probe."""
+    __tablename__ = "stock_movements"
+    __table_args__ = (
+        db.Index("ix_stock_movements_product_created", "product_id", "created_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    stock_after = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<StockMovement {self.product_id} {self.delta:+d} ({self.reason})>"
+
+class InventorySnapshot(db.Model):
+    """Whole-catalog stock levels packed into one compressed blob of (product_id, stock) pairs."""
+    __tablename__ = "inventory_snapshots"
+
+    id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<InventorySnapshot {self.id} @ {self.taken_at}>"
+
+class LowStockAlert(db.Model):
+    __tablename__ = "low_stock_alerts"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), primary_key=True)
+    stock = db.Column(db.Integer, nullable=False)
+    raised_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    resolved_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    product = db.relationship("Product")
+
+    def __repr__(self):
+        return f"<LowStockAlert {self.product_id}: {self.stock}>"
+
+class Promotion(db.Model):
+    """
+    A discount rule. ``value`` is basis points for kind="percent" (1500 = 15 %)
+    and cents for kind="fixed" (per unit for product/category scope).
+    Rules without a ``code`` apply automatically; coupons need their code.
+    """
+    __tablename__ = "promotions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    code = db.Column(db.String(50), unique=True, nullable=True)
+    kind = db.Column(db.String(20), nullable=False, default="percent")
+    value = db.Column(db.Integer, nullable=False)
+    scope = db.Column(db.String(20), nullable=False, default="cart")
+    target_id = db.Column(db.Integer, nullable=True)
+    min_subtotal_cents = db.Column(db.Integer, nullable=False, default=0)
+    usage_limit = db.Column(db.Integer, nullable=True)
+    used_count = db.Column(db.Integer, nullable=False, default=0)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    starts_at = db.Column(db.DateTime, nullable=True)
+    ends_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Promotion {self.code or self.name}>"
+
+class PromotionRedemption(db.Model):
+    __tablename__ = "promotion_redemptions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    promotion_id = db.Column(db.Integer, db.ForeignKey("promotions.id"), nullable=False, index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    discount_cents = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set when the order was cancelled and the use given back; the row stays as the audit trail
+    released_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<PromotionRedemption {self.promotion_id} order {self.order_id}>"
+
+class OutboxJob(db.Model):
+    """
+    Follow-up work written in the same transaction as the change that caused
+    it and executed later by ``flask jobs worker``. ``payload`` is JSON.
+    """
+    __tablename__ = "outbox_jobs"
+    __table_args__ = (
+        db.Index("ix_outbox_jobs_status_run_after", "status", "run_after"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<OutboxJob {self.id} {self.kind} ({self.status})>"
+
+class ArchivedOrder(db.Model):
+    """
+    A closed order moved out of the hot tables by ``flask archive orders``.
+    The summary columns serve listings; ``data`` holds the full order, its
+    items, status history and redemptions as zlib-compressed JSON.
+    On PostgreSQL the table is range-partitioned by month on ``created_at``.
+    """
+    __tablename__ = "archived_orders"
+    __table_args__ = (
+        db.Index("ix_archived_orders_user_created", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    payment_status = db.Column(db.String(50), nullable=True)
+    total_cents = db.Column(db.Integer, nullable=False, default=0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    @property
+    def total_amount(self):
+        return from_cents(self.total_cents)
+
+    def __repr__(self):
+        return f"<ArchivedOrder {self.id}>"
+
+class ShipmentTracking(db.Model):
+    """
+    Local copy of a carrier voucher's status, refreshed in batches by
+    ``flask tracking poll`` so tracking pages never wait on the carrier.
+    ``order_id`` has no foreign key so archiving orders leaves it alone.
+    """
+    __tablename__ = "shipment_tracking"
+    __table_args__ = (
+        db.UniqueConstraint("carrier", "voucher_number", name="uq_shipment_tracking_voucher"),
+        db.Index("ix_shipment_tracking_open_polled", "is_open", "polled_at"),
+        db.Index("ix_shipment_tracking_job", "carrier", "job_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    carrier = db.Column(db.String(20), nullable=False)
+    voucher_number = db.Column(db.String(64), nullable=False)
+    job_id = db.Column(db.String(64), nullable=True)
+    order_id = db.Column(db.Integer, nullable=True, index=True)
+    status = db.Column(db.String(100), nullable=True)
+    job_status = db.Column(db.String(100), nullable=True)
+    is_open = db.Column(db.Boolean, nullable=False, default=True)
+    last_error = db.Column(db.Text, nullable=True)
+    polled_at = db.Column(db.DateTime, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ShipmentTracking {self.carrier} {self.voucher_number} ({self.status})>"
+
+class ProductImage(db.Model):
+    """
+    An uploaded product image. Files are content-addressed (named after the
+    hash of their bytes), so their URLs never change meaning and can be cached
+    forever. ``variants`` is JSON: {width: {"webp": path, "jpeg": path}},
+    filled in by the ``media.variants`` job.
+    """
+    __tablename__ = "product_images"
+    __table_args__ = (
+        db.Index("ix_product_images_product_position", "product_id", "position"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    original = db.Column(db.String(255), nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    alt = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    variants = db.Column(db.Text, nullable=False, default="{}")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ProductImage {self.id} product {self.product_id} ({self.status})>"
+
+class PaymentDiscrepancy(db.Model):
+    """
+    A mismatch between an order and what Viva reports for it, found by
+    ``payments.reconcile``. ``reference`` identifies the finding (the Viva
+    transaction id, or ``order:<id>`` when there is no transaction), so a
+    re-run over the same days does not report it twice. ``corrected`` is set
+    when the reconciliation fixed the order itself. ``order_id`` has no
+    foreign key so archiving orders leaves the findings alone.
+    """
+    __tablename__ = "payment_discrepancies"
+    __table_args__ = (
+        db.UniqueConstraint("kind", "reference", name="uq_payment_discrepancies_kind_reference"),
+        db.Index("ix_payment_discrepancies_resolved_detected", "resolved_at", "detected_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    reference = db.Column(db.String(64), nullable=False)
+    order_id = db.Column(db.Integer, nullable=True, index=True)
+    transaction_id = db.Column(db.String(64), nullable=True)
+    merchant_reference = db.Column(db.String(255), nullable=True)
+    order_status = db.Column(db.String(50), nullable=True)
+    payment_status = db.Column(db.String(50), nullable=True)
+    viva_status = db.Column(db.String(10), nullable=True)
+    expected_cents = db.Column(db.Integer, nullable=True)
+    actual_cents = db.Column(db.Integer, nullable=True)
+    corrected = db.Column(db.Boolean, nullable=False, default=False)
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<PaymentDiscrepancy {self.kind} {self.reference}>"
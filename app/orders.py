@@ -0,0 +1,213 @@
+# app/orders.py
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import inventory, jobs, promotions
+from .db import db
+from .models import Order, OrderStatus, OrderStatusHistory, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+# target status -> (statuses it may be reached from, payment status it implies).
+# A Completed order is paid and on its way, so it is never cancelled here: a
+# refund is made at Viva and recorded with record_refunds, stock untouched.
+TRANSITIONS = {
+    OrderStatus.COMPLETED: ({OrderStatus.PENDING}, PaymentStatus.PAID),
+    OrderStatus.CANCELLED: ({OrderStatus.PENDING}, PaymentStatus.FAILED),
+    OrderStatus.EXPIRED: ({OrderStatus.PENDING}, PaymentStatus.FAILED),
+}
+
+# Statuses that give the order's stock and promotion uses back.
+RELEASING = {OrderStatus.CANCELLED, OrderStatus.EXPIRED}
+
+JOB_KINDS = {
+    OrderStatus.COMPLETED: "order.paid",
+    OrderStatus.CANCELLED: "order.cancelled",
+    OrderStatus.EXPIRED: "order.cancelled",
+}
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def can_transition(order, to):
+    sources, _ = TRANSITIONS[OrderStatus(to)]
+    return order.status in sources
+
+
+def record_created(order):
+    """History entry for a new (flushed) order."""
+    db.session.add(OrderStatusHistory(order_id=order.id, from_status=None, to_status=order.status, reason="checkout"))
+
+
+def transition(order, to, reason=None):
+    """
+    Move one order to ``to`` in the caller's transaction. The status change
+    is a conditional UPDATE on the current status, so a concurrent webhook
+    and sweeper cannot both act on the same order. Releases stock and
+    promotion uses for cancelling transitions, records the history row and
+    enqueues the follow-up job. Returns False if the order was changed
+    concurrently; raises InvalidTransition if ``to`` is not allowed.
+    """
+    to = OrderStatus(to)
+    current = order.status
+    if not can_transition(order, to):
+        raise InvalidTransition(f"Order {order.id}: {current} -> {to.value} is not allowed")
+
+    _, payment_status = TRANSITIONS[to]
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == current)
+        .values(status=to.value, payment_status=payment_status.value, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.session.refresh(order)
+        return False
+    set_committed_value(order, "status", to.value)
+    set_committed_value(order, "payment_status", payment_status.value)
+    set_committed_value(order, "updated_at", now)
+
+    if to in RELEASING:
+        inventory.restore_order_stock(order)
+        promotions.release(order)
+    db.session.add(OrderStatusHistory(order_id=order.id, from_status=current, to_status=to.value, reason=reason))
+    jobs.enqueue(JOB_KINDS[to], {"order_id": order.id})
+    logger.info(f"Order {order.id}: {current} -> {to.value} ({reason})")
+    return True
+
+
+def bulk_transition(from_status, to, *criteria, reason=None):
+    """
+    Move every order in ``from_status`` matching ``criteria`` to ``to`` with
+    one UPDATE ... RETURNING, then write history rows and outbox jobs with
+    one INSERT each and release stock/promotions in bulk. Returns the ids
+    that were moved; the caller commits.
+    """
+    from_status, to = OrderStatus(from_status), OrderStatus(to)
+    if from_status not in TRANSITIONS[to][0]:
+        raise InvalidTransition(f"{from_status.value} -> {to.value} is not allowed")
+
+    now = datetime.utcnow()
+    ids = db.session.execute(
+        update(Order)
+        .where(Order.status == from_status.value, *criteria)
+        .values(status=to.value, payment_status=TRANSITIONS[to][1].value, updated_at=now)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if not ids:
+        return []
+
+    if to in RELEASING:
+        inventory.restore_orders_stock(ids)
+        promotions.release_orders(ids)
+    db.session.execute(insert(OrderStatusHistory), [
+        {"order_id": order_id, "from_status": from_status.value, "to_status": to.value,
+         "reason": reason, "created_at": now}
+        for order_id in ids
+    ])
+    jobs.enqueue_many(JOB_KINDS[to], ({"order_id": order_id} for order_id in ids))
+    logger.info(f"{len(ids)} orders: {from_status.value} -> {to.value} ({reason})")
+    return ids
+
+
+def record_refunds(*criteria, reason=None):
+    """
+    Mark Completed, Paid orders matching ``criteria`` as Refunded, for refunds
+    already made at the gateway. The status stays Completed and nothing is
+    released: the goods have shipped, so their stock and promotion uses are
+    not given back. Returns the ids that were changed; the caller commits.
+    """
+    ids = db.session.execute(
+        update(Order)
+        .where(Order.status == OrderStatus.COMPLETED.value, Order.payment_status == PaymentStatus.PAID.value,
+               *criteria)
+        .values(payment_status=PaymentStatus.REFUNDED.value, updated_at=datetime.utcnow())
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if ids:
+        logger.info(f"{len(ids)} orders refunded ({reason})")
+    return ids
+
+
+def expire_stale(older_than):
+    """Expire Pending orders created before now - ``older_than`` (a timedelta); served by ix_orders_status_created."""
+    cutoff = datetime.utcnow() - older_than
+    return bulk_transition(OrderStatus.PENDING, OrderStatus.EXPIRED, Order.created_at < cutoff,
+                           reason="payment timeout")
+
+
+def history(order_id):
+    return (
+        OrderStatusHistory.query.filter_by(order_id=order_id)
+        .order_by(OrderStatusHistory.created_at, OrderStatusHistory.id)
+        .all()
+    )
+
+
+def queue(status, limit=50):
+    """Oldest orders in ``status`` first – the ops view, answered from the (status, created_at) index."""
+    return (
+        Order.query.filter(Order.status == OrderStatus(status).value)
+        .order_by(Order.created_at)
+        .limit(limit)
+        .all()
+    )
+
+
+orders_cli = AppGroup("orders", help="Order lifecycle.")
+
+
+@orders_cli.command("expire")
+@click.option("--minutes", default=60, show_default=True, help="Expire Pending orders older than this.")
+def expire_command(minutes):
+    """Expire stale Pending orders and return their stock."""
+    ids = expire_stale(timedelta(minutes=minutes))
+    db.session.commit()
+    click.echo(f"Expired {len(ids)} orders.")
+
+
+@orders_cli.command("cancel")
+@click.argument("order_id", type=int)
+@click.option("--reason", default="admin")
+def cancel_command(order_id, reason):
+    """Cancel a Pending order and return its stock."""
+    order = Order.query.get(order_id)
+    if order is None:
+        raise click.ClickException(f"Order {order_id} not found.")
+    try:
+        transition(order, OrderStatus.CANCELLED, reason=reason)
+    except InvalidTransition as exc:
+        raise click.ClickException(str(exc))
+    db.session.commit()
+    click.echo(f"Order {order_id} is now {order.status}.")
+
+
+@orders_cli.command("queue")
+@click.option("--status", default=OrderStatus.PENDING.value, show_default=True)
+@click.option("--limit", default=50, show_default=True)
+def queue_command(status, limit):
+    """List the oldest orders in a status."""
+    for order in queue(status, limit):
+        click.echo(f"{order.id}\t{order.created_at:%Y-%m-%d %H:%M}\t{order.payment_status}\t{order.total_cents}")
+
+
+@orders_cli.command("history")
+@click.argument("order_id", type=int)
+def history_command(order_id):
+    """Show an order's status transitions."""
+    for row in history(order_id):
+        click.echo(f"{row.created_at:%Y-%m-%d %H:%M:%S}\t{row.from_status} -> {row.to_status}\t{row.reason or ''}")
+
+
+def init_app(app):
+    app.cli.add_command(orders_cli)
@@ -0,0 +1,366 @@
+# app/payments.py
+import csv
+import logging
+import re
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, insert, or_, tuple_, update
+
+from . import orders
+from .db import db
+from .helper import to_cents
+from .models import Order, OrderStatus, PaymentDiscrepancy, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BATCH_SIZE = 100
+# Extra seconds past the payment timeout before an order counts as
+# abandoned, so a payment that is being completed right now is not raced.
+SWEEP_GRACE = 120
+
+# Viva order state -> what the sweeper does with the shop's Pending order
+_OUTCOMES = {
+    "paid": (OrderStatus.COMPLETED, "sweeper: paid at viva"),
+    "cancelled": (OrderStatus.CANCELLED, "sweeper: cancelled at viva"),
+    "expired": (OrderStatus.EXPIRED, "payment timeout"),
+}
+
+RECONCILE_CHUNK = 500
+# Viva transaction statusId values that matter here
+CAPTURED = "F"
+REFUNDED = "R"
+_MERCHANT_REFERENCE = re.compile(r"^Order-(\d+)$")
+
+
+def stale_pending(cutoff, batch_size, after=None):
+    """
+    One page of ``(id, created_at, transaction_id)`` for Pending orders
+    created before ``cutoff``, oldest first, resuming after the
+    ``(created_at, id)`` of ``after``; served by ix_orders_status_created.
+    """
+    query = db.session.query(Order.id, Order.created_at, Order.transaction_id).filter(
+        Order.status == OrderStatus.PENDING.value, Order.created_at < cutoff)
+    if after is not None:
+        created_at, order_id = after
+        query = query.filter(or_(Order.created_at > created_at,
+                                 and_(Order.created_at == created_at, Order.id > order_id)))
+    return query.order_by(Order.created_at, Order.id).limit(batch_size).all()
+
+
+def sweep(timeout=None, grace=SWEEP_GRACE, batch_size=SWEEP_BATCH_SIZE, workers=None):
+    """
+    Settle Pending orders whose payment window (``payment_timeout`` seconds,
+    as sent to Viva at checkout) closed without a webhook or a return to the
+    shop. Each batch asks Viva about all of its orders in parallel, then
+    moves them with one bulk transition per outcome and commits: paid orders
+    complete, cancelled and expired ones give their stock back. An order
+    that never got a Viva order code expires; one Viva still reports as
+    pending, or that could not be checked, is left for the next run.
+    ``workers`` caps the parallel Viva calls (viva.STATUS_WORKERS).
+    """
+    from .controllers.payment.viva import STATUS_WORKERS, viva_credentials, viva_order_states
+
+    if timeout is None:
+        timeout = viva_credentials()[3]
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout + grace)
+    stats = Counter()
+    after = None
+    while True:
+        rows = stale_pending(cutoff, batch_size, after)
+        if not rows:
+            break
+        after = (rows[-1].created_at, rows[-1].id)
+
+        codes = [row.transaction_id for row in rows if row.transaction_id]
+        states = viva_order_states(codes, workers or STATUS_WORKERS) if codes else {}
+        moves = {}
+        for row in rows:
+            state = states.get(row.transaction_id) if row.transaction_id else "expired"
+            if state in _OUTCOMES:
+                moves.setdefault(state, []).append(row.id)
+            else:
+                stats["unresolved" if state is None else state] += 1
+        for state, ids in moves.items():
+            to, reason = _OUTCOMES[state]
+            moved = orders.bulk_transition(OrderStatus.PENDING, to, Order.id.in_(ids), reason=reason)
+            stats[state] += len(moved)
+        db.session.commit()
+        stats["checked"] += len(rows)
+    if stats["checked"]:
+        logger.info(f"Pending order sweep: {dict(stats)}")
+    return stats
+
+
+def order_id_from_reference(merchant_trns):
+    """The order id in a ``Order-{id}`` merchant reference, or None."""
+    match = _MERCHANT_REFERENCE.match((merchant_trns or "").strip())
+    return int(match.group(1)) if match else None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _finding(kind, order=None, txn=None, **values):
+    txn = txn or {}
+    transaction_id = txn.get("transactionId")
+    return {
+        "kind": kind,
+        "reference": str(transaction_id) if transaction_id else f"order:{order.id}",
+        "order_id": order.id if order is not None else None,
+        "transaction_id": str(transaction_id) if transaction_id else None,
+        "merchant_reference": txn.get("merchantTrns"),
+        "order_status": order.status if order is not None else None,
+        "payment_status": order.payment_status if order is not None else None,
+        "viva_status": txn.get("statusId"),
+        "expected_cents": order.total_cents if order is not None else None,
+        "actual_cents": to_cents(txn["amount"]) if txn.get("amount") is not None else None,
+        **values,
+    }
+
+
+def _match(transactions, seen):
+    """
+    Join one chunk of transactions with their orders: the chunk's order ids
+    are looked up with one IN query and the rows kept in a dict, which each
+    transaction's ``Order-{id}`` reference is probed against. ``seen`` maps
+    the ids of orders with a capture or refund so far to their number of
+    captures, as an order's transactions may span chunks.
+    """
+    by_order = {}
+    findings = []
+    for txn in transactions:
+        order_id = order_id_from_reference(txn.get("merchantTrns"))
+        if order_id is None:
+            findings.append(_finding("unknown_reference", txn=txn))
+        else:
+            by_order.setdefault(order_id, []).append(txn)
+    found = {
+        row.id: row for row in db.session.query(
+            Order.id, Order.status, Order.payment_status, Order.total_cents
+        ).filter(Order.id.in_(by_order))
+    } if by_order else {}
+
+    for order_id, txns in by_order.items():
+        order = found.get(order_id)
+        if order is None:
+            findings.extend(_finding("unknown_reference", txn=txn) for txn in txns)
+            continue
+        captures = [txn for txn in txns if txn.get("statusId") == CAPTURED]
+        refunds = [txn for txn in txns if txn.get("statusId") == REFUNDED]
+        earlier = seen.get(order_id, 0)
+        if captures or refunds:
+            seen[order_id] = earlier + len(captures)
+        if captures and not earlier:
+            if order.status == OrderStatus.PENDING.value:
+                findings.append(_finding("captured_not_recorded", order, captures[0]))
+            elif order.status in (OrderStatus.CANCELLED.value, OrderStatus.EXPIRED.value) \
+                    and order.payment_status != PaymentStatus.REFUNDED.value:
+                findings.append(_finding("captured_on_closed", order, captures[0]))
+        findings.extend(_finding("amount_mismatch", order, txn) for txn in captures
+                        if to_cents(txn.get("amount") or 0) != order.total_cents)
+        findings.extend(_finding("duplicate_capture", order, txn) for txn in captures[0 if earlier else 1:])
+        if refunds and order.status == OrderStatus.COMPLETED.value \
+                and order.payment_status != PaymentStatus.REFUNDED.value:
+            findings.append(_finding("refund_not_recorded", order, refunds[0]))
+    return findings
+
+
+def _paid_without_capture(start, end, seen, chunk_size):
+    """Orders created in [start, end) and marked Paid that Viva has no capture for, in id chunks."""
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(Order.id, Order.status, Order.payment_status, Order.total_cents)
+            .filter(Order.status == OrderStatus.COMPLETED.value, Order.created_at >= start,
+                    Order.created_at < end, Order.payment_status == PaymentStatus.PAID.value,
+                    Order.id > last_id)
+            .order_by(Order.id).limit(chunk_size).all()
+        )
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield [_finding("paid_without_capture", row) for row in rows if row.id not in seen]
+
+
+def _record(findings, apply, stats):
+    """
+    Store new findings (one per kind and reference) and, with ``apply``,
+    correct what can be corrected with one bulk transition per kind.
+    """
+    if not findings:
+        return
+    keys = {(f["kind"], f["reference"]) for f in findings}
+    known = set(db.session.query(PaymentDiscrepancy.kind, PaymentDiscrepancy.reference).filter(
+        tuple_(PaymentDiscrepancy.kind, PaymentDiscrepancy.reference).in_(keys)))
+    new = {}
+    for finding in findings:
+        key = (finding["kind"], finding["reference"])
+        if key not in known:
+            new.setdefault(key, finding)
+    for kind, _ in new:
+        stats[kind] += 1
+
+    corrected = set()
+    if apply:
+        by_kind = {}
+        for finding in findings:
+            by_kind.setdefault(finding["kind"], []).append(finding["order_id"])
+        if by_kind.get("captured_not_recorded"):
+            corrected.update(orders.bulk_transition(
+                OrderStatus.PENDING, OrderStatus.COMPLETED, Order.id.in_(by_kind["captured_not_recorded"]),
+                reason="reconciliation: captured at viva"))
+        if by_kind.get("refund_not_recorded"):
+            corrected.update(orders.record_refunds(
+                Order.id.in_(by_kind["refund_not_recorded"]), reason="reconciliation: refunded at viva"))
+        stats["corrected"] += len(corrected)
+
+    now = datetime.utcnow()
+    correctable = {"captured_not_recorded", "refund_not_recorded"}
+    if new:
+        db.session.execute(insert(PaymentDiscrepancy), [
+            {**finding, "detected_at": now,
+             **({"corrected": True, "resolved_at": now}
+                if finding["kind"] in correctable and finding["order_id"] in corrected else {"corrected": False})}
+            for finding in new.values()
+        ])
+    if corrected:
+        # Findings from an earlier run without --apply
+        db.session.execute(
+            update(PaymentDiscrepancy)
+            .where(PaymentDiscrepancy.kind.in_(correctable), PaymentDiscrepancy.order_id.in_(corrected),
+                   PaymentDiscrepancy.resolved_at.is_(None))
+            .values(corrected=True, resolved_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def reconcile(start, end, apply=False, chunk_size=RECONCILE_CHUNK):
+    """
+    Check orders against the transactions Viva recorded from ``start`` to
+    ``end`` (dates, inclusive; the listing runs one day further so payments
+    made just after midnight are included). Transactions are streamed from
+    the paginated listing and matched chunk by chunk on their ``Order-{id}``
+    merchant reference. Each new finding is stored as a PaymentDiscrepancy,
+    one per kind and reference:
+
+    captured_not_recorded  captured at Viva, order still Pending
+    captured_on_closed     captured at Viva, order Cancelled or Expired (refund by hand)
+    refund_not_recorded    refunded at Viva, order still Completed and Paid
+    amount_mismatch        captured amount differs from the order total
+    duplicate_capture      more than one capture for an order
+    unknown_reference      the merchant reference names no order
+    paid_without_capture   order created in the window and marked Paid, nothing captured
+
+    With ``apply`` the not-recorded captures are corrected by a bulk
+    transition and the refunds by marking the orders Refunded. Commits per chunk; returns a Counter of new findings.
+    """
+    from .controllers.payment.viva import viva_transactions
+
+    stats = Counter()
+    seen = {}
+    for chunk in _chunks(viva_transactions(start, end + timedelta(days=1)), chunk_size):
+        stats["transactions"] += len(chunk)
+        _record(_match(chunk, seen), apply, stats)
+        db.session.commit()
+
+    window = (datetime.combine(start, datetime.min.time()),
+              datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    for findings in _paid_without_capture(*window, seen, chunk_size):
+        _record(findings, apply, stats)
+        db.session.commit()
+    logger.info(f"Payment reconciliation {start} to {end}: {dict(stats)}")
+    return stats
+
+
+def discrepancies(kind=None, include_resolved=False, limit=None):
+    """Recorded discrepancies, oldest first; only the unresolved ones unless ``include_resolved``."""
+    query = PaymentDiscrepancy.query
+    if kind:
+        query = query.filter(PaymentDiscrepancy.kind == kind)
+    if not include_resolved:
+        query = query.filter(PaymentDiscrepancy.resolved_at.is_(None))
+    query = query.order_by(PaymentDiscrepancy.detected_at, PaymentDiscrepancy.id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+payments_cli = AppGroup("payments", help="Payment follow-up.")
+
+
+@payments_cli.command("sweep")
+@click.option("--timeout", type=int, help="Payment timeout in seconds (default: the payment_timeout setting).")
+@click.option("--grace", default=SWEEP_GRACE, show_default=True, help="Extra seconds before an order is swept.")
+@click.option("--batch-size", default=SWEEP_BATCH_SIZE, show_default=True)
+@click.option("--workers", type=int, help="Parallel Viva status checks (default 8).")
+@click.option("--every", type=float, help="Keep running, sweeping every this many seconds (otherwise run once, e.g. from cron).")
+def sweep_command(timeout, grace, batch_size, workers, every):
+    """Complete, cancel or expire abandoned Pending orders according to Viva."""
+    while True:
+        stats = sweep(timeout, grace, batch_size, workers)
+        click.echo(f"checked={stats['checked']} paid={stats['paid']} cancelled={stats['cancelled']} "
+                   f"expired={stats['expired']} pending={stats['pending']} unresolved={stats['unresolved']}")
+        if not every:
+            return
+        time.sleep(every)
+
+
+@payments_cli.command("reconcile")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="First day (default: yesterday).")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last day (default: --start).")
+@click.option("--apply", is_flag=True, help="Correct unrecorded captures and refunds.")
+@click.option("--chunk-size", default=RECONCILE_CHUNK, show_default=True)
+def reconcile_command(start, end, apply, chunk_size):
+    """Compare orders with Viva's transactions and record the discrepancies."""
+    start = start.date() if start else date.today() - timedelta(days=1)
+    end = end.date() if end else start
+    stats = reconcile(start, end, apply, chunk_size)
+    click.echo(f"{stats.pop('transactions', 0)} transactions checked, {stats.pop('corrected', 0)} orders corrected.")
+    for kind, count in sorted(stats.items()):
+        click.echo(f"{kind}\t{count}")
+
+
+@payments_cli.command("discrepancies")
+@click.option("--kind", help="Only this kind.")
+@click.option("--all", "include_resolved", is_flag=True, help="Include resolved ones.")
+@click.option("--limit", type=int)
+@click.option("--csv", "as_csv", is_flag=True, help="Write CSV (e.g. for the accountant) instead of a table.")
+def discrepancies_command(kind, include_resolved, limit, as_csv):
+    """List recorded payment discrepancies."""
+    fields = ["id", "kind", "order_id", "transaction_id", "merchant_reference", "order_status",
+              "payment_status", "viva_status", "expected_cents", "actual_cents", "corrected",
+              "detected_at", "resolved_at"]
+    rows = discrepancies(kind, include_resolved, limit)
+    if as_csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(fields)
+        writer.writerows([getattr(row, field) for field in fields] for row in rows)
+        return
+    for row in rows:
+        click.echo(f"{row.id}\t{row.kind}\torder {row.order_id}\t{row.transaction_id or '-'}\t"
+                   f"{row.expected_cents}/{row.actual_cents}\t{'corrected' if row.corrected else ''}")
+
+
+@payments_cli.command("resolve")
+@click.argument("discrepancy_ids", type=int, nargs=-1, required=True)
+def resolve_command(discrepancy_ids):
+    """Mark discrepancies as handled."""
+    result = db.session.execute(
+        update(PaymentDiscrepancy)
+        .where(PaymentDiscrepancy.id.in_(discrepancy_ids), PaymentDiscrepancy.resolved_at.is_(None))
+        .values(resolved_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    click.echo(f"Resolved {result.rowcount} discrepancies.")
+
+
+def init_app(app):
+    app.cli.add_command(payments_cli)
@@ -0,0 +1,194 @@
+# app/pricing.py
+import itertools
+import logging
+from collections import namedtuple
+from decimal import Decimal
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, update
+
+from . import promotions, settings
+from .db import db
+from .helper import from_cents, to_cents
+from .models import Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+# All amounts are integer cents; the tax rate is held in basis points so the
+# whole pipeline stays in integer arithmetic.
+PricingRules = namedtuple("PricingRules", "tax_bp shipping_cents free_shipping_cents")
+
+BATCH_SIZE = 1000
+
+
+def load_rules():
+    """Read the tax/shipping settings once; pass the result to every pricing call in a request."""
+    values = settings.get_many(["tax_rate", "default_shipping_cost", "free_shipping_threshold"])
+    threshold = values.get("free_shipping_threshold")
+    return PricingRules(
+        tax_bp=int(Decimal(values.get("tax_rate", "0")) * 10000),
+        shipping_cents=to_cents(values.get("default_shipping_cost", "0")),
+        free_shipping_cents=to_cents(threshold) if threshold else None,
+    )
+
+
+def totals(subtotal_cents, rules, discount_cents=0):
+    """
+    Tax (rounded half up), shipping and grand total for a cart subtotal.
+    Tax and the free-shipping threshold apply to the discounted subtotal.
+    """
+    net = subtotal_cents - discount_cents
+    tax = (net * rules.tax_bp + 5000) // 10000
+    free = rules.free_shipping_cents is not None and net >= rules.free_shipping_cents
+    shipping = 0 if subtotal_cents == 0 or free else rules.shipping_cents
+    return {
+        "subtotal_cents": subtotal_cents,
+        "discount_cents": discount_cents,
+        "tax_cents": tax,
+        "shipping_cents": shipping,
+        "total_cents": net + tax + shipping,
+    }
+
+
+def price_cart(lines, rules=None, coupon_code=None):
+    """
+    Price ``(product, quantity)`` lines in a single pass: line subtotals,
+    promotions (automatic ones plus ``coupon_code``), then tax, shipping and
+    the free-shipping threshold on the discounted subtotal.
+    """
+    rules = rules or load_rules()
+    priced, subtotal = [], 0
+    for product, quantity in lines:
+        line_cents = product.price_cents * quantity
+        subtotal += line_cents
+        priced.append({
+            "product": product,
+            "quantity": quantity,
+            "unit_price_cents": product.price_cents,
+            "subtotal_cents": line_cents,
+        })
+    discount, applied = promotions.evaluate(priced, subtotal, coupon_code)
+    result = totals(subtotal, rules, discount)
+    result["lines"] = priced
+    result["promotions"] = applied
+    return result
+
+
+def cart_products(cart, for_update=False):
+    """Load every product in a session cart with one query (optionally row-locked, in id order)."""
+    ids = {item["product_id"] for item in cart}
+    if not ids:
+        return {}
+    query = Product.query.filter(Product.id.in_(ids))
+    if for_update:
+        query = query.order_by(Product.id).with_for_update()
+    return {p.id: p for p in query}
+
+
+def _chunks(items, size=BATCH_SIZE):
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def price_carts(carts, rules=None, prices=None):
+    """
+    Batch mode: price many carts at once. ``carts`` maps any key to a list of
+    ``(product_id, quantity)``; product prices are fetched with one query per
+    chunk of ids unless ``prices`` ({product_id: cents}) overrides them, e.g.
+    to preview a promotion across thousands of carts.
+    """
+    rules = rules or load_rules()
+    if prices is None:
+        prices = {}
+        ids = {pid for lines in carts.values() for pid, _ in lines}
+        for chunk in _chunks(ids):
+            prices.update(
+                db.session.query(Product.id, Product.price_cents).filter(Product.id.in_(chunk)).all()
+            )
+    return {
+        key: totals(sum(prices[pid] * qty for pid, qty in lines if pid in prices), rules)
+        for key, lines in carts.items()
+    }
+
+
+def reprice_orders(order_ids, rules=None, prices=None):
+    """
+    Batch mode for orders: recompute subtotal/tax/shipping/total for many
+    orders with one grouped query and one bulk UPDATE per chunk; each order's
+    recorded discount is kept. Without ``prices`` each line keeps its stored
+    unit price (e.g. after a tax change); with ``prices`` the matching lines
+    are re-priced as well.
+    Returns the number of orders updated; the caller commits.
+    """
+    rules = rules or load_rules()
+    updated = 0
+    for chunk in _chunks(order_ids):
+        if prices is None:
+            subtotals = dict(
+                db.session.query(
+                    OrderItem.order_id, func.sum(OrderItem.quantity * OrderItem.unit_price_cents)
+                )
+                .filter(OrderItem.order_id.in_(chunk))
+                .group_by(OrderItem.order_id)
+                .all()
+            )
+        else:
+            subtotals, item_updates = {}, []
+            rows = (
+                db.session.query(OrderItem.id, OrderItem.order_id, OrderItem.product_id,
+                                 OrderItem.quantity, OrderItem.unit_price_cents)
+                .filter(OrderItem.order_id.in_(chunk))
+                .all()
+            )
+            for item_id, order_id, product_id, quantity, unit_cents in rows:
+                new_cents = prices.get(product_id, unit_cents)
+                if new_cents != unit_cents:
+                    item_updates.append({"id": item_id, "unit_price_cents": new_cents})
+                subtotals[order_id] = subtotals.get(order_id, 0) + new_cents * quantity
+            if item_updates:
+                db.session.execute(update(OrderItem), item_updates)
+
+        discounts = dict(
+            db.session.query(Order.id, Order.discount_cents).filter(Order.id.in_(chunk)).all()
+        )
+        order_updates = [
+            dict(id=order_id, **totals(subtotals.get(order_id, 0), rules, discounts.get(order_id, 0)))
+            for order_id in chunk
+        ]
+        db.session.execute(update(Order), order_updates)
+        updated += len(order_updates)
+    return updated
+
+
+def money(cents):
+    value = from_cents(cents)
+    return "" if value is None else f"{value:.2f}"
+
+
+pricing_cli = AppGroup("pricing", help="Cart and order pricing.")
+
+
+@pricing_cli.command("reprice-orders")
+@click.option("--status", default="Pending", show_default=True, help="Only orders in this status.")
+def reprice_orders_command(status):
+    """
+    Re-apply the current tax/shipping settings to orders that are not paid
+    yet. Orders that already have a Viva payment order are skipped: Viva
+    captures the amount it was given, which a new total would no longer match.
+    """
+    ids = [
+        row.id for row in db.session.query(Order.id).filter(Order.status == status, Order.transaction_id.is_(None))
+    ]
+    count = reprice_orders(ids)
+    db.session.commit()
+    click.echo(f"Repriced {count} {status} orders.")
+
+
+def init_app(app):
+    app.add_template_filter(money, "money")
+    app.cli.add_command(pricing_cli)
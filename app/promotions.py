@@ -0,0 +1,292 @@
+# app/promotions.py
+import logging
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+import click
+from flask import g, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import case, event, func, or_, update
+from sqlalchemy.orm import Session
+
+from . import cache, catalog
+from .db import db
+from .helper import to_cents
+from .models import Promotion, PromotionRedemption
+
+logger = logging.getLogger(__name__)
+
+Rule = namedtuple(
+    "Rule", "id name code kind value scope target_id min_subtotal_cents starts_at ends_at"
+)
+
+# The compiled index lives in the shared cache under PROMOTIONS_TAG, and under
+# the catalog's tag too since category rules are expanded over the category
+# tree; either write invalidates it on commit. The TTL bounds how stale a
+# process-local cache backend can be after a write in another worker.
+PROMOTIONS_TTL = 60
+PROMOTIONS_TAG = "promotions"
+
+
+def _compile():
+    """
+    Turn the active rules into lookup tables so evaluating a cart costs a
+    couple of dict probes per line instead of a pass over every rule.
+    Category rules are expanded to all descendant categories here.
+    """
+    index = {
+        "by_product": defaultdict(list),
+        "by_category": defaultdict(list),
+        "cart": [],
+        "by_code": {},
+    }
+    now = datetime.utcnow()
+    rows = Promotion.query.filter(
+        Promotion.active.is_(True),
+        or_(Promotion.ends_at.is_(None), Promotion.ends_at > now),
+        or_(Promotion.usage_limit.is_(None), Promotion.used_count < Promotion.usage_limit),
+    ).all()
+    tree = catalog.get_category_tree() if any(r.scope == "category" for r in rows) else None
+
+    for row in rows:
+        rule = Rule(
+            row.id, row.name, row.code.upper() if row.code else None, row.kind, row.value,
+            row.scope, row.target_id, row.min_subtotal_cents, row.starts_at, row.ends_at,
+        )
+        if rule.code:
+            index["by_code"][rule.code] = rule
+        if rule.scope == "product":
+            index["by_product"][rule.target_id].append(rule)
+        elif rule.scope == "category":
+            for category_id in catalog.descendant_ids(rule.target_id, tree):
+                index["by_category"][category_id].append(rule)
+        else:
+            index["cart"].append(rule)
+    return index
+
+
+def get_index():
+    """
+    The compiled rules, built by one worker at a time and kept in the shared
+    cache until a promotion or catalog write commits; within a request it is
+    read from the cache once.
+    """
+    if "promotion_index" not in g:
+        g.promotion_index = cache.get_cache().get_or_set(
+            "promotions:index", _compile, PROMOTIONS_TTL, [PROMOTIONS_TAG, catalog.CATALOG_TAG]
+        )
+    return g.promotion_index
+
+
+def invalidate():
+    cache.invalidate_tags([PROMOTIONS_TAG])
+    if has_app_context():
+        g.pop("promotion_index", None)
+
+
+def lookup_coupon(code):
+    if not code:
+        return None
+    return get_index()["by_code"].get(code.strip().upper())
+
+
+def _applies(rule, code, subtotal_cents, now):
+    if rule.code is not None and rule.code != code:
+        return False
+    if rule.starts_at and rule.starts_at > now:
+        return False
+    if rule.ends_at and rule.ends_at <= now:
+        return False
+    return subtotal_cents >= rule.min_subtotal_cents
+
+
+def _line_discount(rule, line):
+    if rule.kind == "percent":
+        return line["subtotal_cents"] * rule.value // 10000
+    return min(rule.value * line["quantity"], line["subtotal_cents"])
+
+
+def evaluate(lines, subtotal_cents, coupon_code=None):
+    """
+    Best product/category rule per line (no stacking on a line), then the
+    best cart-wide rule on what is left. Sets ``discount_cents`` on every
+    line and returns ``(total_discount_cents, {rule_id: discount_cents})``.
+    """
+    index = get_index()
+    code = coupon_code.strip().upper() if coupon_code else None
+    now = datetime.utcnow()
+    applied = defaultdict(int)
+    line_total = 0
+
+    for line in lines:
+        product = line["product"]
+        candidates = index["by_product"].get(product.id, []) + index["by_category"].get(product.category_id, [])
+        best, best_rule = 0, None
+        for rule in candidates:
+            if _applies(rule, code, subtotal_cents, now):
+                amount = _line_discount(rule, line)
+                if amount > best:
+                    best, best_rule = amount, rule
+        line["discount_cents"] = best
+        if best_rule is not None:
+            applied[best_rule.id] += best
+            line_total += best
+
+    remaining = subtotal_cents - line_total
+    best, best_rule = 0, None
+    for rule in index["cart"]:
+        if _applies(rule, code, subtotal_cents, now):
+            amount = remaining * rule.value // 10000 if rule.kind == "percent" else min(rule.value, remaining)
+            if amount > best:
+                best, best_rule = amount, rule
+    if best_rule is not None:
+        applied[best_rule.id] += best
+
+    return line_total + best, dict(applied)
+
+
+def redeem(applied, order, user_id):
+    """
+    Count one use of each applied promotion ({rule_id: discount_cents}, as
+    returned by ``evaluate``) for ``order`` in the caller's transaction. The
+    check and the increment are a single conditional UPDATE over all of them,
+    so concurrent checkouts can never push a coupon past its usage limit.
+    Returns the id of a promotion that is no longer available (the caller
+    rolls back), else None.
+    """
+    if not applied:
+        return None
+    counted = set(db.session.scalars(
+        update(Promotion)
+        .where(
+            Promotion.id.in_(applied),
+            Promotion.active.is_(True),
+            or_(Promotion.usage_limit.is_(None), Promotion.used_count < Promotion.usage_limit),
+        )
+        .values(used_count=Promotion.used_count + 1)
+        .returning(Promotion.id)
+        .execution_options(synchronize_session=False)
+    ))
+    missing = [promotion_id for promotion_id in applied if promotion_id not in counted]
+    if missing:
+        return missing[0]
+    db.session.add_all(
+        PromotionRedemption(promotion_id=promotion_id, order_id=order.id, user_id=user_id, discount_cents=discount_cents)
+        for promotion_id, discount_cents in applied.items()
+    )
+    db.session.info["promotions_dirty"] = True
+    return None
+
+
+def release(order):
+    """Give back the uses taken by a cancelled order."""
+    release_orders([order.id])
+
+
+def release_orders(order_ids):
+    """
+    Give back the uses taken by many cancelled orders: one UPDATE for all the
+    promotions involved, however many there are. The redemptions are kept for the audit trail and
+    marked released, so a second release of the same order gives nothing back.
+    """
+    if not order_ids:
+        return
+    pending = (PromotionRedemption.order_id.in_(order_ids), PromotionRedemption.released_at.is_(None))
+    uses = dict(
+        db.session.query(PromotionRedemption.promotion_id, func.count(PromotionRedemption.id))
+        .filter(*pending)
+        .group_by(PromotionRedemption.promotion_id)
+        .all()
+    )
+    if uses:
+        returned = case(uses, value=Promotion.id)
+        db.session.execute(
+            update(Promotion)
+            .where(Promotion.id.in_(uses))
+            .values(used_count=case((Promotion.used_count > returned, Promotion.used_count - returned), else_=0))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(PromotionRedemption)
+            .where(*pending)
+            .values(released_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.info["promotions_dirty"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_promotions_dirty(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Promotion):
+            session.info["promotions_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("promotions_dirty", False):
+        invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("promotions_dirty", None)
+
+
+promotions_cli = AppGroup("promotions", help="Coupons and automatic promotions.")
+
+
+@promotions_cli.command("create")
+@click.argument("name")
+@click.option("--code", help="Coupon code; omit for an automatic promotion.")
+@click.option("--percent", type=float, help="Percentage off, e.g. 15.")
+@click.option("--amount", help="Fixed amount off, e.g. 5.00 (per unit for product/category scope).")
+@click.option("--product", "product_id", type=int, help="Limit to one product.")
+@click.option("--category", "category_id", type=int, help="Limit to a category and its subcategories.")
+@click.option("--min-subtotal", default="0", help="Minimum cart subtotal.")
+@click.option("--limit", "usage_limit", type=int, help="Maximum number of redemptions.")
+def create_command(name, code, percent, amount, product_id, category_id, min_subtotal, usage_limit):
+    """Create a promotion."""
+    if (percent is None) == (amount is None):
+        raise click.UsageError("Give exactly one of --percent or --amount.")
+    if product_id and category_id:
+        raise click.UsageError("Give at most one of --product or --category.")
+    promotion = Promotion(
+        name=name,
+        code=code.upper() if code else None,
+        kind="percent" if percent is not None else "fixed",
+        value=int(round(percent * 100)) if percent is not None else to_cents(amount),
+        scope="product" if product_id else "category" if category_id else "cart",
+        target_id=product_id or category_id,
+        min_subtotal_cents=to_cents(min_subtotal),
+        usage_limit=usage_limit,
+    )
+    db.session.add(promotion)
+    db.session.commit()
+    click.echo(f"Created promotion {promotion.id}.")
+
+
+@promotions_cli.command("list")
+def list_command():
+    """List promotions and their usage."""
+    for p in Promotion.query.order_by(Promotion.id):
+        limit = p.usage_limit if p.usage_limit is not None else "-"
+        state = "active" if p.active else "inactive"
+        click.echo(f"{p.id}\t{p.code or '(auto)'}\t{p.name}\t{p.scope}\t{p.used_count}/{limit}\t{state}")
+
+
+@promotions_cli.command("deactivate")
+@click.argument("promotion_id", type=int)
+def deactivate_command(promotion_id):
+    """Stop a promotion from applying."""
+    promotion = Promotion.query.get(promotion_id)
+    if promotion is None:
+        raise click.ClickException(f"Promotion {promotion_id} not found.")
+    promotion.active = False
+    db.session.commit()
+    click.echo(f"Deactivated {promotion.name}.")
+
+
+def init_app(app):
+    app.cli.add_command(promotions_cli)
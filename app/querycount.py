@@ -0,0 +1,84 @@
+# app/querycount.py
+import logging
+
+import click
+from flask import current_app, g, has_request_context, request
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from .db import db
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """
+    Declare the most SQL statements a view may run per request, counting
+    the user loader and everything the template triggers. Budgets are
+    exact-size guards against N+1 patterns: a view whose count grows with
+    the cart or the order history will blow through it.
+    """
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def _count(conn, clauseelement, multiparams, params, execution_options):
+    # before_execute fires once per statement, so an executemany or a flush
+    # inserting many rows counts once whichever way the driver batches it.
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def budget_for(endpoint):
+    overrides = current_app.config.get("QUERY_BUDGETS") or {}
+    if endpoint in overrides:
+        return overrides[endpoint]
+    view = current_app.view_functions.get(endpoint)
+    return getattr(view, "query_budget", None)
+
+
+def _check_budget(response):
+    count = g.get("query_count", 0)
+    if current_app.config.get("QUERY_COUNT_HEADER"):
+        response.headers["X-Query-Count"] = str(count)
+
+    budget = budget_for(request.endpoint) if request.endpoint else None
+    if budget is not None and count > budget:
+        message = f"{request.method} {request.path} ({request.endpoint}) ran {count} queries, budget is {budget}"
+        if current_app.config.get("QUERY_BUDGET_ENFORCE", current_app.testing):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+def watch_engine(engine):
+    if not event.contains(engine, "before_execute", _count):
+        event.listen(engine, "before_execute", _count)
+
+
+@click.command("query-budgets")
+@with_appcontext
+def query_budgets_command():
+    """List every route's query budget (routes without one are marked '-')."""
+    for rule in sorted(current_app.url_map.iter_rules(), key=lambda r: r.endpoint):
+        if rule.endpoint == "static":
+            continue
+        budget = budget_for(rule.endpoint)
+        click.echo(f"{'-' if budget is None else budget:>3}  {rule.endpoint:<36} {rule.rule}")
+
+
+def init_app(app):
+    app.config.setdefault("QUERY_COUNT_HEADER", app.debug)
+    with app.app_context():
+        watch_engine(db.engine)
+    replicas = app.extensions.get("replicas")
+    for engine in replicas.engines if replicas else []:
+        watch_engine(engine)
+    app.after_request(_check_budget)
+    app.cli.add_command(query_budgets_command)
@@ -0,0 +1,217 @@
+# app/ratelimit.py
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request, session
+from werkzeug.exceptions import TooManyRequests
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate):
+    """"5/minute" -> (capacity 5, refill 5/60 tokens per second)."""
+    count, _, period = rate.partition("/")
+    return int(count), int(count) / PERIODS[period.strip().rstrip("s")]
+
+
+class MemoryBucketStore:
+    """Process-local buckets; for development and tests only (not shared by workers)."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+        return allowed, 0 if allowed else (cost - tokens) / refill_rate
+
+
+class SQLiteBucketStore:
+    """
+    Buckets in a local SQLite file shared by every worker on the host.
+    WAL mode plus BEGIN IMMEDIATE makes each read-refill-write atomic across
+    processes; a check is a couple of sub-millisecond statements.
+    """
+
+    PRUNE_PROBABILITY = 0.001
+    PRUNE_AGE = 86400
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            if random.random() < self.PRUNE_PROBABILITY:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.PRUNE_AGE,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0 if allowed else (cost - tokens) / refill_rate
+
+
+class RedisBucketStore:
+    """Buckets in Redis for multi-host deployments; one atomic Lua call per check."""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local cost = tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1])
+    local ts = tonumber(bucket[2])
+    if tokens == nil then
+        tokens = capacity
+        ts = now
+    end
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        import redis  # optional dependency, only needed when configured
+
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        allowed, tokens = self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill_rate, time.time(), cost])
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (cost - tokens) / refill_rate
+
+
+def create_store(app):
+    url = app.config.get("RATELIMIT_STORAGE_URL")
+    if url and url.startswith("redis"):
+        return RedisBucketStore(url)
+    if url == "memory://":
+        return MemoryBucketStore()
+    if url and url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+    else:
+        os.makedirs(app.instance_path, exist_ok=True)
+        path = os.path.join(app.instance_path, "ratelimit.db")
+    return SQLiteBucketStore(path)
+
+
+def client_ip():
+    """
+    The client's address. Behind a reverse proxy this is only the client's
+    once TRUSTED_PROXY_HOPS is set, so ProxyFix takes it from X-Forwarded-For;
+    otherwise every client shares the proxy's bucket.
+    """
+    return request.remote_addr or "unknown"
+
+
+def form_email():
+    email = request.form.get("email")
+    return email.strip().lower() if email else None
+
+
+def session_user():
+    """The logged-in user id straight from the session cookie – no user loader, no DB."""
+    user_id = session.get("_user_id")
+    return str(user_id).partition(":")[0] if user_id else None
+
+
+def _reject(retry_after):
+    retry_after = max(1, int(retry_after + 0.999))
+    if request.path.startswith("/api/") or request.is_json or request.path.startswith("/payment/viva/"):
+        resp = jsonify({"error": "rate_limited", "message": "Too many requests.", "retry_after": retry_after})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(retry_after)
+        return resp
+    raise TooManyRequests("Too many requests. Please wait a moment and try again.", retry_after=retry_after)
+
+
+def limit(name, per_ip=None, per_account=None, account=None, methods=None):
+    """
+    Token-bucket limit for a view, checked before the view (and any DB or
+    password-hash work) runs. ``per_ip``/``per_account`` are rates such as
+    "5/minute"; ``account`` returns the account key for the request (e.g.
+    the submitted email) or None. Put it above every decorator that does
+    work, such as ``@login_required`` and ``@db_transaction``; only
+    ``@querycount.query_budget``, which just tags the view, goes between it
+    and ``@bp.route``. Store failures fail open so an unavailable limiter never blocks the shop.
+    """
+    buckets = []
+    if per_ip:
+        buckets.append(("ip", parse_rate(per_ip), client_ip))
+    if per_account:
+        buckets.append(("acct", parse_rate(per_account), account or session_user))
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            store = current_app.extensions.get("ratelimit")
+            if store is None or (methods and request.method not in methods):
+                return f(*args, **kwargs)
+            for kind, (capacity, refill), key_func in buckets:
+                key = key_func()
+                if key is None:
+                    continue
+                try:
+                    allowed, retry_after = store.take(f"{name}:{kind}:{key}", capacity, refill)
+                except Exception as exc:
+                    logger.error(f"Rate limiter unavailable, allowing request: {exc}")
+                    break
+                if not allowed:
+                    logger.warning(f"Rate limited {name} for {kind} {key}")
+                    return _reject(retry_after)
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def init_app(app):
+    if app.config.get("RATELIMIT_ENABLED", True):
+        app.extensions["ratelimit"] = create_store(app)
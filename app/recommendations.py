@@ -0,0 +1,272 @@
+# app/recommendations.py
+import heapq
+import itertools
+import logging
+import math
+import random
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from .db import db
+from .models import Order, OrderItem, OrderStatus, Product, ProductCooccurrence, ProductRecommendation, RecommendationRun
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 8
+MAX_BASKET = 50        # huge baskets add O(n²) pairs and very little signal
+SCAN_BATCH = 5000
+WRITE_CHUNK = 1000
+# Only paid orders are counted: a Pending order may still be cancelled or
+# expire, and nothing would take its pairs back out of the matrix then.
+_COUNTED = OrderStatus.COMPLETED.value
+_CLOSED = (OrderStatus.CANCELLED.value, OrderStatus.EXPIRED.value)
+
+
+def _chunks(iterable, size=WRITE_CHUNK):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _basket(order_id, product_ids):
+    """
+    The order's distinct products, capped at MAX_BASKET by a sample seeded
+    with the order id, so every product of a huge basket has the same chance
+    of counting and a rebuild picks the same sample as the update before it.
+    """
+    products = sorted(product_ids)
+    if len(products) > MAX_BASKET:
+        products = sorted(random.Random(order_id).sample(products, MAX_BASKET))
+    return products
+
+
+def _stream_baskets(uncounted_only):
+    """
+    Yield (order_id, product ids) for Completed orders, streamed in id order;
+    with ``uncounted_only`` just those not yet folded into the matrix (served
+    by the partial ix_orders_basket_uncounted index). Pending orders wait
+    there until they complete or close.
+    """
+    query = (
+        db.session.query(OrderItem.order_id, OrderItem.product_id)
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(Order.status == _COUNTED)
+        .order_by(OrderItem.order_id)
+        .execution_options(yield_per=SCAN_BATCH)
+    )
+    if uncounted_only:
+        query = query.filter(Order.basket_counted.is_(False))
+    for order_id, rows in itertools.groupby(query, key=lambda row: row.order_id):
+        yield order_id, _basket(order_id, {row.product_id for row in rows})
+
+
+def _mark_counted(order_ids):
+    """
+    Flag exactly the orders whose baskets were just counted. Orders that
+    committed while the scan ran were not in it and stay for the next update,
+    whatever their ids; cancelled and expired orders are never counted, so
+    they are flagged too to keep them out of the partial index.
+    """
+    for chunk in _chunks(order_ids):
+        db.session.execute(
+            db.update(Order).where(Order.id.in_(chunk))
+            .values(basket_counted=True, updated_at=Order.updated_at)
+        )
+    db.session.execute(
+        db.update(Order).where(Order.basket_counted.is_(False), Order.status.in_(_CLOSED))
+        .values(basket_counted=True, updated_at=Order.updated_at)
+    )
+
+
+def _count(baskets):
+    """Co-occurrence and order counts of ``baskets``, and the ids of the orders counted."""
+    pairs = defaultdict(Counter)
+    singles = Counter()
+    order_ids = array("l")
+    for order_id, products in baskets:
+        order_ids.append(order_id)
+        singles.update(products)
+        for a, b in itertools.combinations(products, 2):
+            pairs[a][b] += 1
+            pairs[b][a] += 1
+    return pairs, singles, order_ids
+
+
+def _top_k(neighbours, own_count, order_counts, k=TOP_K):
+    """
+    bought_together: highest raw co-occurrence counts.
+    related: highest cosine similarity (co / sqrt(n_a * n_b)), which favours
+    niche products that are almost always bought with this one, minus the
+    ids already shown as bought_together.
+    """
+    together = [p for p, _ in heapq.nlargest(k, neighbours.items(), key=lambda kv: (kv[1], -kv[0]))]
+    shown = set(together)
+
+    def cosine(kv):
+        other, co = kv
+        return co / math.sqrt(max(own_count, 1) * max(order_counts.get(other, 1), 1)), -other
+
+    candidates = ((p, co) for p, co in neighbours.items() if p not in shown)
+    related = [p for p, _ in heapq.nlargest(k, candidates, key=cosine)]
+    return ",".join(map(str, together)), ",".join(map(str, related))
+
+
+def rebuild():
+    """Full rebuild: rescan every basket and replace the matrix and all top-K rows."""
+    run = RecommendationRun(mode="full", started_at=datetime.utcnow())
+    pairs, singles, order_ids = _count(_stream_baskets(uncounted_only=False))
+    scanned = len(order_ids)
+
+    db.session.query(ProductCooccurrence).delete(synchronize_session=False)
+    db.session.query(ProductRecommendation).delete(synchronize_session=False)
+
+    cooc_rows = (
+        {"product_id": a, "other_id": b, "count": n}
+        for a, neighbours in pairs.items() for b, n in neighbours.items()
+    )
+    for chunk in _chunks(cooc_rows):
+        db.session.execute(ProductCooccurrence.__table__.insert(), chunk)
+
+    now = datetime.utcnow()
+
+    def rec_rows():
+        for product_id, own in singles.items():
+            together, related = _top_k(pairs.get(product_id, {}), own, singles)
+            yield {
+                "product_id": product_id,
+                "order_count": own,
+                "bought_together": together,
+                "related": related,
+                "updated_at": now,
+            }
+
+    for chunk in _chunks(rec_rows()):
+        db.session.execute(ProductRecommendation.__table__.insert(), chunk)
+
+    _mark_counted(order_ids)
+    run.last_order_id = max(order_ids, default=0)
+    run.orders_scanned = scanned
+    run.products_updated = len(singles)
+    run.finished_at = datetime.utcnow()
+    db.session.add(run)
+    db.session.commit()
+    logger.info(f"Recommendations rebuilt: {scanned} orders, {len(singles)} products")
+    return run
+
+
+def update():
+    """
+    Incremental update: fold orders not counted yet into the stored matrix
+    and recompute top-K rows only for products in those orders. Neighbours'
+    own rankings are refreshed by the next full rebuild.
+    """
+    if db.session.query(RecommendationRun.id).first() is None:
+        return rebuild()
+
+    delta_pairs, delta_singles, order_ids = _count(_stream_baskets(uncounted_only=True))
+    if not order_ids:
+        _mark_counted(order_ids)
+        db.session.commit()
+        return None
+
+    run = RecommendationRun(mode="incremental", started_at=datetime.utcnow())
+    scanned = len(order_ids)
+    affected = sorted(delta_singles)
+
+    adjacency = defaultdict(Counter)
+    recs = {}
+    for chunk in _chunks(affected):
+        rows = ProductCooccurrence.query.filter(ProductCooccurrence.product_id.in_(chunk)).all()
+        for row in rows:
+            adjacency[row.product_id][row.other_id] = row.count
+        ProductCooccurrence.query.filter(ProductCooccurrence.product_id.in_(chunk)).delete(
+            synchronize_session=False
+        )
+        for rec in ProductRecommendation.query.filter(ProductRecommendation.product_id.in_(chunk)):
+            recs[rec.product_id] = rec
+
+    for product_id, neighbours in delta_pairs.items():
+        adjacency[product_id].update(neighbours)
+
+    for chunk in _chunks(
+        {"product_id": a, "other_id": b, "count": n}
+        for a in affected for b, n in adjacency[a].items()
+    ):
+        db.session.execute(ProductCooccurrence.__table__.insert(), chunk)
+
+    for product_id, n in delta_singles.items():
+        rec = recs.get(product_id)
+        if rec is None:
+            rec = recs[product_id] = ProductRecommendation(product_id=product_id, order_count=0)
+            db.session.add(rec)
+        rec.order_count += n
+
+    order_counts = {pid: rec.order_count for pid, rec in recs.items()}
+    missing = {other for a in affected for other in adjacency[a]} - order_counts.keys()
+    for chunk in _chunks(missing):
+        order_counts.update(
+            db.session.query(ProductRecommendation.product_id, ProductRecommendation.order_count)
+            .filter(ProductRecommendation.product_id.in_(chunk))
+            .all()
+        )
+
+    for product_id in affected:
+        rec = recs[product_id]
+        rec.bought_together, rec.related = _top_k(adjacency[product_id], rec.order_count, order_counts)
+
+    _mark_counted(order_ids)
+    run.last_order_id = max(order_ids)
+    run.orders_scanned = scanned
+    run.products_updated = len(affected)
+    run.finished_at = datetime.utcnow()
+    db.session.add(run)
+    db.session.commit()
+    logger.info(f"Recommendations updated: {scanned} new orders, {len(affected)} products")
+    return run
+
+
+def recommendations_for(product_id):
+    """Read the precomputed row for a product page – no mining on the request path."""
+    rec = ProductRecommendation.query.get(product_id)
+    if rec is None:
+        return {"bought_together": [], "related": []}
+
+    together = ProductRecommendation.split_ids(rec.bought_together)
+    related = ProductRecommendation.split_ids(rec.related)
+    ids = set(together) | set(related)
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))} if ids else {}
+    return {
+        "bought_together": [products[i] for i in together if i in products],
+        "related": [products[i] for i in related if i in products],
+    }
+
+
+recommendations_cli = AppGroup("recommendations", help="Mine order baskets for product recommendations.")
+
+
+@recommendations_cli.command("rebuild")
+def rebuild_command():
+    """Rescan all orders and rebuild every recommendation row."""
+    run = rebuild()
+    click.echo(f"Full rebuild: {run.orders_scanned} orders, {run.products_updated} products.")
+
+
+@recommendations_cli.command("update")
+def update_command():
+    """Fold orders placed since the last run into the recommendations."""
+    run = update()
+    if run is None:
+        click.echo("No new orders.")
+    else:
+        click.echo(f"{run.mode.capitalize()} run: {run.orders_scanned} orders, {run.products_updated} products.")
+
+
+def init_app(app):
+    app.cli.add_command(recommendations_cli)
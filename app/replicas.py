@@ -0,0 +1,133 @@
+# app/replicas.py
+import logging
+import random
+import threading
+import time
+from functools import wraps
+
+import click
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, session
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+LAG_QUERIES = {
+    # 0 when the replica has replayed everything it received, so an idle
+    # primary does not make a caught-up replica look stale.
+    "postgresql": (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    ),
+}
+
+
+class ReplicaSet:
+    """
+    Replica engines plus their last measured lag. Lag is re-measured at
+    most every ``check_interval`` seconds by whichever request gets there
+    first; the others keep using the previous measurement.
+    """
+
+    def __init__(self, urls, max_lag, check_interval):
+        self.engines = [sa.create_engine(url, pool_pre_ping=True) for url in urls]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lag = [None] * len(self.engines)
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _measure(self, engine):
+        query = LAG_QUERIES.get(engine.dialect.name)
+        try:
+            with engine.connect() as conn:
+                return float(conn.execute(sa.text(query or "SELECT 0")).scalar() or 0)
+        except Exception as exc:
+            logger.warning(f"Replica {engine.url.render_as_string()} unavailable: {exc}")
+            return None
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            self._lag = [self._measure(engine) for engine in self.engines]
+            self._checked = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def healthy(self):
+        self.refresh()
+        return [
+            engine for engine, lag in zip(self.engines, self._lag)
+            if lag is not None and lag <= self.max_lag
+        ]
+
+    def status(self):
+        self.refresh(force=True)
+        return [(engine.url.render_as_string(), lag) for engine, lag in zip(self.engines, self._lag)]
+
+
+def choose_replica():
+    """A healthy replica for this request, or None to use the primary."""
+    replicas = current_app.extensions.get("replicas")
+    if replicas is None:
+        return None
+    if session.get("primary_until", 0) > time.time():
+        return None
+    healthy = replicas.healthy()
+    if not healthy:
+        logger.debug("No replica within the lag limit, reading from the primary")
+        return None
+    return random.choice(healthy)
+
+
+def read_only(f):
+    """Route the view's plain SELECTs to a replica (see db.RoutingSession)."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_replica = choose_replica()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.pop("read_replica", None)
+    return decorated
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_request_wrote(session_, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _pin_to_primary(response):
+    """After a write, keep this client on the primary until the replicas have caught up."""
+    if g.get("db_wrote"):
+        session["primary_until"] = time.time() + current_app.config.get("READ_YOUR_WRITES_SECONDS", 10)
+    return response
+
+
+@click.command("replica-status")
+@with_appcontext
+def replica_status_command():
+    """Show each read replica's measured lag."""
+    replicas = current_app.extensions.get("replicas")
+    for url, lag in replicas.status() if replicas else []:
+        click.echo(f"{url}\t{'unavailable' if lag is None else f'{lag:.1f}s'}")
+
+
+def init_app(app):
+    urls = app.config.get("SQLALCHEMY_REPLICA_URIS") or []
+    if not urls:
+        return
+    app.extensions["replicas"] = ReplicaSet(
+        urls,
+        max_lag=app.config.get("REPLICA_MAX_LAG", 5),
+        check_interval=app.config.get("REPLICA_CHECK_INTERVAL", 5),
+    )
+    app.after_request(_pin_to_primary)
+    app.cli.add_command(replica_status_command)
@@ -0,0 +1,196 @@
+# app/settings.py
+import logging
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import case, event, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from . import cache
+from .db import db
+from .models import Config, Setting
+
+logger = logging.getLogger(__name__)
+
+# Resolved settings are kept per user in the shared cache for this long; a
+# committed change invalidates them at once (for every worker, unless the
+# cache backend is process-local).
+SETTINGS_CACHE_TTL = 30
+# Every resolved value carries this tag, and a user's also their own tag
+GLOBAL_TAG = "settings"
+
+_MISSING = object()
+_ALL = object()
+
+
+def _user_tag(user_id):
+    return f"settings:user:{user_id}"
+
+
+def _cache_key(user_id, key):
+    return f"settings:{'-' if user_id is None else user_id}:{key}"
+
+
+def _query(keys, user_id):
+    """
+    ``{key: value}`` for ``keys`` in one round trip: the user's overrides,
+    the global settings and the old Config table, each row ranked so the
+    merge keeps user over global over Config.
+    """
+    settings = select(
+        Setting.key, Setting.value,
+        case((Setting.user_id.is_(None), 1), else_=0).label("rank"),
+    ).where(Setting.key.in_(keys))
+    if user_id is None:
+        settings = settings.where(Setting.user_id.is_(None))
+    else:
+        settings = settings.where(or_(Setting.user_id == user_id, Setting.user_id.is_(None)))
+    config = select(Config.key, Config.value, literal(2).label("rank")).where(Config.key.in_(keys))
+
+    resolved = {}
+    for key, value, rank in db.session.execute(union_all(settings, config)):
+        if key not in resolved or rank < resolved[key][1]:
+            resolved[key] = (value, rank)
+    return {key: value for key, (value, _) in resolved.items()}
+
+
+def _request_cache():
+    if not has_app_context():
+        return None
+    if "settings" not in g:
+        g.settings = {}
+    return g.settings
+
+
+def get_many(keys, user_id=None):
+    """
+    Resolve ``keys`` for ``user_id`` (None for the global values) with user →
+    global → Config precedence. Returns ``{key: value}`` for the keys that
+    are set anywhere; callers apply their own defaults. Served from the
+    request's cache, then the shared cache, and whatever is left is read
+    with a single query.
+    """
+    keys = list(dict.fromkeys(keys))
+    request_cache = _request_cache()
+    known = dict(request_cache.get(user_id, {})) if request_cache is not None else {}
+
+    wanted = [key for key in keys if key not in known]
+    if wanted:
+        # None marks a key that is set nowhere (stored values are never None)
+        cached = cache.get_cache().get_many([_cache_key(user_id, key) for key in wanted])
+        for key in wanted:
+            value = cached.get(_cache_key(user_id, key), _MISSING)
+            if value is not _MISSING:
+                known[key] = _MISSING if value is None else value
+        wanted = [key for key in keys if key not in known]
+
+    if wanted:
+        found = _query(wanted, user_id)
+        known.update((key, found.get(key, _MISSING)) for key in wanted)
+        tags = [GLOBAL_TAG] if user_id is None else [GLOBAL_TAG, _user_tag(user_id)]
+        cache.get_cache().set_many(
+            {_cache_key(user_id, key): found.get(key) for key in wanted},
+            current_app.config.get("SETTINGS_CACHE_TTL", SETTINGS_CACHE_TTL), tags,
+        )
+
+    if request_cache is not None:
+        request_cache[user_id] = known
+    return {key: known[key] for key in keys if known[key] is not _MISSING}
+
+
+def get(key, user_id=None, default=None):
+    return get_many([key], user_id).get(key, default)
+
+
+def set_value(key, value, user_id=None, description=None):
+    """Create or update a setting (in the caller's transaction); caches are dropped on commit."""
+    setting = Setting.query.filter_by(user_id=user_id, key=key).first()
+    if setting is None:
+        setting = Setting(user_id=user_id, key=key)
+        db.session.add(setting)
+    setting.value = str(value)
+    if description is not None:
+        setting.description = description
+    return setting
+
+
+def invalidate(user_id=_ALL):
+    """Forget cached settings of one user, or of everyone (the default)."""
+    if user_id is _ALL or user_id is None:
+        cache.invalidate_tags([GLOBAL_TAG])
+    else:
+        cache.invalidate_tags([_user_tag(user_id)])
+    if has_app_context():
+        g.pop("settings", None)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_settings_dirty(session, flush_context):
+    dirty = session.info.setdefault("settings_dirty", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Config) or (isinstance(obj, Setting) and obj.user_id is None):
+            # A global value feeds every user's resolved settings
+            dirty.add(_ALL)
+        elif isinstance(obj, Setting):
+            dirty.add(obj.user_id)
+    if not dirty:
+        session.info.pop("settings_dirty")
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    dirty = session.info.pop("settings_dirty", None)
+    if not dirty:
+        return
+    if _ALL in dirty:
+        invalidate()
+    else:
+        for user_id in dirty:
+            invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("settings_dirty", None)
+
+
+settings_cli = AppGroup("settings", help="Global and per-user settings.")
+
+
+@settings_cli.command("show")
+@click.option("--user", "user_id", type=int, help="Resolve for this user.")
+def show_command(user_id):
+    """List the settings in effect (user → global → Config)."""
+    keys = {key for (key,) in db.session.query(Setting.key).filter(
+        or_(Setting.user_id.is_(None), Setting.user_id == user_id))}
+    keys |= {key for (key,) in db.session.query(Config.key)}
+    for key, value in sorted(get_many(keys, user_id).items()):
+        click.echo(f"{key}\t{value}")
+
+
+@settings_cli.command("set")
+@click.argument("key")
+@click.argument("value")
+@click.option("--user", "user_id", type=int, help="Override for this user only.")
+def set_command(key, value, user_id):
+    """Set a global setting or a user's override."""
+    set_value(key, value, user_id)
+    db.session.commit()
+    click.echo(f"{key} = {value}" + (f" for user {user_id}" if user_id is not None else ""))
+
+
+@settings_cli.command("unset")
+@click.argument("key")
+@click.option("--user", "user_id", type=int, help="Remove this user's override.")
+def unset_command(key, user_id):
+    """Remove a global setting or a user's override."""
+    deleted = Setting.query.filter_by(user_id=user_id, key=key).delete()
+    db.session.commit()
+    # A bulk delete does not pass through the flush events
+    invalidate(user_id)
+    click.echo(f"{deleted} setting removed." if deleted else f"{key} is not set.")
+
+
+def init_app(app):
+    app.cli.add_command(settings_cli)
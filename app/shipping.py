@@ -0,0 +1,178 @@
+# app/shipping.py
+import hashlib
+import logging
+import time
+
+import click
+from flask import session
+from flask.cli import AppGroup
+from sqlalchemy import or_
+
+from . import cache
+from .db import db
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Carriers bill the larger of actual and volumetric weight, with volumetric
+# kg = L x W x H (cm) / 5000. In the units stored here that is mm³ / 5000 = grams.
+VOLUMETRIC_DIVISOR = 5000
+# Used for products nobody has weighed yet (the old create_voucher assumed 1 kg too)
+DEFAULT_WEIGHT_GRAMS = 1000
+
+# Quotes are requested per weight bucket, not per exact cart weight, so every
+# cart between 1 and 2 kg to the same destination shares one carrier call.
+# Above the last bucket weights round up to whole HEAVY_STEP_GRAMS.
+WEIGHT_BUCKETS_GRAMS = (500, 1000, 2000, 3000, 5000, 10000, 15000, 20000, 30000)
+HEAVY_STEP_GRAMS = 5000
+
+CART_WEIGHT_TTL = 600
+QUOTE_TTL = 3600
+QUOTES_TAG = "quotes"
+
+METRIC_COLUMNS = (Product.id, Product.weight_grams, Product.length_mm, Product.width_mm, Product.height_mm)
+
+
+def volumetric_grams(length_mm, width_mm, height_mm):
+    if not (length_mm and width_mm and height_mm):
+        return 0
+    return -(-length_mm * width_mm * height_mm // VOLUMETRIC_DIVISOR)
+
+
+def chargeable_grams(weight_grams, length_mm=None, width_mm=None, height_mm=None):
+    """Billable weight of one unit: actual (or the default) vs volumetric, whichever is larger."""
+    actual = weight_grams if weight_grams is not None else DEFAULT_WEIGHT_GRAMS
+    return max(actual, volumetric_grams(length_mm, width_mm, height_mm))
+
+
+def shipment_grams(cart, products=None):
+    """
+    Chargeable weight of a session cart. ``products`` ({id: Product}, e.g.
+    from ``pricing.cart_products``) avoids the query; otherwise the metrics
+    of every line are read with one query. Unknown products weigh nothing.
+    """
+    quantities = {}
+    for item in cart:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    if not quantities:
+        return 0
+    if products is not None:
+        rows = [
+            (p.id, p.weight_grams, p.length_mm, p.width_mm, p.height_mm)
+            for p in products.values() if p.id in quantities
+        ]
+    else:
+        rows = db.session.query(*METRIC_COLUMNS).filter(Product.id.in_(quantities)).all()
+    return sum(chargeable_grams(*metrics) * quantities[product_id] for product_id, *metrics in rows)
+
+
+def order_shipment(order):
+    """
+    What Carrier.create_voucher needs for ``order``: recipient and address
+    from the order, weight from its items (one query for the metrics).
+    """
+    lines = [{"product_id": item.product_id, "quantity": item.quantity} for item in order.items]
+    return {
+        "order_id": order.id,
+        "reference": f"ORDER-{order.id}",
+        "recipient_name": order.user.name or "Customer",
+        "address": order.shipping_address,
+        "phone": order.shipping_phone,
+        "zipcode": order.shipping_zipcode,
+        "region": order.shipping_region,
+        "weight_kg": shipment_grams(lines) / 1000,
+        "items": len(lines),
+    }
+
+
+def _cart_signature(cart):
+    lines = sorted(f"{item['product_id']}:{item['quantity']}" for item in cart)
+    return hashlib.blake2b(",".join(lines).encode(), digest_size=8).hexdigest()
+
+
+def cart_shipment_grams(products=None):
+    """
+    Chargeable weight of the current session cart, cached in the session next
+    to the cart. The entry is keyed on the cart contents, so any add, remove or
+    quantity change recomputes it; the TTL picks up re-weighed products.
+    """
+    cart = session.get("cart") or []
+    if not cart:
+        return 0
+    signature = _cart_signature(cart)
+    cached = session.get("cart_weight")
+    if cached and cached[0] == signature and cached[2] > time.time():
+        return cached[1]
+    grams = shipment_grams(cart, products)
+    session["cart_weight"] = [signature, grams, time.time() + CART_WEIGHT_TTL]
+    return grams
+
+
+def weight_bucket(grams):
+    """Smallest bucket that holds ``grams`` (in grams)."""
+    for bucket in WEIGHT_BUCKETS_GRAMS:
+        if grams <= bucket:
+            return bucket
+    return -(-grams // HEAVY_STEP_GRAMS) * HEAVY_STEP_GRAMS
+
+
+def quote(carrier, destination, grams, fetch):
+    """
+    Carrier price for a shipment, cached per (carrier, destination, weight
+    bucket) in the shared cache, so all workers share one carrier call per
+    bucket. ``fetch(weight_kg)`` asks the carrier for the bucket's upper
+    weight and returns ``(result, status)``; only status 200 is cached.
+    """
+    bucket = weight_bucket(grams)
+    destination = (destination or "").strip().lower()
+    return tuple(cache.get_cache().get_or_set(
+        f"quote:{carrier}:{bucket}:{destination}",
+        lambda: fetch(bucket / 1000),
+        QUOTE_TTL, [QUOTES_TAG],
+        cache_if=lambda answer: answer[1] == 200,
+    ))
+
+
+def clear_quotes():
+    cache.invalidate_tags([QUOTES_TAG])
+
+
+shipping_cli = AppGroup("shipping", help="Product weights and carrier quotes.")
+
+
+@shipping_cli.command("missing")
+@click.option("--limit", default=20, show_default=True, help="How many products to list.")
+def missing_command(limit):
+    """List products without a weight or dimensions (they ship at the default weight)."""
+    query = Product.query.filter(or_(
+        Product.weight_grams.is_(None), Product.length_mm.is_(None),
+        Product.width_mm.is_(None), Product.height_mm.is_(None),
+    ))
+    click.echo(f"{query.count()} products are missing shipping metrics.")
+    for product in query.order_by(Product.id).limit(limit):
+        click.echo(f"{product.id}\t{product.name}")
+
+
+@shipping_cli.command("set")
+@click.argument("product_id", type=int)
+@click.option("--weight", "weight_grams", type=int, help="Grams.")
+@click.option("--size", help="LxWxH in millimetres, e.g. 300x200x100.")
+def set_command(product_id, weight_grams, size):
+    """Record a product's weight and/or dimensions."""
+    product = Product.query.get(product_id)
+    if product is None:
+        raise click.ClickException(f"Product {product_id} not found.")
+    if weight_grams is not None:
+        product.weight_grams = weight_grams
+    if size:
+        try:
+            product.length_mm, product.width_mm, product.height_mm = (int(x) for x in size.lower().split("x"))
+        except ValueError:
+            raise click.BadParameter("expected LxWxH, e.g. 300x200x100", param_hint="--size")
+    db.session.commit()
+    grams = chargeable_grams(product.weight_grams, product.length_mm, product.width_mm, product.height_mm)
+    click.echo(f"{product.name}: ships as {grams} g (bucket {weight_bucket(grams)} g)")
+
+
+def init_app(app):
+    app.cli.add_command(shipping_cli)
@@ -0,0 +1,140 @@
+# app/templating.py
+import logging
+import os
+import threading
+import time
+
+import click
+from flask import current_app, g, has_request_context
+from flask.cli import AppGroup, with_appcontext
+from flask.signals import before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+logger = logging.getLogger(__name__)
+
+# A render slower than this is logged with the template's name
+SLOW_RENDER_MS = 50
+
+_stats_lock = threading.Lock()
+_stats = {}  # template name -> [renders, total ms, max ms]
+
+
+def cache_dir(app):
+    """Where compiled templates are kept, or None when the cache is disabled."""
+    directory = app.config.get("TEMPLATE_CACHE_DIR")
+    if directory is False:
+        return None
+    return directory or os.path.join(app.instance_path, "jinja")
+
+
+def precompile(app):
+    """
+    Compile every template into the environment (and so into the bytecode
+    cache). Returns ``(compiled, failed)`` where ``failed`` lists
+    ``(name, error)`` for templates that do not compile.
+    """
+    env = app.jinja_env
+    compiled, failed = 0, []
+    for name in env.list_templates(filter_func=lambda n: n.endswith(".html")):
+        try:
+            env.get_template(name)
+        except TemplateError as e:
+            logger.error(f"Template {name} does not compile: {e}")
+            failed.append((name, e))
+            continue
+        compiled += 1
+    return compiled, failed
+
+
+def _render_started(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("template_starts", []).append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    starts = g.get("template_starts") if has_request_context() else None
+    if not starts:
+        return
+    elapsed = (time.perf_counter() - starts.pop()) * 1000
+    name = template.name or "<string>"
+    with _stats_lock:
+        entry = _stats.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+    g.setdefault("template_timings", []).append((name, elapsed))
+    if elapsed > current_app.config.get("TEMPLATE_SLOW_MS", SLOW_RENDER_MS):
+        logger.warning(f"Rendering {name} took {elapsed:.1f} ms")
+
+
+def _timing_header(response):
+    timings = g.get("template_timings")
+    if timings and current_app.config.get("TEMPLATE_TIMING_HEADER"):
+        for index, (name, elapsed) in enumerate(timings):
+            response.headers.add("Server-Timing", f'render{index};desc="{name}";dur={elapsed:.1f}')
+    return response
+
+
+def render_stats():
+    """
+    Render timings of this process since start (or ``reset_stats``), slowest
+    average first: ``[(name, renders, avg_ms, max_ms)]``.
+    """
+    with _stats_lock:
+        rows = [(name, n, total / n, peak) for name, (n, total, peak) in _stats.items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+templates_cli = AppGroup("templates", help="Template compilation and the bytecode cache.")
+
+
+@templates_cli.command("compile")
+@with_appcontext
+def compile_command():
+    """Precompile every template into the bytecode cache (e.g. at deploy)."""
+    start = time.perf_counter()
+    compiled, failed = precompile(current_app)
+    click.echo(f"{compiled} templates compiled in {(time.perf_counter() - start) * 1000:.0f} ms"
+               f" into {cache_dir(current_app) or 'memory only (cache disabled)'}")
+    if failed:
+        raise click.ClickException(f"{len(failed)} templates failed: {', '.join(name for name, _ in failed)}")
+
+
+@templates_cli.command("clear")
+@with_appcontext
+def clear_command():
+    """Delete the compiled templates."""
+    bytecode_cache = current_app.jinja_env.bytecode_cache
+    if bytecode_cache is None:
+        raise click.ClickException("The template bytecode cache is disabled.")
+    bytecode_cache.clear()
+    click.echo("Template bytecode cache cleared.")
+
+
+def init_app(app):
+    """
+    Keep compiled templates on disk so a restarted worker loads bytecode
+    instead of recompiling every template on its first render. The cache is
+    keyed on each template's source checksum, so an edited template is
+    recompiled, and the files are written atomically, so all workers on a
+    host can share the directory. TEMPLATE_PRECOMPILE compiles everything at
+    startup rather than on first use.
+    """
+    app.config.setdefault("TEMPLATE_TIMING_HEADER", app.debug)
+    directory = cache_dir(app)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    if app.config.get("TEMPLATE_PRECOMPILE"):
+        compiled, failed = precompile(app)
+        logger.info(f"Precompiled {compiled} templates ({len(failed)} failed)")
+
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.after_request(_timing_header)
+    app.cli.add_command(templates_cli)
@@ -0,0 +1,261 @@
+# app/tracking.py
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import or_, update
+
+from . import cache, carriers, shipping
+from .db import db
+from .models import Order, ShipmentTracking
+
+logger = logging.getLogger(__name__)
+
+# An open voucher is re-checked at most this often; a voucher in a closed
+# status is never polled again.
+POLL_INTERVAL = 300
+POLL_BATCH_SIZE = 100
+CLOSED_STATUSES = {"delivered", "cancelled", "canceled", "returned", "returned to sender", "destroyed"}
+
+# Pickup slots change rarely within a day. The poller fetches them for the
+# coming PICKUP_SLOTS_DAYS days at most once per PICKUP_SLOTS_TTL and keeps
+# them in the shared cache for PICKUP_SLOTS_KEEP seconds, so a carrier that
+# fails a refresh goes on answering with its last known slots; requests only
+# read the cache.
+PICKUP_SLOTS_TTL = 900
+PICKUP_SLOTS_DAYS = 7
+PICKUP_SLOTS_KEEP = 2 * 86400
+PICKUP_SLOTS_TAG = "pickup_slots"
+
+
+def register(carrier, voucher_number, order_id=None, job_id=None):
+    """Start tracking a voucher (in the caller's transaction); it is polled from the next run on."""
+    shipment = ShipmentTracking.query.filter_by(carrier=carrier, voucher_number=voucher_number).first()
+    if shipment is None:
+        shipment = ShipmentTracking(carrier=carrier, voucher_number=voucher_number)
+        db.session.add(shipment)
+    shipment.order_id = order_id if order_id is not None else shipment.order_id
+    shipment.job_id = job_id if job_id is not None else shipment.job_id
+    shipment.is_open = True
+    return shipment
+
+
+def close(carrier, voucher_number, status):
+    db.session.execute(
+        update(ShipmentTracking)
+        .where(ShipmentTracking.carrier == carrier, ShipmentTracking.voucher_number == voucher_number)
+        .values(status=status, is_open=False, changed_at=datetime.utcnow())
+    )
+
+
+def by_voucher(carrier, voucher_number):
+    return ShipmentTracking.query.filter_by(carrier=carrier, voucher_number=voucher_number).first()
+
+
+def by_job_id(carrier, job_id):
+    return ShipmentTracking.query.filter_by(carrier=carrier, job_id=job_id).first()
+
+
+def for_order(order_id):
+    """The order's voucher, the most recent one if it was booked again."""
+    return ShipmentTracking.query.filter_by(order_id=order_id).order_by(ShipmentTracking.id.desc()).first()
+
+
+def lock_order(order_id):
+    """Load an order row-locked until the caller's transaction ends (None if there is none)."""
+    return Order.query.filter_by(id=order_id).with_for_update().populate_existing().first()
+
+
+def book(order, carrier):
+    """
+    Book ``order``'s voucher with ``carrier`` and start tracking it, unless
+    it already has one; returns ``(shipment, created)``. The caller holds the
+    order's row lock (lock_order) from before this call to its commit, so the
+    order.paid job, a rerun of it and /delivery/create-voucher take turns and
+    only the first books. The shipment carries ``ORDER-<id>`` as reference,
+    so a booking repeated after a failed commit is recognised by the carrier.
+    CarrierError and NotImplementedError come from the carrier.
+    """
+    shipment = for_order(order.id)
+    if shipment is not None:
+        return shipment, False
+    voucher_no, job_id = carrier.create_voucher(shipping.order_shipment(order))
+    return register(carrier.name, voucher_no, order_id=order.id, job_id=job_id), True
+
+
+def checked_at(shipment):
+    return shipment.polled_at.isoformat() + "Z" if shipment.polled_at else None
+
+
+def is_closed(status):
+    return status is not None and status.strip().lower() in CLOSED_STATUSES
+
+
+def poll(carrier=None, batch_size=POLL_BATCH_SIZE, interval=POLL_INTERVAL):
+    """
+    Refresh every open voucher not checked in the last ``interval`` seconds:
+    one Carrier.track call per carrier and batch (which fans out as the
+    carrier sees fit) and one bulk UPDATE per batch, committed as it goes.
+    Every polled row gets a new ``polled_at`` (failures too), so a run always
+    terminates and a voucher the carrier keeps rejecting does not starve the
+    rest.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=interval)
+    stats = Counter()
+    last_id = 0
+    while True:
+        query = (
+            db.session.query(ShipmentTracking.id, ShipmentTracking.carrier, ShipmentTracking.voucher_number,
+                             ShipmentTracking.job_id, ShipmentTracking.status, ShipmentTracking.job_status,
+                             ShipmentTracking.changed_at)
+            .filter(ShipmentTracking.is_open.is_(True), ShipmentTracking.id > last_id,
+                    or_(ShipmentTracking.polled_at.is_(None), ShipmentTracking.polled_at < cutoff))
+        )
+        if carrier:
+            query = query.filter(ShipmentTracking.carrier == carrier)
+        rows = query.order_by(ShipmentTracking.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        by_carrier = {}
+        for row in rows:
+            by_carrier.setdefault(row.carrier, []).append(row)
+        now = datetime.utcnow()
+        updates = []
+        for name, shipments in by_carrier.items():
+            if name not in carriers.names():
+                logger.warning(f"No carrier plugin for {name}; skipping {len(shipments)} vouchers")
+                results = {}
+            else:
+                try:
+                    results = carriers.get(name).track([(s.voucher_number, s.job_id) for s in shipments])
+                except Exception as e:
+                    logger.exception(f"Polling {name} failed")
+                    results = {s.voucher_number: {"error": str(e)} for s in shipments}
+            for s in shipments:
+                result = results.get(s.voucher_number) or {"error": "no result"}
+                status = result.get("status") or s.status
+                job_status = result.get("job_status") or s.job_status
+                changed = (status, job_status) != (s.status, s.job_status)
+                updates.append({
+                    "id": s.id,
+                    "status": status,
+                    "job_status": job_status,
+                    "is_open": not is_closed(status),
+                    "last_error": result.get("error"),
+                    "polled_at": now,
+                    "changed_at": now if changed else s.changed_at,
+                })
+                stats["polled"] += 1
+                stats["changed"] += changed
+                stats["closed"] += is_closed(status)
+                stats["errors"] += bool(result.get("error"))
+        db.session.execute(update(ShipmentTracking), updates)
+        db.session.commit()
+    logger.info(f"Tracking poll: {dict(stats)}")
+    return stats
+
+
+def _slots_key(carrier, pickup_date):
+    return f"pickup_slots:{carrier}:{pickup_date.isoformat()}"
+
+
+def _slots_refreshed_key(carrier):
+    return f"pickup_slots:refreshed:{carrier}"
+
+
+def pickup_slots(carrier, pickup_date):
+    """Pickup times for ``pickup_date`` as last fetched by ``refresh_slots``, or None if none are known."""
+    return cache.get_cache().get(_slots_key(carrier, pickup_date))
+
+
+def refresh_slots(carrier=None, days=PICKUP_SLOTS_DAYS, force=False):
+    """
+    Fetch the pickup slots of the coming ``days`` days from every carrier
+    (or just ``carrier``) not refreshed in the last PICKUP_SLOTS_TTL seconds,
+    in parallel on the shared transport. A date the carrier fails on keeps
+    its cached slots. Returns the number of dates stored.
+    """
+    store = cache.get_cache()
+    names = [carrier] if carrier else carriers.names()
+    if not force:
+        refreshed = store.get_many([_slots_refreshed_key(name) for name in names])
+        names = [name for name in names if _slots_refreshed_key(name) not in refreshed]
+    dates = [date.today() + timedelta(days=offset) for offset in range(days)]
+
+    def fetch(item):
+        name, day = item
+        try:
+            return item, carriers.get(name).pickup_slots(day)
+        except carriers.CarrierError as e:
+            logger.warning(f"No {name} pickup slots for {day}: {e}")
+            return item, None
+        except Exception:
+            logger.exception(f"Fetching {name} pickup slots for {day} failed")
+            return item, None
+
+    found = {}
+    for (name, day), times in carriers.transport().map(fetch, [(n, d) for n in names if n in carriers.names() for d in dates]):
+        if times is not None:
+            found[_slots_key(name, day)] = times
+    store.set_many(found, PICKUP_SLOTS_KEEP, [PICKUP_SLOTS_TAG])
+    store.set_many({_slots_refreshed_key(name): True for name in names}, PICKUP_SLOTS_TTL)
+    return len(found)
+
+
+tracking_cli = AppGroup("tracking", help="Carrier voucher tracking.")
+
+
+@tracking_cli.command("poll")
+@click.option("--carrier", help="Only this carrier.")
+@click.option("--batch-size", default=POLL_BATCH_SIZE, show_default=True)
+@click.option("--interval", default=POLL_INTERVAL, show_default=True,
+              help="Seconds before an open voucher is checked again.")
+@click.option("--every", type=float, help="Keep running, polling every this many seconds (otherwise run once, e.g. from cron).")
+def poll_command(carrier, batch_size, interval, every):
+    """Refresh the status of open vouchers, and the pickup slots, from the carriers."""
+    while True:
+        stats = poll(carrier, batch_size, interval)
+        slots = refresh_slots(carrier)
+        click.echo(f"polled={stats['polled']} changed={stats['changed']} "
+                   f"closed={stats['closed']} errors={stats['errors']} slots={slots}")
+        if not every:
+            return
+        time.sleep(every)
+
+
+@tracking_cli.command("slots")
+@click.option("--carrier", default="geniki", show_default=True)
+@click.option("--days", default=PICKUP_SLOTS_DAYS, show_default=True)
+@click.option("--refresh", is_flag=True, help="Fetch them from the carrier first.")
+def slots_command(carrier, days, refresh):
+    """Show the pickup slots known for the coming days."""
+    if refresh:
+        refresh_slots(carrier, days, force=True)
+    for offset in range(days):
+        day = date.today() + timedelta(days=offset)
+        times = pickup_slots(carrier, day)
+        click.echo(f"{day}\t{', '.join(times) if times is not None else 'unavailable'}")
+
+
+@tracking_cli.command("show")
+@click.argument("voucher_number")
+@click.option("--carrier", default="geniki", show_default=True)
+def show_command(voucher_number, carrier):
+    """Show the stored status of one voucher."""
+    shipment = by_voucher(carrier, voucher_number)
+    if shipment is None:
+        raise click.ClickException(f"Voucher {voucher_number} is not tracked.")
+    click.echo(f"{shipment.voucher_number}\torder {shipment.order_id}\t{shipment.status or '-'}"
+               f"\tjob {shipment.job_status or '-'}\t{'open' if shipment.is_open else 'closed'}"
+               f"\tchecked {checked_at(shipment) or 'never'}")
+    if shipment.last_error:
+        click.echo(f"last error: {shipment.last_error}")
+
+
+def init_app(app):
+    app.cli.add_command(tracking_cli)
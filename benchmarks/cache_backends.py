@@ -0,0 +1,129 @@
+"""
+Cache backend benchmark.
+
+Times single and batched gets and sets, tag invalidation and a cache
+stampede (many threads, and for shared backends many processes, missing
+the same key at once) for the process-local LRU, the shared SQLite file
+and, when a URL is given, Redis. The stampede reports how many times the
+slow loader actually ran; single-flight should keep it at 1.
+
+    python benchmarks/cache_backends.py --redis-url redis://localhost:6379/15
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from common import report, timed
+
+
+def make_backend(kind, target):
+    from app.cache import LocalCache, RedisCache, SQLiteCache
+
+    if kind == "local":
+        return LocalCache()
+    if kind == "sqlite":
+        return SQLiteCache(target)
+    return RedisCache(target, namespace="eshop-bench:")
+
+
+def stampede(cache, key, threads, calls, load_ms):
+    def loader():
+        with calls.get_lock():
+            calls.value += 1
+        time.sleep(load_ms / 1000)
+        return {"loaded": True}
+
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        cache.get_or_set(key, loader, ttl=60)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+
+def stampede_process(kind, target, key, threads, calls, load_ms, start, elapsed, index):
+    from app.cache import Cache
+
+    cache = Cache(make_backend(kind, target))
+    start.wait()
+    began = time.perf_counter()
+    stampede(cache, key, threads, calls, load_ms)
+    # Timed here: joining includes interpreter shutdown
+    elapsed[index] = (time.perf_counter() - began) * 1000
+
+
+def run(kind, target, args):
+    from app.cache import Cache
+
+    cache = Cache(make_backend(kind, target), prefix=f"bench{os.getpid()}:")
+    cache.clear()
+    value = {"id": 1, "name": "Category 1", "children": list(range(20))}
+    batch = {f"many:{i}": value for i in range(100)}
+
+    cache.set("hit", value, ttl=600)
+    report(f"[{kind}] set", timed(lambda: cache.set("hit", value, ttl=600), repeat=args.repeat))
+    report(f"[{kind}] get (hit)", timed(lambda: cache.get("hit"), repeat=args.repeat))
+    report(f"[{kind}] get (miss)", timed(lambda: cache.get("missing"), repeat=args.repeat))
+    report(f"[{kind}] set_many (100, tagged)", timed(lambda: cache.set_many(batch, 600, ["bench"]), repeat=args.repeat // 10))
+    report(f"[{kind}] get_many (100)", timed(lambda: cache.get_many(batch), repeat=args.repeat // 10))
+    report(f"[{kind}] invalidate tag (100 keys)", timed(
+        lambda: (cache.set_many(batch, 600, ["bench"]), cache.invalidate_tags(["bench"])), repeat=args.repeat // 10
+    ))
+
+    calls = multiprocessing.get_context("spawn").Value("i", 0)
+    start = time.perf_counter()
+    stampede(cache, "stampede:threads", args.threads, calls, args.load_ms)
+    report(f"[{kind}] stampede ({args.threads} threads)", {
+        "loads": calls.value, "wall_ms": round((time.perf_counter() - start) * 1000, 1),
+    })
+
+    if kind != "local":
+        ctx = multiprocessing.get_context("spawn")
+        calls = ctx.Value("i", 0)
+        # Every process is imported and connected before the key is missed
+        ready = ctx.Barrier(args.processes + 1)
+        elapsed = ctx.Array("d", args.processes)
+        processes = [
+            ctx.Process(target=stampede_process, args=(
+                kind, target, f"{cache.prefix}stampede:processes", args.threads, calls, args.load_ms, ready, elapsed, i,
+            ))
+            for i in range(args.processes)
+        ]
+        for p in processes:
+            p.start()
+        ready.wait()
+        for p in processes:
+            p.join()
+        report(f"[{kind}] stampede ({args.processes} processes x {args.threads} threads)", {
+            "loads": calls.value, "wall_ms": round(max(elapsed), 1),
+        })
+    cache.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--redis-url", help="Also benchmark Redis (uses keys under eshop-bench:).")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--load-ms", type=float, default=50, help="How long the stampeding loader takes.")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(prefix="eshop-cache-", suffix=".db")
+    os.close(fd)
+    run("local", None, args)
+    run("sqlite", path, args)
+    if args.redis_url:
+        run("redis", args.redis_url, args)
+
+
+if __name__ == "__main__":
+    main()
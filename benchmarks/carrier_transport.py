@@ -0,0 +1,79 @@
+"""
+Carrier calls through the shared transport versus one-off clients.
+
+Tracks a batch of ACS and Geniki vouchers against the stub gateway three
+ways: a fresh connection per call, sequentially (what the old ACS
+``requests.post`` calls did); one pooled session, sequentially; and the
+shared carrier transport, which runs the calls of all carriers on one
+pool of keep-alive connections. Reports wall time and the transport's
+per-operation metrics.
+
+    python benchmarks/carrier_transport.py --vouchers 200 --latency-ms 20
+"""
+import argparse
+import os
+import time
+
+import requests
+
+from common import make_app, report
+from stubs import start_stubs, stub_environment
+
+
+def track_all(app, vouchers):
+    from app import carriers
+
+    with app.app_context():
+        results = {}
+        for name in carriers.names():
+            results.update(carriers.get(name).track([(v, None) for v in vouchers[name]]))
+        return results
+
+
+def one_off(url, vouchers, session=None):
+    post = session.post if session is not None else requests.post
+    for voucher in vouchers["acs"]:
+        post(f"{url}/acs", json={"ACSAlias": "ACS_TrackingSummary", "ACSInputParameters": {"Voucher_No": voucher}},
+             timeout=15).raise_for_status()
+    for voucher in vouchers["geniki"]:
+        post(f"{url}/geniki", data=f"<voucherNumber>{voucher}</voucherNumber>", timeout=15,
+             headers={"SOAPAction": "http://voucher.taxydromiki.gr/JobServicesV2.asmx/GetVoucherPickUpStatus"},
+             ).raise_for_status()
+
+
+def timed_once(fn):
+    start = time.perf_counter()
+    fn()
+    return {"seconds": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--vouchers", type=int, default=200, help="Per carrier.")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--pool-size", type=int, default=16)
+    args = parser.parse_args()
+
+    server, url = start_stubs(latency_ms=args.latency_ms)
+    os.environ.update(stub_environment(url))
+    app = make_app(None, LOG_LEVEL="WARNING", CARRIER_POOL_SIZE=args.pool_size)
+    vouchers = {"acs": [str(7100000000000000 + i) for i in range(args.vouchers)],
+                "geniki": [str(7200000000000000 + i) for i in range(args.vouchers)]}
+    print(f"{2 * args.vouchers} tracking calls, stub latency {args.latency_ms} ms")
+
+    report("new connection per call", timed_once(lambda: one_off(url, vouchers)))
+    report("one pooled session, sequential", timed_once(lambda: one_off(url, vouchers, requests.Session())))
+    track_all(app, {"acs": [], "geniki": ["warm-up"]})  # Geniki authenticates once
+    report(f"shared transport ({args.pool_size} connections)", timed_once(lambda: track_all(app, vouchers)))
+
+    from app import carriers
+
+    with app.app_context():
+        for row in carriers.transport().metrics():
+            report(f"  {row['carrier']} {row['operation']}",
+                   {k: row[k] for k in ("calls", "errors", "avg_ms", "max_ms")})
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Faceted catalog query benchmark.
+
+Seeds a synthetic catalog (two-level category tree, many products) and times
+the grouped facet query, a category-filtered page and the cached category
+tree, with and without the products.category_id index.
+
+    python benchmarks/catalog_facets.py --products 200000 --categories 60
+"""
+import argparse
+import random
+
+from common import make_app, report, timed
+
+
+def seed(db, n_products, n_categories, chunk=10000):
+    from app.models import Category, Product
+
+    roots = max(1, n_categories // 10)
+    cats = []
+    for i in range(n_categories):
+        parent = None if i < roots else (i % roots) + 1
+        cats.append({"id": i + 1, "name": f"Category {i + 1}", "parent_id": parent})
+    db.session.execute(Category.__table__.insert(), cats)
+
+    rng = random.Random(42)
+    for start in range(0, n_products, chunk):
+        rows = [
+            {
+                "name": f"Bag {i}",
+                "description": "Synthetic product",
+                "price_cents": int(rng.lognormvariate(3.8, 0.8) * 100),
+                "stock": rng.randint(0, 100),
+                "category_id": rng.randint(1, n_categories),
+            }
+            for i in range(start, min(start + chunk, n_products))
+        ]
+        db.session.execute(Product.__table__.insert(), rows)
+    db.session.commit()
+
+
+def run(app, label):
+    from flask import g
+
+    from app import catalog
+    from app.db import db
+    from app.models import Product
+
+    with app.test_request_context():
+        tree = catalog.get_category_tree()
+        leaf = next(n["id"] for n in tree["nodes"].values() if not n["children"])
+        root = tree["roots"][0]["id"]
+        base = Product.query.filter(Product.name.ilike("%bag 1%"))
+
+        report(f"[{label}] facet_counts (all)", timed(lambda: catalog.facet_counts(base)))
+        report(f"[{label}] facet_counts (root + band)",
+               timed(lambda: catalog.facet_counts(base, category_id=root, band="50-100")))
+        report(f"[{label}] page (leaf category)", timed(
+            lambda: catalog.filter_products(Product.query, category_id=leaf)
+            .order_by(Product.name).paginate(page=1, per_page=9, error_out=False)
+        ))
+        report(f"[{label}] tree rebuild", timed(
+            lambda: (catalog.invalidate_category_tree(), catalog.get_category_tree()), repeat=10
+        ))
+        # A new request reads the tree from the shared cache once
+        report(f"[{label}] tree cached", timed(
+            lambda: (g.pop("category_tree", None), catalog.get_category_tree()), repeat=1000
+        ))
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--categories", type=int, default=60)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from app.db import db
+
+    with app.app_context():
+        seed(db, args.products, args.categories)
+    run(app, "indexed")
+
+    with app.app_context():
+        db.session.execute(db.text("DROP INDEX ix_products_category_id"))
+        db.session.commit()
+    run(app, "no index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# benchmarks/common.py
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def make_app(database_url=None, **config):
+    """
+    Build the real application against a benchmark database. Without a URL a
+    throwaway SQLite file is used so nothing touches the development DB.
+    """
+    from app import create_app
+
+    if database_url is None:
+        fd, path = tempfile.mkstemp(prefix="eshop-bench-", suffix=".db")
+        os.close(fd)
+        database_url = f"sqlite:///{path}"
+    config.setdefault("SQLALCHEMY_DATABASE_URI", database_url)
+    config.setdefault("TESTING", True)
+    config.setdefault("RATELIMIT_ENABLED", False)
+    return create_app(config)
+
+
+def percentile(sorted_samples, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def timed(fn, repeat=20, warmup=2):
+    """Run ``fn`` and return timing stats in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def report(name, stats):
+    cols = "  ".join(f"{k}={v}" for k, v in stats.items())
+    print(f"{name:<40} {cols}")
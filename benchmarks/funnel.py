@@ -0,0 +1,227 @@
+"""
+Shopping-funnel load test.
+
+Serves the real app over HTTP in-process (or targets --url), points Viva,
+ACS and Geniki at local stubs, and runs concurrent virtual users through
+
+    browse -> product -> add_to_cart -> cart -> delivery_info -> checkout -> webhook
+
+Reports p50/p95/p99 latency, SQL statements per request and throughput per
+step, and writes everything to benchmarks/results/ as JSON. Pass --compare
+with an earlier result file to print the per-step change.
+
+    python benchmarks/funnel.py --vus 16 --duration 60 --products 100000 --orders 1000000
+    python benchmarks/funnel.py --database-url postgresql://.../eshop_bench --no-seed --compare results/old.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from common import ROOT, make_app, percentile
+from seed import BENCH_HASH_METHOD, PASSWORD, seed
+from stubs import start_stubs, stub_environment
+
+STEPS = ["login", "browse", "product", "add_to_cart", "cart", "delivery_info", "checkout", "webhook"]
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {step: [] for step in STEPS}
+        self.queries = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+
+    def record(self, step, seconds, response, ok):
+        with self._lock:
+            self.samples[step].append(seconds * 1000)
+            count = response.headers.get("X-Query-Count") if response is not None else None
+            if count is not None:
+                self.queries[step].append(int(count))
+            if not ok:
+                self.errors[step] += 1
+
+    def summary(self, wall_seconds):
+        routes = {}
+        for step in STEPS:
+            samples = sorted(self.samples[step])
+            if not samples:
+                continue
+            queries = self.queries[step]
+            routes[step] = {
+                "requests": len(samples),
+                "errors": self.errors[step],
+                "throughput_rps": round(len(samples) / wall_seconds, 2),
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "max_ms": round(samples[-1], 2),
+                "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+                "queries_max": max(queries) if queries else None,
+            }
+        return routes
+
+
+def virtual_user(base_url, stub_url, email, product_count, recorder, deadline, webhook_key):
+    http = requests.Session()
+    rng = random.Random(email)
+
+    def step(name, method, url, expect=(200, 302), **kwargs):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = http.request(method, url, allow_redirects=False, timeout=60, **kwargs)
+            ok = response.status_code in expect
+        except requests.RequestException:
+            ok = False
+        recorder.record(name, time.perf_counter() - start, response, ok)
+        return response
+
+    step("login", "POST", f"{base_url}/login", data={"email": email, "password": PASSWORD}, expect=(302,))
+    delivery = {"address": "1 Load Street", "phone": "2100000000", "zipcode": "10431", "region": "Attica"}
+    while time.monotonic() < deadline:
+        step("browse", "GET", f"{base_url}/products?page={rng.randint(1, 50)}&sort={rng.choice(['name', 'price-asc'])}")
+        for _ in range(rng.randint(1, 3)):
+            product_id = rng.randint(1, product_count)
+            step("product", "GET", f"{base_url}/product/{product_id}")
+            step("add_to_cart", "POST", f"{base_url}/add_to_cart/{product_id}", data={"quantity": 1}, expect=(302,))
+        step("cart", "GET", f"{base_url}/cart")
+        step("delivery_info", "POST", f"{base_url}/delivery_info", data=delivery, expect=(302,))
+        response = step("checkout", "POST", f"{base_url}/payment/checkout", data=delivery, expect=(302,))
+
+        # Play the gateway: look up the order the shop registered and confirm it via the webhook.
+        location = response.headers.get("Location", "") if response is not None else ""
+        if "ref=" not in location:
+            continue
+        code = location.split("ref=", 1)[1].split("&", 1)[0]
+        order = http.get(f"{stub_url}/stub/orders/{code}", timeout=10).json()
+        step("webhook", "POST", order["webhookUrl"], json={"statusId": "F"}, headers={"Key": webhook_key})
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current, previous_path):
+    previous = json.loads(Path(previous_path).read_text())["routes"]
+    print(f"\nvs {previous_path}")
+    for step, stats in current.items():
+        old = previous.get(step)
+        if not old:
+            continue
+        change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        queries = ""
+        if stats["queries_mean"] is not None and old.get("queries_mean") is not None:
+            queries = f"  queries {old['queries_mean']} -> {stats['queries_mean']}"
+        print(f"{step:<14} p95 {old['p95_ms']:>8} -> {stats['p95_ms']:>8} ms ({change:+.1f}%)"
+              f"  rps {old['throughput_rps']} -> {stats['throughput_rps']}{queries}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", help="Database to run against (default: a fresh SQLite file).")
+    parser.add_argument("--no-seed", action="store_true", help="Use the data already in --database-url.")
+    parser.add_argument("--url", help="Drive an already running shop instead of serving it in-process.")
+    parser.add_argument("--vus", type=int, default=8, help="Concurrent virtual users.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="Simulated gateway latency.")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/funnel-<commit>-<time>.json).")
+    parser.add_argument("--compare", help="Earlier result file to compare with.")
+    args = parser.parse_args()
+
+    stub_server, stub_url = start_stubs(latency_ms=args.stub_latency_ms)
+    environment = stub_environment(stub_url)
+    os.environ.update(environment)
+
+    if args.url:
+        base_url, product_count = args.url.rstrip("/"), args.products
+    else:
+        app = make_app(args.database_url, PASSWORD_HASH_METHOD=BENCH_HASH_METHOD, USER_CACHE_TTL=30,
+                       QUERY_COUNT_HEADER=True, QUERY_BUDGET_ENFORCE=False,
+                       **{k: v for k, v in environment.items() if k.startswith("VIVA_") and k.endswith("_URL")})
+        from app.db import db
+        from app.models import Product
+
+        with app.app_context():
+            if not args.no_seed:
+                seed(db, args.users, 60, args.products, args.orders)
+            product_count = db.session.query(Product).count()
+        server, base_url = serve(app)
+
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=virtual_user, args=(base_url, stub_url, f"user{i % args.users}@bench.local",
+                                                    product_count, recorder, deadline,
+                                                    environment["VIVA_WEBHOOK_KEY"]))
+        for i in range(args.vus)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    routes = recorder.summary(wall)
+    total = sum(r["requests"] for r in routes.values())
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "database": args.url or (args.database_url or "sqlite (temp)").split("@")[-1],
+            "vus": args.vus,
+            "duration_s": round(wall, 2),
+            "stub_latency_ms": args.stub_latency_ms,
+            "products": product_count,
+        },
+        "routes": routes,
+        "total": {"requests": total, "throughput_rps": round(total / wall, 2),
+                  "errors": sum(r["errors"] for r in routes.values())},
+    }
+
+    for step, stats in routes.items():
+        print(f"{step:<14} n={stats['requests']:<6} err={stats['errors']:<4} rps={stats['throughput_rps']:<8} "
+              f"p50={stats['p50_ms']:<8} p95={stats['p95_ms']:<8} p99={stats['p99_ms']:<8} "
+              f"queries={stats['queries_mean']}")
+    print(f"total: {total} requests, {result['total']['throughput_rps']} req/s, {result['total']['errors']} errors")
+
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"funnel-{result['meta']['commit']}-{datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(routes, args.compare)
+    stub_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Logging overhead per request.
+
+Serves a route that logs like a busy view (a few INFO records, many DEBUG
+ones) under several configurations and reports the per-request cost over
+a run with logging off: the old synchronous DEBUG basicConfig, synchronous
+JSON at INFO, and the queued JSON handler at INFO with and without DEBUG
+sampling. Output goes to a temporary file, so real writes are included.
+
+    python benchmarks/logging_overhead.py --requests 2000 --debug-records 20
+"""
+import argparse
+import logging
+import os
+import tempfile
+
+from common import make_app, report, timed
+
+logger = logging.getLogger("bench.view")
+
+
+def make_view(info_records, debug_records):
+    def view():
+        payload = {"items": list(range(10)), "user": "bench"}
+        for i in range(info_records):
+            logger.info("Handled step %d for %s", i, payload["user"])
+        for i in range(debug_records):
+            logger.debug("Intermediate state %d: %s", i, payload)
+        return "ok"
+    return view
+
+
+def sync_handler(path, formatter, level, context=False):
+    from app import logs
+
+    handler = logging.FileHandler(path)
+    handler.setFormatter(formatter)
+    if context:
+        handler.addFilter(logs.ContextFilter())
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+
+
+def run(label, args, config, setup=None):
+    fd, path = tempfile.mkstemp(prefix="eshop-log-", suffix=".log")
+    os.close(fd)
+    app = make_app(None, LOG_FILE=path, **config)
+    app.add_url_rule("/bench/log", "bench_log", make_view(args.info_records, args.debug_records))
+    if setup:
+        setup(path)
+    client = app.test_client()
+    stats = timed(lambda: client.get("/bench/log"), repeat=args.requests, warmup=50)
+
+    from app import logs
+
+    logs.configure(app)  # flush the queue before measuring the file
+    size = os.path.getsize(path)
+    stats["log_kb_per_req"] = round(size / 1024 / (args.requests + 50), 2)
+    report(label, stats)
+    os.remove(path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--info-records", type=int, default=3)
+    parser.add_argument("--debug-records", type=int, default=20)
+    args = parser.parse_args()
+
+    from app.logs import JsonFormatter
+
+    base = run("logging off", args, {"LOG_LEVEL": "CRITICAL"})
+    results = [
+        run("legacy: basicConfig DEBUG, sync text", args, {"LOG_LEVEL": "CRITICAL"},
+            lambda path: sync_handler(path, logging.Formatter(logging.BASIC_FORMAT), logging.DEBUG)),
+        run("sync JSON, INFO", args, {"LOG_LEVEL": "CRITICAL"},
+            lambda path: sync_handler(path, JsonFormatter(), logging.INFO, context=True)),
+        run("queued JSON, INFO", args, {"LOG_LEVEL": "INFO", "LOG_FORMAT": "json"}),
+        run("queued JSON, INFO + 1% DEBUG sampling", args,
+            {"LOG_LEVEL": "INFO", "LOG_FORMAT": "json", "LOG_DEBUG_SAMPLE_RATE": 0.01}),
+        run("queued JSON, DEBUG", args, {"LOG_LEVEL": "DEBUG", "LOG_FORMAT": "json"}),
+    ]
+    print()
+    labels = ["legacy", "sync JSON INFO", "queued INFO", "queued INFO + sampling", "queued DEBUG"]
+    for label, stats in zip(labels, results):
+        print(f"{label:<40} +{stats['median_ms'] - base['median_ms']:.3f} ms/request (median)")
+
+
+if __name__ == "__main__":
+    main()
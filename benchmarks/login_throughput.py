@@ -0,0 +1,71 @@
+"""
+Login and user-loader benchmark.
+
+Measures password verification cost for several hash settings (logins per
+second per core), full POST /login throughput through the app, and
+authenticated request latency with and without the user cache.
+
+    python benchmarks/login_throughput.py --methods pbkdf2:sha256 pbkdf2:sha256:210000 scrypt:16384:8:1
+"""
+import argparse
+import time
+
+from common import make_app, report, timed
+
+
+def hash_rate(method, seconds=2.0):
+    from werkzeug.security import check_password_hash, generate_password_hash
+
+    stored = generate_password_hash("correct horse battery", method=method)
+    n, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        check_password_hash(stored, "correct horse battery")
+        n += 1
+    return n / (time.perf_counter() - start)
+
+
+def login_rate(method, users=20):
+    app = make_app(PASSWORD_HASH_METHOD=method)
+    from app.db import db
+    from app.models import User
+
+    with app.app_context():
+        for i in range(users):
+            user = User(email=f"bench{i}@example.com", name="Bench")
+            user.set_password("correct horse battery")
+            db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+    start = time.perf_counter()
+    for i in range(users):
+        resp = client.post("/login", data={"email": f"bench{i}@example.com", "password": "correct horse battery"})
+        assert resp.status_code == 302, resp.status_code
+    return users / (time.perf_counter() - start), app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--methods", nargs="+",
+                        default=["pbkdf2:sha256", "pbkdf2:sha256:210000", "scrypt:16384:8:1"])
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    for method in args.methods:
+        verify = hash_rate(method)
+        rate, app = login_rate(method, args.users)
+        print(f"{method:<28} verify/s/core={verify:8.1f}  POST /login/s={rate:8.1f}")
+
+    from app import auth
+
+    client = app.test_client()
+    client.post("/login", data={"email": "bench0@example.com", "password": "correct horse battery"})
+    report("GET /dashboard (user cache)", timed(lambda: client.get("/dashboard"), repeat=200))
+
+    app.config["USER_CACHE_TTL"] = 0
+    auth._user_cache.clear()
+    report("GET /dashboard (no cache)", timed(lambda: client.get("/dashboard"), repeat=200))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Pending-order sweeper against the stub Viva gateway.
+
+Seeds an order history, gives every Pending order an old creation time and
+a Viva order code whose stub state is paid, cancelled, expired or still
+pending, then sweeps copies of that database with one Viva call at a time
+and with parallel calls. Reports wall time, orders per second and what the
+sweep did; the stub's latency stands in for the real gateway's.
+
+    python benchmarks/pending_sweep.py --orders 50000 --latency-ms 40 --workers 8
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import make_app, report
+from stubs import start_stubs, stub_environment
+
+STATES = [(3, 30), (2, 10), (1, 50), (0, 10)]  # Viva stateId, weight
+
+
+def prepare(database_url, stub_url, orders):
+    import requests
+
+    from app.db import db
+    from app.models import Order, OrderStatus
+    from seed import seed
+
+    app = make_app(database_url, LOG_LEVEL="WARNING", **stub_environment(stub_url))
+    with app.app_context():
+        seed(db, users=200, categories=20, products=2000, orders=orders, log=lambda *a: None)
+        pending = [order_id for (order_id,) in db.session.query(Order.id).filter(
+            Order.status == OrderStatus.PENDING.value)]
+        rng = random.Random(7)
+        old = datetime.utcnow() - timedelta(hours=2)
+        http = requests.Session()
+        updates = []
+        for order_id in pending:
+            code = str(8000000000000000 + order_id)
+            state = rng.choices([s for s, _ in STATES], [w for _, w in STATES])[0]
+            http.post(f"{stub_url}/stub/orders/{code}", json={"stateId": state, "merchantTrns": f"Order-{order_id}"})
+            updates.append({"id": order_id, "transaction_id": code, "created_at": old})
+        db.session.execute(Order.__table__.update().where(Order.id == db.bindparam("order_id")).values(
+            transaction_id=db.bindparam("code"), created_at=db.bindparam("old")),
+            [{"order_id": u["id"], "code": u["transaction_id"], "old": u["created_at"]} for u in updates])
+        db.session.commit()
+    return len(pending)
+
+
+def run(label, path, stub_url, workers, batch_size):
+    fd, copy = tempfile.mkstemp(prefix="eshop-sweep-", suffix=".db")
+    os.close(fd)
+    shutil.copy(path, copy)
+    app = make_app(f"sqlite:///{copy}", LOG_LEVEL="WARNING", **stub_environment(stub_url))
+    from app import payments
+
+    with app.app_context():
+        start = time.perf_counter()
+        stats = payments.sweep(batch_size=batch_size, workers=workers)
+        seconds = time.perf_counter() - start
+    report(label, {"seconds": round(seconds, 2), "orders_per_s": round(stats["checked"] / seconds, 1),
+                   **{k: stats[k] for k in ("checked", "paid", "cancelled", "expired", "pending", "unresolved")}})
+    os.remove(copy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=20000, help="Order history to seed (about 2% Pending).")
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    server, stub_url = start_stubs(latency_ms=args.latency_ms)
+    os.environ.update(stub_environment(stub_url))
+    fd, path = tempfile.mkstemp(prefix="eshop-bench-", suffix=".db")
+    os.close(fd)
+    pending = prepare(f"sqlite:///{path}", stub_url, args.orders)
+    print(f"{pending} stale Pending orders, stub latency {args.latency_ms} ms")
+    run("sequential (1 worker)", path, stub_url, 1, args.batch_size)
+    run(f"parallel ({args.workers} workers)", path, stub_url, args.workers, args.batch_size)
+    server.shutdown()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
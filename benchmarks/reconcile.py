@@ -0,0 +1,149 @@
+"""
+Payment reconciliation against the stub Viva gateway.
+
+Seeds an order history and gives the stub a transaction listing for the
+last ``--days`` days that matches it, except for a known number of planted
+discrepancies of every kind. Then reconciles those days and checks the
+findings against what was planted. Runs it a second time to show nothing
+is reported twice, and a third time with corrections applied. Reports
+transactions per second for each page size.
+
+    python benchmarks/reconcile.py --orders 200000 --days 30 --latency-ms 30
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from common import make_app, report
+from stubs import start_stubs, stub_environment
+
+PLANTED_EACH = 25
+
+
+def _amount(cents):
+    return round(cents / 100, 2)
+
+
+def plant(database_url, stub_url, orders, days):
+    """Seed the database and the stub's listing; returns the expected findings."""
+    import requests
+
+    from app.db import db
+    from app.models import Order
+    from seed import seed
+
+    app = make_app(database_url, LOG_LEVEL="WARNING")
+    rng = random.Random(11)
+    expected = Counter()
+    with app.app_context():
+        seed(db, users=500, categories=20, products=5000, orders=orders, log=lambda *a: None)
+        since = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+        rows = db.session.query(Order.id, Order.status, Order.payment_status, Order.total_cents,
+                                Order.created_at).filter(Order.created_at >= since).all()
+    by_status = {}
+    for row in rows:
+        by_status.setdefault(row.status, []).append(row)
+
+    def txn(row, status="F", cents=None, reference=None):
+        return {"merchantTrns": reference or f"Order-{row.id}", "statusId": status,
+                "amount": _amount(row.total_cents if cents is None else cents),
+                "insDate": (row.created_at + timedelta(minutes=1)).isoformat()}
+
+    completed = by_status.get("Completed", [])
+    rng.shuffle(completed)
+    n = PLANTED_EACH
+    missing, refunded, mismatched, doubled, fine = (
+        completed[:n], completed[n:2 * n], completed[2 * n:3 * n], completed[3 * n:4 * n], completed[4 * n:])
+    transactions = [txn(row) for row in fine]
+    transactions += [txn(row, "R") for row in refunded]
+    transactions += [txn(row, cents=row.total_cents + 1) for row in mismatched]
+    transactions += [txn(row) for row in doubled] + [txn(row) for row in doubled]
+    expected.update(paid_without_capture=len(missing), refund_not_recorded=len(refunded),
+                    amount_mismatch=len(mismatched), duplicate_capture=len(doubled))
+
+    pending = by_status.get("Pending", [])[:n]
+    transactions += [txn(row) for row in pending]
+    expected["captured_not_recorded"] = len(pending)
+    closed = (by_status.get("Cancelled", []) + by_status.get("Expired", []))[:n]
+    transactions += [txn(row) for row in closed]
+    expected["captured_on_closed"] = len(closed)
+    some = completed[4 * n] if len(completed) > 4 * n else rows[0]
+    transactions += [txn(some, reference=f"Order-{10 ** 9 + i}") for i in range(n)]
+    transactions += [txn(some, reference=f"Gift card {i}") for i in range(n)]
+    expected["unknown_reference"] = 2 * n
+
+    rng.shuffle(transactions)
+    transactions.sort(key=lambda t: t["insDate"][:10])
+    http = requests.Session()
+    for start in range(0, len(transactions), 5000):
+        http.post(f"{stub_url}/stub/transactions", json=transactions[start:start + 5000]).raise_for_status()
+    return expected, len(transactions)
+
+
+def run(label, path, days, page_size, passes):
+    from app import payments
+    from app.controllers.payment import viva
+
+    app = make_app(f"sqlite:///{path}", LOG_LEVEL="WARNING")
+    results = []
+    with app.app_context():
+        viva_transactions = viva.viva_transactions
+        viva.viva_transactions = lambda a, b: viva_transactions(a, b, page_size)
+        try:
+            for name, apply in passes:
+                start = time.perf_counter()
+                stats = payments.reconcile(date.today() - timedelta(days=days), date.today(), apply=apply)
+                seconds = time.perf_counter() - start
+                report(f"{label} {name}", {"seconds": round(seconds, 2),
+                                           "txn_per_s": round(stats["transactions"] / seconds),
+                                           "findings": sum(v for k, v in stats.items()
+                                                           if k not in ("transactions", "corrected")),
+                                           "corrected": stats["corrected"]})
+                results.append(stats)
+        finally:
+            viva.viva_transactions = viva_transactions
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--page-sizes", default="100,500")
+    args = parser.parse_args()
+
+    server, stub_url = start_stubs(latency_ms=args.latency_ms)
+    os.environ.update(stub_environment(stub_url))
+    fd, path = tempfile.mkstemp(prefix="eshop-bench-", suffix=".db")
+    os.close(fd)
+    expected, total = plant(f"sqlite:///{path}", stub_url, args.orders, args.days)
+    print(f"{total} transactions over {args.days} days, stub latency {args.latency_ms} ms")
+
+    ok = True
+    for page_size in (int(size) for size in args.page_sizes.split(",")):
+        fd, copy = tempfile.mkstemp(prefix="eshop-reconcile-", suffix=".db")
+        os.close(fd)
+        shutil.copy(path, copy)
+        first, again, applied = run(f"[page {page_size}]", copy, args.days, page_size,
+                                    [("report", False), ("re-run", False), ("apply", True)])
+        found = Counter({k: v for k, v in first.items() if k not in ("transactions", "corrected")})
+        repeated = sum(v for k, v in again.items() if k not in ("transactions", "corrected"))
+        corrections = expected["captured_not_recorded"] + expected["refund_not_recorded"]
+        if found != expected or repeated or applied["corrected"] != corrections:
+            ok = False
+            print(f"  MISMATCH expected {dict(expected)} found {dict(found)}, "
+                  f"re-run reported {repeated}, corrected {applied['corrected']} of {corrections}")
+        os.remove(copy)
+    print("findings match what was planted" if ok else "findings differ from what was planted")
+    server.shutdown()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
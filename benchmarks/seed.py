@@ -0,0 +1,133 @@
+"""
+Realistic dataset seeder for load tests (into an empty database).
+
+Bulk-inserts users, a two-level category tree, products and a history of
+orders with items (mostly Completed, spread over two years) using core
+INSERTs in chunks, so millions of rows load in minutes.
+
+    python benchmarks/seed.py --database-url postgresql://.../eshop_bench \\
+        --users 5000 --products 100000 --orders 2000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import make_app
+
+PASSWORD = "bench-password"
+# Cheap hash so logging in thousands of virtual users does not dominate a run.
+BENCH_HASH_METHOD = "pbkdf2:sha256:1000"
+
+ORDER_STATUSES = [("Completed", "Paid", 85), ("Cancelled", "Failed", 8), ("Expired", "Failed", 5), ("Pending", "Pending", 2)]
+
+
+def _chunks(total, size):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def seed(db, users=1000, categories=60, products=100000, orders=100000, items_per_order=3,
+         chunk=10000, seed_value=42, log=print):
+    from werkzeug.security import generate_password_hash
+
+    from app.models import Category, Order, OrderItem, Product, User
+
+    rng = random.Random(seed_value)
+    started = time.perf_counter()
+
+    password_hash = generate_password_hash(PASSWORD, method=BENCH_HASH_METHOD)
+    for lo, hi in _chunks(users, chunk):
+        db.session.execute(User.__table__.insert(), [
+            {"email": f"user{i}@bench.local", "name": f"User {i}", "password": password_hash,
+             "role": "user", "auth_version": 1}
+            for i in range(lo, hi)
+        ])
+
+    roots = max(1, categories // 10)
+    db.session.execute(Category.__table__.insert(), [
+        {"id": i + 1, "name": f"Category {i + 1}", "parent_id": None if i < roots else (i % roots) + 1}
+        for i in range(categories)
+    ])
+
+    prices = []
+    for lo, hi in _chunks(products, chunk):
+        rows = []
+        for i in range(lo, hi):
+            price = int(rng.lognormvariate(3.8, 0.8) * 100)
+            prices.append(price)
+            rows.append({
+                "name": f"Bag {i}", "description": "Synthetic product", "price_cents": price,
+                "stock": 1_000_000, "category_id": rng.randint(1, categories),
+            })
+        db.session.execute(Product.__table__.insert(), rows)
+    db.session.commit()
+    log(f"users/categories/products in {time.perf_counter() - started:.1f}s")
+
+    weights = [w for _, _, w in ORDER_STATUSES]
+    now = datetime.utcnow()
+
+    def pick():
+        # Popular products sell more: half the picks follow a long-tailed distribution.
+        if rng.random() < 0.5:
+            return min(products, int(rng.paretovariate(1.2)))
+        return rng.randint(1, products)
+
+    order_id = 0
+    for lo, hi in _chunks(orders, chunk):
+        order_rows, item_rows = [], []
+        for _ in range(lo, hi):
+            order_id += 1
+            status, payment_status, _ = rng.choices(ORDER_STATUSES, weights)[0]
+            lines = {pick(): rng.randint(1, 3) for _ in range(rng.randint(1, items_per_order * 2 - 1))}
+            subtotal = sum(prices[pid - 1] * qty for pid, qty in lines.items())
+            tax = (subtotal * 2000 + 5000) // 10000
+            shipping = 0 if subtotal >= 5000 else 500
+            order_rows.append({
+                "id": order_id, "user_id": rng.randint(1, users), "subtotal_cents": subtotal,
+                "discount_cents": 0, "tax_cents": tax, "shipping_cents": shipping,
+                "total_cents": subtotal + tax + shipping, "status": status, "payment_status": payment_status,
+                "created_at": now - timedelta(seconds=rng.randint(0, 730 * 86400)),
+                "shipping_address": "1 Bench Street", "payment_method": "card",
+                "shipping_phone": "2100000000", "shipping_zipcode": "10431", "shipping_region": "Attica",
+            })
+            item_rows.extend(
+                {"order_id": order_id, "product_id": pid, "quantity": qty, "unit_price_cents": prices[pid - 1]}
+                for pid, qty in lines.items()
+            )
+        db.session.execute(Order.__table__.insert(), order_rows)
+        db.session.execute(OrderItem.__table__.insert(), item_rows)
+        db.session.commit()
+        if hi % (chunk * 10) == 0 or hi == orders:
+            log(f"{hi} orders in {time.perf_counter() - started:.1f}s")
+
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy import text
+
+        db.session.execute(text("SELECT setval('orders_id_seq', (SELECT MAX(id) FROM orders))"))
+        db.session.commit()
+        for table in ("users", "categories", "products", "orders", "order_items"):
+            db.session.execute(text(f"ANALYZE {table}"))
+        db.session.commit()
+    log(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", help="Target database (default: a throwaway SQLite file).")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=60)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--orders", type=int, default=100000)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url, PASSWORD_HASH_METHOD=BENCH_HASH_METHOD)
+    from app.db import db
+
+    with app.app_context():
+        print(f"Seeding {db.engine.url.render_as_string()}")
+        seed(db, args.users, args.categories, args.products, args.orders)
+
+
+if __name__ == "__main__":
+    main()
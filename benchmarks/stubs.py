@@ -0,0 +1,199 @@
+"""
+Local stand-ins for the Viva Payments, ACS and Geniki Taxydromiki APIs.
+
+Answers just enough of each protocol for the shop's code paths, with an
+optional fixed latency to mimic a remote gateway:
+
+    Viva    POST /connect/token, POST /checkout/v2/orders, GET /checkout/v2/orders/<orderCode>
+            (stateId), GET /web/checkout,
+            GET /stub/orders/<orderCode> (the order payload the shop sent, incl. webhookUrl),
+            POST /stub/orders/<orderCode> (merge fields into it, e.g. {"stateId": 3} once paid),
+            GET /checkout/v2/transactions?dateFrom&dateTo&page&pageSize (paginated listing),
+            POST /stub/transactions (add one transaction or a list of them to the listing)
+    ACS     POST /acs           (ACSAlias JSON envelope)
+    Geniki  POST /geniki        (SOAP, dispatched on the SOAPAction header)
+
+    python benchmarks/stubs.py --port 8099 --latency-ms 80
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+GENIKI_NS = "http://voucher.taxydromiki.gr/JobServicesV2.asmx"
+
+_codes = itertools.count(7000000000000000)
+
+
+def _geniki_result(action):
+    if action == "Authenticate":
+        body = "<AuthenticateResult><Result>0</Result><Key>stub-key</Key></AuthenticateResult>"
+    elif action == "CreateGetVoucherPickUpOrder":
+        body = f"<{action}Result><Result>0</Result><Voucher>{next(_codes)}</Voucher></{action}Result>"
+    elif action in ("GetVoucherPickUpStatus", "GetJobStatus"):
+        body = f"<{action}Result>In transit</{action}Result>"
+    elif action == "GetAvailablePickupTimes":
+        body = f"<{action}Result><time>09:00-12:00</time><time>12:00-15:00</time></{action}Result>"
+    else:
+        body = f"<{action}Result>0</{action}Result>"
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+        f'<{action}Response xmlns="{GENIKI_NS}">{body}</{action}Response>'
+        "</soap:Body></soap:Envelope>"
+    )
+
+
+def _acs_result(alias):
+    if alias == "ACS_Price_Lookup":
+        output = {"Total_Amount": "4.50"}
+    elif alias == "ACS_Create_Voucher":
+        output = {"Voucher_No": str(next(_codes))}
+    elif alias == "ACS_TrackingSummary":
+        output = {"ACSValueOutput": [{"shipment_status": "In transit", "delivery_flag": 0}]}
+    else:
+        output = {}
+    return {"ACSExecution_HasError": False, "ACSOutputResponse": output}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive like the real gateways, so clients can reuse connections
+    protocol_version = "HTTP/1.1"
+    # Headers and body in one segment: a reused connection otherwise stalls
+    # ~40 ms per response on Nagle's algorithm and delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    latency = 0.0
+    counts = {}
+    orders = {}
+    transactions = []
+    _lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        if self.latency:
+            time.sleep(self.latency)
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _transactions_page(self, query):
+        date_from = query.get("dateFrom", ["0000-00-00"])[0]
+        date_to = query.get("dateTo", ["9999-99-99"])[0]
+        page = int(query.get("page", ["1"])[0])
+        size = int(query.get("pageSize", ["500"])[0])
+        with self._lock:
+            matching = [t for t in self.transactions if date_from <= t["insDate"][:10] <= date_to]
+        chunk = matching[(page - 1) * size:page * size]
+        return {"transactions": chunk, "page": page, "hasMore": page * size < len(matching)}
+
+    def do_GET(self):
+        self._count(f"GET {self.path.split('?')[0]}")
+        if self.path.startswith("/web/checkout"):
+            return self._send(200, "<html>stub checkout</html>", "text/html")
+        if self.path.startswith("/stub/orders/"):
+            order = self.orders.get(self.path.rsplit("/", 1)[-1])
+            return self._send(200, order) if order else self._send(404, {"error": "unknown order"})
+        if self.path.startswith("/checkout/v2/transactions"):
+            return self._send(200, self._transactions_page(parse_qs(urlsplit(self.path).query)))
+        if self.path.startswith("/checkout/v2/orders/"):
+            code = self.path.split("?")[0].rsplit("/", 1)[-1]
+            order = self.orders.get(code)
+            if order is None:
+                return self._send(404, {"error": "unknown order"})
+            return self._send(200, {"orderCode": int(code), "stateId": order.get("stateId", 0),
+                                    "amount": order.get("amount"), "merchantTrns": order.get("merchantTrns")})
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        self._count(f"POST {path}")
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if path == "/connect/token":
+            return self._send(200, {"access_token": "stub-token", "expires_in": 3600, "token_type": "Bearer"})
+        if path == "/checkout/v2/orders":
+            code = next(_codes)
+            with self._lock:
+                self.orders[str(code)] = json.loads(body or b"{}")
+            return self._send(200, {"orderCode": code})
+        if path.startswith("/stub/orders/"):
+            code = path.rsplit("/", 1)[-1]
+            with self._lock:
+                order = self.orders.setdefault(code, {})
+                order.update(json.loads(body or b"{}"))
+            return self._send(200, order)
+        if path == "/stub/transactions":
+            added = json.loads(body or b"[]")
+            added = added if isinstance(added, list) else [added]
+            for txn in added:
+                txn.setdefault("transactionId", str(uuid.uuid4()))
+                txn.setdefault("statusId", "F")
+                txn.setdefault("insDate", datetime.utcnow().isoformat())
+            with self._lock:
+                self.transactions.extend(added)
+            return self._send(200, {"added": len(added)})
+        if path == "/acs":
+            alias = json.loads(body or b"{}").get("ACSAlias", "")
+            return self._send(200, _acs_result(alias))
+        if path == "/geniki":
+            action = self.headers.get("SOAPAction", "").strip('"').rsplit("/", 1)[-1]
+            return self._send(200, _geniki_result(action), "text/xml; charset=utf-8")
+        self._send(404, {"error": "not found"})
+
+
+def start_stubs(port=0, latency_ms=0):
+    """Serve the stubs on a daemon thread; returns ``(server, base_url)``."""
+    handler = type("Handler", (StubHandler,), {"latency": latency_ms / 1000, "counts": {}, "orders": {}, "transactions": []})
+    server_class = type("Server", (ThreadingHTTPServer,), {"request_queue_size": 128})
+    server = server_class(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def stub_environment(base_url):
+    """Settings that point the app's gateway clients at the stubs."""
+    return {
+        "VIVA_ACCOUNTS_URL": base_url,
+        "VIVA_API_URL": base_url,
+        "VIVA_CHECKOUT_URL": base_url,
+        "ACS_BASE_URL": f"{base_url}/acs",
+        "GENIKI_BASE_URL": f"{base_url}/geniki",
+        "VIVA_CLIENT_ID": "stub",
+        "VIVA_CLIENT_SECRET": "stub",
+        "VIVA_WEBHOOK_KEY": "stub-webhook-key",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    server, url = start_stubs(args.port, args.latency_ms)
+    print(f"Stubs listening on {url}")
+    for key, value in stub_environment(url).items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
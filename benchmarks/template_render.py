@@ -0,0 +1,100 @@
+"""
+Cold versus warm template render benchmark.
+
+First times loading every template three ways: compiled from source (a
+fresh worker without the bytecode cache), loaded from the on-disk bytecode
+cache (a fresh worker with it) and from the environment's in-memory cache
+(a warm worker). Then requests real pages from freshly created apps and
+compares each worker's first request with the following ones, with and
+without the bytecode cache.
+
+    python benchmarks/template_render.py --workers 5 --requests 20
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from common import make_app, report, timed
+
+PAGES = ("/", "/products", "/categories", "/cart", "/orders")
+
+
+def load_times(app, names, repeat):
+    env = app.jinja_env
+    bytecode_cache = env.bytecode_cache
+
+    def load_all(clear):
+        for name in names:
+            if clear:
+                env.cache.clear()
+            env.get_template(name)
+
+    env.bytecode_cache = None
+    report("load all (compile from source)", timed(lambda: load_all(True), repeat=repeat))
+    env.bytecode_cache = bytecode_cache
+    load_all(True)  # fill the disk cache
+    report("load all (bytecode cache)", timed(lambda: load_all(True), repeat=repeat))
+    report("load all (in memory)", timed(lambda: load_all(False), repeat=repeat))
+
+
+def request_ms(client, page):
+    # Wall time of the whole request: Server-Timing only covers rendering, and
+    # the page template itself is compiled before rendering starts.
+    start = time.perf_counter()
+    assert client.get(page).status_code == 200, page
+    return (time.perf_counter() - start) * 1000
+
+
+def page_times(database_url, cache_dir, workers, requests):
+    from seed import BENCH_HASH_METHOD, PASSWORD
+
+    cold, warm = {page: [] for page in PAGES}, {page: [] for page in PAGES}
+    for _ in range(workers):
+        # A new app has a new Jinja environment, like a restarted worker
+        app = make_app(database_url, PASSWORD_HASH_METHOD=BENCH_HASH_METHOD, TEMPLATE_CACHE_DIR=cache_dir,
+                       QUERY_BUDGET_ENFORCE=False)
+        client = app.test_client()
+        client.post("/login", data={"email": "user1@bench.local", "password": PASSWORD})
+        for page in PAGES:
+            cold[page].append(request_ms(client, page))
+            warm[page].extend(request_ms(client, page) for _ in range(requests))
+    for page in PAGES:
+        label = "bytecode cache" if cache_dir else "no cache"
+        report(f"[{label}] {page}", {
+            "cold_median_ms": round(statistics.median(cold[page]), 3),
+            "warm_median_ms": round(statistics.median(warm[page]), 3),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=5, help="Fresh apps (cold starts) per configuration.")
+    parser.add_argument("--requests", type=int, default=20, help="Warm requests per page and app.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from seed import seed
+
+    fd, path = tempfile.mkstemp(prefix="eshop-bench-", suffix=".db")
+    os.close(fd)
+    database_url = f"sqlite:///{path}"
+    cache_dir = tempfile.mkdtemp(prefix="eshop-jinja-")
+    app = make_app(database_url, TEMPLATE_CACHE_DIR=cache_dir)
+    from app.db import db
+    from app.templating import precompile
+
+    with app.app_context():
+        seed(db, users=10, categories=20, products=500, orders=200, log=lambda *a: None)
+    names = app.jinja_env.list_templates(filter_func=lambda n: n.endswith(".html"))
+    print(f"{len(names)} templates")
+    load_times(app, names, args.repeat)
+
+    page_times(database_url, False, args.workers, args.requests)
+    precompile(app)
+    page_times(database_url, cache_dir, args.workers, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""product weight and dimensions
+
+Revision ID: 0b6e4d2f8a19
+Revises: f2a8c6d41b07
+Create Date: 2026-10-19 18:58:12.406195
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e4d2f8a19'
+down_revision = 'f2a8c6d41b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('weight_grams', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('length_mm', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('width_mm', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('height_mm', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('height_mm')
+        batch_op.drop_column('width_mm')
+        batch_op.drop_column('length_mm')
+        batch_op.drop_column('weight_grams')
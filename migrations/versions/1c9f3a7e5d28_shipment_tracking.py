@@ -0,0 +1,48 @@
+"""shipment tracking
+
+Revision ID: 1c9f3a7e5d28
+Revises: 0b6e4d2f8a19
+Create Date: 2026-10-19 19:24:37.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c9f3a7e5d28'
+down_revision = '0b6e4d2f8a19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('shipment_tracking',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('carrier', sa.String(length=20), nullable=False),
+    sa.Column('voucher_number', sa.String(length=64), nullable=False),
+    sa.Column('job_id', sa.String(length=64), nullable=True),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=100), nullable=True),
+    sa.Column('job_status', sa.String(length=100), nullable=True),
+    sa.Column('is_open', sa.Boolean(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('polled_at', sa.DateTime(), nullable=True),
+    sa.Column('changed_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('carrier', 'voucher_number', name='uq_shipment_tracking_voucher')
+    )
+    with op.batch_alter_table('shipment_tracking', schema=None) as batch_op:
+        batch_op.create_index('ix_shipment_tracking_open_polled', ['is_open', 'polled_at'], unique=False)
+        batch_op.create_index('ix_shipment_tracking_job', ['carrier', 'job_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_shipment_tracking_order_id'), ['order_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('shipment_tracking', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_shipment_tracking_order_id'))
+        batch_op.drop_index('ix_shipment_tracking_job')
+        batch_op.drop_index('ix_shipment_tracking_open_polled')
+
+    op.drop_table('shipment_tracking')
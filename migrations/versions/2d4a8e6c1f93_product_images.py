@@ -0,0 +1,42 @@
+"""product images
+
+Revision ID: 2d4a8e6c1f93
+Revises: 1c9f3a7e5d28
+Create Date: 2026-10-19 19:51:08.273640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d4a8e6c1f93'
+down_revision = '1c9f3a7e5d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_images',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('original', sa.String(length=255), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('alt', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('variants', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.create_index('ix_product_images_product_position', ['product_id', 'position'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_images_product_position')
+
+    op.drop_table('product_images')
@@ -0,0 +1,36 @@
+"""category tree and products.category_id index
+
+Revision ID: 3b8e1f6c2a47
+Revises: ee53204760ae
+Create Date: 2026-10-19 09:12:31.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e1f6c2a47'
+down_revision = 'ee53204760ae'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_categories_parent_id'), ['parent_id'], unique=False)
+        batch_op.create_foreign_key('fk_categories_parent_id', 'categories', ['parent_id'], ['id'])
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_products_category_id'), ['category_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_products_category_id'))
+
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_categories_parent_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_categories_parent_id'))
+        batch_op.drop_column('parent_id')
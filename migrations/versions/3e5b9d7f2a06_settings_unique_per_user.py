@@ -0,0 +1,65 @@
+"""settings unique per user
+
+Revision ID: 3e5b9d7f2a06
+Revises: 2d4a8e6c1f93
+Create Date: 2026-10-19 20:42:17.905318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e5b9d7f2a06'
+down_revision = '2d4a8e6c1f93'
+branch_labels = None
+depends_on = None
+
+# The old unique=True on settings.key was never named explicitly; this names
+# it the same way on SQLite's reflected copy, and Postgres's default name is
+# looked up below.
+NAMING = {"uq": "uq_%(table_name)s_%(column_0_name)s"}
+
+
+def _key_unique_name(bind):
+    for constraint in sa.inspect(bind).get_unique_constraints('settings'):
+        if constraint['column_names'] == ['key']:
+            return constraint['name'] or 'uq_settings_key'
+    return None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('settings'):
+        # Older databases only got this table from db.create_all()
+        op.create_table('settings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('key', sa.String(length=100), nullable=False),
+        sa.Column('value', sa.String(length=500), nullable=False),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'key', name='uq_settings_user_key')
+        )
+    else:
+        old_unique = _key_unique_name(bind)
+        with op.batch_alter_table('settings', schema=None, naming_convention=NAMING) as batch_op:
+            if old_unique:
+                batch_op.drop_constraint(old_unique, type_='unique')
+            batch_op.create_unique_constraint('uq_settings_user_key', ['user_id', 'key'])
+
+    with op.batch_alter_table('settings', schema=None) as batch_op:
+        batch_op.create_index('uq_settings_global_key', ['key'], unique=True,
+                              postgresql_where=sa.text('user_id IS NULL'),
+                              sqlite_where=sa.text('user_id IS NULL'))
+
+
+def downgrade():
+    # Fails if two users override the same key; remove the duplicates first.
+    with op.batch_alter_table('settings', schema=None) as batch_op:
+        batch_op.drop_index('uq_settings_global_key')
+        batch_op.drop_constraint('uq_settings_user_key', type_='unique')
+        batch_op.create_unique_constraint('uq_settings_key', ['key'])
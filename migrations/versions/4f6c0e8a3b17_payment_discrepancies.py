@@ -0,0 +1,48 @@
+"""payment discrepancies
+
+Revision ID: 4f6c0e8a3b17
+Revises: 3e5b9d7f2a06
+Create Date: 2026-10-19 22:14:37.509182
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f6c0e8a3b17'
+down_revision = '3e5b9d7f2a06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payment_discrepancies',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=40), nullable=False),
+    sa.Column('reference', sa.String(length=64), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('transaction_id', sa.String(length=64), nullable=True),
+    sa.Column('merchant_reference', sa.String(length=255), nullable=True),
+    sa.Column('order_status', sa.String(length=50), nullable=True),
+    sa.Column('payment_status', sa.String(length=50), nullable=True),
+    sa.Column('viva_status', sa.String(length=10), nullable=True),
+    sa.Column('expected_cents', sa.Integer(), nullable=True),
+    sa.Column('actual_cents', sa.Integer(), nullable=True),
+    sa.Column('corrected', sa.Boolean(), nullable=False),
+    sa.Column('detected_at', sa.DateTime(), nullable=False),
+    sa.Column('resolved_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'reference', name='uq_payment_discrepancies_kind_reference')
+    )
+    with op.batch_alter_table('payment_discrepancies', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payment_discrepancies_order_id'), ['order_id'], unique=False)
+        batch_op.create_index('ix_payment_discrepancies_resolved_detected', ['resolved_at', 'detected_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment_discrepancies', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_discrepancies_resolved_detected')
+        batch_op.drop_index(batch_op.f('ix_payment_discrepancies_order_id'))
+
+    op.drop_table('payment_discrepancies')
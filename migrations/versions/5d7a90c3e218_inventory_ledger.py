@@ -0,0 +1,78 @@
+"""inventory ledger, snapshots and low-stock alerts
+
+Revision ID: 5d7a90c3e218
+Revises: 9c41d2e7b5a0
+Create Date: 2026-10-19 11:26:05.537112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7a90c3e218'
+down_revision = '9c41d2e7b5a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_movements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('delta', sa.Integer(), nullable=False),
+    sa.Column('stock_after', sa.Integer(), nullable=False),
+    sa.Column('reason', sa.String(length=20), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.create_index('ix_stock_movements_product_created', ['product_id', 'created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_movements_created_at'), ['created_at'], unique=False)
+
+    op.create_table('inventory_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=False),
+    sa.Column('last_movement_id', sa.Integer(), nullable=False),
+    sa.Column('product_count', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('inventory_snapshots', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_inventory_snapshots_taken_at'), ['taken_at'], unique=False)
+
+    op.create_table('low_stock_alerts',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.Column('raised_at', sa.DateTime(), nullable=False),
+    sa.Column('resolved_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    with op.batch_alter_table('low_stock_alerts', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_low_stock_alerts_resolved_at'), ['resolved_at'], unique=False)
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('ix_products_low_stock', ['stock'], unique=False,
+                              postgresql_where=sa.text('stock <= 5'), sqlite_where=sa.text('stock <= 5'))
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_low_stock')
+
+    with op.batch_alter_table('low_stock_alerts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_low_stock_alerts_resolved_at'))
+    op.drop_table('low_stock_alerts')
+
+    with op.batch_alter_table('inventory_snapshots', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_inventory_snapshots_taken_at'))
+    op.drop_table('inventory_snapshots')
+
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_movements_created_at'))
+        batch_op.drop_index('ix_stock_movements_product_created')
+    op.drop_table('stock_movements')
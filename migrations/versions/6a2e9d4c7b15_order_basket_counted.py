@@ -0,0 +1,38 @@
+"""order basket counted flag
+
+Revision ID: 6a2e9d4c7b15
+Revises: 4f6c0e8a3b17
+Create Date: 2026-10-20 09:41:26.318054
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2e9d4c7b15'
+down_revision = '4f6c0e8a3b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('basket_counted', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    # Orders up to the old id watermark are already in the matrix
+    op.execute(
+        "UPDATE orders SET basket_counted = true "
+        "WHERE id <= (SELECT COALESCE(MAX(last_order_id), 0) FROM recommendation_runs)"
+    )
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_basket_uncounted', ['id'], unique=False,
+                              postgresql_where=sa.text('NOT basket_counted'),
+                              sqlite_where=sa.text('NOT basket_counted'))
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_basket_uncounted')
+        batch_op.drop_column('basket_counted')
@@ -0,0 +1,26 @@
+"""keep released promotion redemptions
+
+Revision ID: 7b3f1a8e5c62
+Revises: 6a2e9d4c7b15
+Create Date: 2026-10-20 10:27:53.940712
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3f1a8e5c62'
+down_revision = '6a2e9d4c7b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('promotion_redemptions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('released_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('promotion_redemptions', schema=None) as batch_op:
+        batch_op.drop_column('released_at')
@@ -0,0 +1,26 @@
+"""order shipping carrier
+
+Revision ID: 8d4b2f6a9e31
+Revises: 7b3f1a8e5c62
+Create Date: 2026-10-20 11:12:08.574129
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4b2f6a9e31'
+down_revision = '7b3f1a8e5c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('shipping_carrier', sa.String(length=20), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('shipping_carrier')
@@ -0,0 +1,52 @@
+"""product recommendations
+
+Revision ID: 9c41d2e7b5a0
+Revises: 3b8e1f6c2a47
+Create Date: 2026-10-19 10:03:47.881260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c41d2e7b5a0'
+down_revision = '3b8e1f6c2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_recommendations',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('bought_together', sa.String(length=255), nullable=False),
+    sa.Column('related', sa.String(length=255), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_table('product_cooccurrence',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('other_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['other_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id', 'other_id')
+    )
+    op.create_table('recommendation_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('mode', sa.String(length=20), nullable=False),
+    sa.Column('last_order_id', sa.Integer(), nullable=False),
+    sa.Column('orders_scanned', sa.Integer(), nullable=False),
+    sa.Column('products_updated', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('recommendation_runs')
+    op.drop_table('product_cooccurrence')
+    op.drop_table('product_recommendations')
@@ -0,0 +1,73 @@
+"""money as integer cents
+
+Revision ID: a6f0b4c81d93
+Revises: 5d7a90c3e218
+Create Date: 2026-10-19 13:41:52.316904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f0b4c81d93'
+down_revision = '5d7a90c3e218'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('price_cents', sa.Integer(), nullable=True))
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('subtotal_cents', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('tax_cents', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('shipping_cents', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('total_cents', sa.Integer(), nullable=True))
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_price_cents', sa.Integer(), nullable=True))
+
+    # Existing orders predate tax/shipping: their whole amount becomes the subtotal.
+    op.execute("UPDATE products SET price_cents = CAST(ROUND(price * 100) AS INTEGER)")
+    op.execute("UPDATE order_items SET unit_price_cents = CAST(ROUND(unit_price * 100) AS INTEGER)")
+    op.execute(
+        "UPDATE orders SET total_cents = CAST(ROUND(total_amount * 100) AS INTEGER), "
+        "subtotal_cents = CAST(ROUND(total_amount * 100) AS INTEGER), tax_cents = 0, shipping_cents = 0"
+    )
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.alter_column('price_cents', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('price')
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        for column in ('subtotal_cents', 'tax_cents', 'shipping_cents', 'total_cents'):
+            batch_op.alter_column(column, existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('total_amount')
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.alter_column('unit_price_cents', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('unit_price')
+
+
+def downgrade():
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_price', sa.Float(), nullable=True))
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('total_amount', sa.Float(), nullable=True))
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('price', sa.Float(), nullable=True))
+
+    op.execute("UPDATE products SET price = price_cents / 100.0")
+    op.execute("UPDATE order_items SET unit_price = unit_price_cents / 100.0")
+    op.execute("UPDATE orders SET total_amount = total_cents / 100.0")
+
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.alter_column('unit_price', existing_type=sa.Float(), nullable=False)
+        batch_op.drop_column('unit_price_cents')
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('total_amount', existing_type=sa.Float(), nullable=False)
+        batch_op.drop_column('total_cents')
+        batch_op.drop_column('shipping_cents')
+        batch_op.drop_column('tax_cents')
+        batch_op.drop_column('subtotal_cents')
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.alter_column('price', existing_type=sa.Float(), nullable=False)
+        batch_op.drop_column('price_cents')
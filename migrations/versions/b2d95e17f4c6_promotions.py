@@ -0,0 +1,67 @@
+"""promotions and coupon redemptions
+
+Revision ID: b2d95e17f4c6
+Revises: a6f0b4c81d93
+Create Date: 2026-10-19 15:08:19.662034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d95e17f4c6'
+down_revision = 'a6f0b4c81d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('promotions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('code', sa.String(length=50), nullable=True),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.Column('scope', sa.String(length=20), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=True),
+    sa.Column('min_subtotal_cents', sa.Integer(), nullable=False),
+    sa.Column('usage_limit', sa.Integer(), nullable=True),
+    sa.Column('used_count', sa.Integer(), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.Column('starts_at', sa.DateTime(), nullable=True),
+    sa.Column('ends_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code')
+    )
+    op.create_table('promotion_redemptions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('promotion_id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('discount_cents', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['promotion_id'], ['promotions.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('promotion_redemptions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_promotion_redemptions_order_id'), ['order_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_promotion_redemptions_promotion_id'), ['promotion_id'], unique=False)
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('discount_cents', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('discount_cents')
+
+    with op.batch_alter_table('promotion_redemptions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_promotion_redemptions_promotion_id'))
+        batch_op.drop_index(batch_op.f('ix_promotion_redemptions_order_id'))
+    op.drop_table('promotion_redemptions')
+    op.drop_table('promotions')
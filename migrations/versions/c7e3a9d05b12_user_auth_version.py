@@ -0,0 +1,26 @@
+"""user auth_version
+
+Revision ID: c7e3a9d05b12
+Revises: b2d95e17f4c6
+Create Date: 2026-10-19 16:22:40.118357
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e3a9d05b12'
+down_revision = 'b2d95e17f4c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('auth_version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('auth_version')
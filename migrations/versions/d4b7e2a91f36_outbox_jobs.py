@@ -0,0 +1,42 @@
+"""outbox jobs
+
+Revision ID: d4b7e2a91f36
+Revises: c7e3a9d05b12
+Create Date: 2026-10-19 17:05:12.407733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b7e2a91f36'
+down_revision = 'c7e3a9d05b12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('outbox_jobs', schema=None) as batch_op:
+        batch_op.create_index('ix_outbox_jobs_status_run_after', ['status', 'run_after'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('outbox_jobs', schema=None) as batch_op:
+        batch_op.drop_index('ix_outbox_jobs_status_run_after')
+
+    op.drop_table('outbox_jobs')
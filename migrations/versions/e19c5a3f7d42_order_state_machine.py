@@ -0,0 +1,44 @@
+"""order status history and (status, created_at) index
+
+Revision ID: e19c5a3f7d42
+Revises: d4b7e2a91f36
+Create Date: 2026-10-19 17:48:31.552910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e19c5a3f7d42'
+down_revision = 'd4b7e2a91f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('order_status_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('from_status', sa.String(length=50), nullable=True),
+    sa.Column('to_status', sa.String(length=50), nullable=False),
+    sa.Column('reason', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('order_status_history', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_status_history_order_id'), ['order_id'], unique=False)
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_status_created', ['status', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_status_created')
+
+    with op.batch_alter_table('order_status_history', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_status_history_order_id'))
+
+    op.drop_table('order_status_history')
@@ -0,0 +1,48 @@
+"""archived orders (partitioned by month on PostgreSQL) and per-user order index
+
+Revision ID: f2a8c6d41b07
+Revises: e19c5a3f7d42
+Create Date: 2026-10-19 18:26:03.914462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8c6d41b07'
+down_revision = 'e19c5a3f7d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Monthly partitions are created on demand by `flask archive orders`.
+    op.create_table('archived_orders',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('payment_status', sa.String(length=50), nullable=True),
+    sa.Column('total_cents', sa.Integer(), nullable=False),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    with op.batch_alter_table('archived_orders', schema=None) as batch_op:
+        batch_op.create_index('ix_archived_orders_user_created', ['user_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_user_created', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_user_created')
+
+    with op.batch_alter_table('archived_orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_archived_orders_user_created')
+
+    op.drop_table('archived_orders')
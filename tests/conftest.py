@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app  # noqa: E402
+from app.db import db  # noqa: E402
+from benchmarks.stubs import start_stubs  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stubs():
+    """Viva, ACS and Geniki stand-ins on a local port (benchmarks/stubs.py)."""
+    server, base_url = start_stubs()
+    yield base_url
+    server.shutdown()
+
+
+@pytest.fixture
+def app(tmp_path, stubs):
+    """
+    The real application on a throwaway SQLite database with empty caches,
+    so every test sees the cold path that query budgets have to cover.
+    """
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'shop.db'}",
+        "CACHE_URL": "memory://",
+        "RATELIMIT_STORAGE_URL": "memory://",
+        "TEMPLATE_CACHE_DIR": False,
+        "VIVA_ACCOUNTS_URL": stubs,
+        "VIVA_API_URL": stubs,
+        "VIVA_CHECKOUT_URL": stubs,
+    })
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session["_user_id"] = f"{user_id}:1"
+        session["_fresh"] = True
@@ -0,0 +1,196 @@
+"""
+The routes most exposed to N+1 queries, run at their declared budgets
+(QUERY_BUDGET_ENFORCE follows TESTING, so going over fails the request)
+with enough rows that a per-row query would blow through them.
+"""
+import json
+
+import pytest
+
+from app import inventory, querycount
+from app.controllers.delivery import delivery_acs
+from app.db import db
+from app.models import (
+    Category, Order, OrderItem, OrderStatus, PaymentStatus, Product, ProductImage, Promotion, Setting, User
+)
+
+from conftest import login
+
+PRODUCTS = 24
+ORDERS = 8
+ITEMS_PER_ORDER = 4
+CART_LINES = 6
+
+
+@pytest.fixture
+def shop(app):
+    """A catalogue with images, a customer with a history of orders, an admin and active promotions."""
+    with app.app_context():
+        bags = Category(name="Bags")
+        db.session.add(bags)
+        db.session.flush()
+        totes = Category(name="Totes", parent_id=bags.id)
+        db.session.add(totes)
+        db.session.flush()
+        products = [
+            Product(name=f"Product {i:02}", price_cents=1000 + 100 * i, stock=3 if i % 4 == 0 else 50,
+                    category_id=totes.id if i % 2 else bags.id, weight_grams=400)
+            for i in range(PRODUCTS)
+        ]
+        db.session.add_all(products)
+        customer = User(email="customer@example.com", name="Customer")
+        admin = User(email="admin@example.com", name="Admin", role="admin")
+        for user in (customer, admin):
+            user.set_password("password1")
+        db.session.add_all([customer, admin])
+        db.session.flush()
+
+        variants = json.dumps({"320": {"jpeg": "v/320.jpg", "webp": "v/320.webp"},
+                               "640": {"jpeg": "v/640.jpg", "webp": "v/640.webp"}})
+        db.session.add_all(
+            ProductImage(product_id=product.id, position=position, original=f"o/{product.id}-{position}.jpg",
+                         width=1200, height=900, status="ready", variants=variants)
+            for product in products for position in range(2)
+        )
+        orders = [
+            Order(user_id=customer.id, status=OrderStatus.COMPLETED.value, payment_status=PaymentStatus.PAID.value,
+                  total_cents=5000, shipping_carrier="acs", shipping_address="Egnatia 1", shipping_phone="2310000000",
+                  shipping_zipcode="54630", shipping_region="Thessaloniki")
+            for _ in range(ORDERS)
+        ]
+        db.session.add_all(orders)
+        db.session.flush()
+        db.session.add_all(
+            OrderItem(order_id=order.id, product_id=products[(n + k) % PRODUCTS].id, quantity=1, unit_price_cents=1000)
+            for n, order in enumerate(orders) for k in range(ITEMS_PER_ORDER)
+        )
+        db.session.add_all([
+            Promotion(name="10% off totes", kind="percent", value=1000, scope="category", target_id=totes.id),
+            Promotion(name="5 off", code="SAVE5", kind="fixed", value=500, scope="cart"),
+            Setting(key="VIVA_CLIENT_ID", value="stub"),
+            Setting(key="VIVA_CLIENT_SECRET", value="stub"),
+        ])
+        db.session.commit()
+        inventory.sync_alerts()
+        yield {
+            "customer": customer.id,
+            "admin": admin.id,
+            "products": [product.id for product in products],
+            "order": orders[0].id,
+        }
+
+
+@pytest.fixture
+def cart(client, shop):
+    login(client, shop["customer"])
+    with client.session_transaction() as session:
+        session["cart"] = [{"product_id": product_id, "quantity": 1} for product_id in shop["products"][1:CART_LINES + 1]]
+        session["coupon"] = "SAVE5"
+        session["delivery_info"] = {"address": "Egnatia 1", "phone": "2310000000", "zipcode": "54630",
+                                    "region": "Thessaloniki"}
+        session["delivery"] = {"carrier": "acs"}
+    return client
+
+
+def assert_budgeted(app, endpoint):
+    # The declared budget, not an override, is what these tests hold the route to
+    with app.app_context():
+        assert not app.config["QUERY_BUDGETS"]
+        assert querycount.budget_for(endpoint) is not None
+
+
+def test_view_cart(app, cart):
+    assert_budgeted(app, "shop.view_cart")
+    response = cart.get("/cart")
+    assert response.status_code == 200
+    assert b"Product 06" in response.data
+
+
+def test_api_cart(app, cart):
+    assert_budgeted(app, "api.cart")
+    response = cart.get("/api/v1/cart")
+    assert response.status_code == 200
+    assert len(response.get_json()["lines"]) == CART_LINES
+
+
+def test_checkout(app, cart, shop):
+    assert_budgeted(app, "payment.checkout")
+    response = cart.post("/payment/checkout", data={"payment_method": "card"})
+    assert response.status_code == 302
+    assert "/web/checkout" in response.headers["Location"]
+    with app.app_context():
+        order = Order.query.order_by(Order.id.desc()).first()
+        assert len(order.items) == CART_LINES
+        assert order.discount_cents > 0
+
+
+def test_products(app, client, shop):
+    assert_budgeted(app, "shop.products")
+    response = client.get("/products")
+    assert response.status_code == 200
+    assert response.data.count(b"v/320.jpg") >= 9
+
+
+def test_orders(app, client, shop):
+    assert_budgeted(app, "shop.orders")
+    login(client, shop["customer"])
+    response = client.get("/orders")
+    assert response.status_code == 200
+    assert response.data.count(b"Order again") == ORDERS
+
+
+def test_api_orders(app, client, shop):
+    assert_budgeted(app, "api.orders")
+    login(client, shop["customer"])
+    response = client.get("/api/v1/orders")
+    assert response.status_code == 200
+    assert len(response.get_json()["data"]) == ORDERS
+
+
+def test_api_order(app, client, shop):
+    assert_budgeted(app, "api.order")
+    login(client, shop["customer"])
+    response = client.get(f"/api/v1/orders/{shop['order']}")
+    assert response.status_code == 200
+    assert len(response.get_json()["items"]) == ITEMS_PER_ORDER
+
+
+def test_admin_dashboard(app, client, shop):
+    assert_budgeted(app, "shop.dashboard")
+    login(client, shop["admin"])
+    response = client.get("/dashboard")
+    assert response.status_code == 200
+    assert b"Product 04" in response.data
+
+
+def test_create_voucher(app, client, shop, stubs, monkeypatch):
+    # The order's items are read lazily (Order.items) to weigh the shipment
+    assert_budgeted(app, "delivery.create_voucher")
+    monkeypatch.setattr(delivery_acs, "ACS_BASE_URL", f"{stubs}/acs")
+    login(client, shop["customer"])
+    with client.session_transaction() as session:
+        session["order_id"] = shop["order"]
+    response = client.post("/delivery/create-voucher")
+    assert response.status_code == 200
+    assert response.get_json()["message"] == "Voucher created"
+
+
+def test_api_cart_batch(app, cart, shop):
+    assert_budgeted(app, "api.cart_batch")
+    operations = [{"op": "add", "product_id": product_id, "quantity": 1} for product_id in shop["products"][8:14]]
+    response = cart.post("/api/v1/cart/batch", json={"operations": operations})
+    assert response.status_code == 200
+    assert len(response.get_json()["lines"]) == CART_LINES + 6
+
+
+def test_api_reorder(app, cart, shop):
+    assert_budgeted(app, "api.cart_reorder")
+    response = cart.post(f"/api/v1/cart/reorder/{shop['order']}")
+    assert response.status_code == 200
+    assert not response.get_json()["skipped"]
+
+
+def test_reorder(app, cart, shop):
+    assert_budgeted(app, "shop.reorder")
+    response = cart.post(f"/orders/{shop['order']}/reorder")
+    assert response.status_code == 302
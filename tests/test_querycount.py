@@ -0,0 +1,39 @@
+import pytest
+
+from app import tracking
+from app.db import db
+from app.querycount import QueryBudgetExceeded
+
+
+@pytest.fixture(autouse=True)
+def voucher(app):
+    with app.app_context():
+        tracking.register("acs", "7000000000000001", order_id=1)
+        db.session.commit()
+
+
+def voucher_status(client):
+    return client.get("/delivery/voucher-status", query_string={"carrier": "acs", "voucher_number": "7000000000000001"})
+
+
+def test_budget_met(app):
+    # One lookup in the tracking table for an anonymous client: exactly at budget
+    app.config["QUERY_BUDGETS"] = {"delivery.get_voucher_status": 1}
+    response = voucher_status(app.test_client())
+    assert response.status_code == 200
+
+
+def test_declared_budget(app):
+    assert voucher_status(app.test_client()).status_code == 200
+
+
+def test_budget_exceeded(app):
+    app.config["QUERY_BUDGETS"] = {"delivery.get_voucher_status": 0}
+    with pytest.raises(QueryBudgetExceeded, match="ran 1 queries, budget is 0"):
+        voucher_status(app.test_client())
+
+
+def test_budget_not_enforced(app):
+    app.config["QUERY_BUDGETS"] = {"delivery.get_voucher_status": 0}
+    app.config["QUERY_BUDGET_ENFORCE"] = False
+    assert voucher_status(app.test_client()).status_code == 200